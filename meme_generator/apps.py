@@ -6,5 +6,6 @@ class MemeAppConfig(AppConfig):
     name = 'meme_generator'
 
     def ready(self):
+        from . import signals  # noqa: F401
         from django.core.management import call_command
         call_command('populate_templates')
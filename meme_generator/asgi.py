@@ -8,9 +8,39 @@ https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 """
 
 import os
+import time
 
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'meme_generator.settings')
 
-application = get_asgi_application()
+started = time.perf_counter()
+django_application = get_asgi_application()
+setup = time.perf_counter() - started
+
+# Imported after Django is set up
+from asgiref.sync import sync_to_async  # noqa: E402
+from meme_generator.events import stream_app  # noqa: E402
+from meme_generator.warmup import startup  # noqa: E402
+
+
+async def lifespan(receive, send):
+    # The server only accepts connections after startup completes. Warm-up runs
+    # in the thread that serves the sync views, which then reuse its connections.
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await sync_to_async(startup)(setup)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    # Long-lived event streams skip the Django stack, see meme_generator.events
+    if scope['type'] == 'http' and scope['path'] == '/api/stream/':
+        return await stream_app(scope, receive, send)
+    return await django_application(scope, receive, send)
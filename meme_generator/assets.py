@@ -0,0 +1,105 @@
+"""Template images stored once as pre-decoded rasters.
+
+``ingest`` decodes a template image a single time and writes its pixels to
+``TEMPLATE_ASSET_DIR`` as a raw raster, named by the hash of the source
+image. ``open_raster`` maps that file read-only with ``mmap`` and wraps it in
+a Pillow image without copying, so renders neither fetch nor decode the
+template, and every worker process shares the same pages through the OS
+page cache.
+
+Pixels are stored as RGBX (4 bytes per pixel) because that is Pillow's
+in-memory layout for RGB images; ``Image.frombuffer`` can only share memory
+for layouts it uses itself.
+"""
+import hashlib
+import io
+import mmap
+import struct
+from functools import lru_cache
+from pathlib import Path
+
+from django.conf import settings
+
+from .snapshots import write_atomic
+
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover - optional dependency
+    Image = None
+
+MAGIC = b'MEMERAW1'
+HEADER = struct.Struct('<8sII')  # magic, width, height
+MODE = 'RGBX'
+
+
+class AssetError(Exception):
+    """The template image is missing, too large or cannot be decoded."""
+
+
+def asset_key(source):
+    return hashlib.sha256(source).hexdigest()
+
+
+def _path(key):
+    return Path(settings.TEMPLATE_ASSET_DIR) / key[:2] / f'{key}.raw'
+
+
+def has_asset(key):
+    return _path(key).exists()
+
+
+def ingest(source):
+    """Store the encoded image ``source`` as a raster, once. Returns its key."""
+    if len(source) > settings.RENDER_MAX_SOURCE_BYTES:
+        raise AssetError(f'The image is larger than {settings.RENDER_MAX_SOURCE_BYTES} bytes.')
+    key = asset_key(source)
+    if has_asset(key):
+        return key
+
+    try:
+        image = Image.open(io.BytesIO(source))
+        # Checked on the header, before decoding: a few MB of PNG can expand
+        # to a raster of hundreds of MB
+        if image.width * image.height > settings.TEMPLATE_MAX_PIXELS:
+            raise AssetError(f'The image is larger than {settings.TEMPLATE_MAX_PIXELS} pixels.')
+        image = image.convert(MODE)
+    except (OSError, ValueError, Image.DecompressionBombError) as exc:
+        raise AssetError(f'The image cannot be decoded: {exc}')
+
+    path = _path(key)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    write_atomic(path, HEADER.pack(MAGIC, image.width, image.height) + image.tobytes())
+    return key
+
+
+def ingest_file(path):
+    """Ingest the image file at ``path``. Returns its key."""
+    try:
+        source = Path(path).read_bytes()
+    except OSError as exc:
+        raise AssetError(f'Could not read {path}: {exc}')
+    return ingest(source)
+
+
+@lru_cache(maxsize=64)
+def open_raster(key):
+    """Read-only image backed by the memory-mapped raster of ``key``.
+
+    Mappings stay open for the life of the process (up to 64 templates), so
+    repeated renders of a template cost no system calls.
+    """
+    try:
+        with open(_path(key), 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError) as exc:  # ValueError: empty files cannot be mapped
+        raise AssetError(f'Template asset {key} is not available: {exc}')
+
+    try:
+        magic, width, height = HEADER.unpack_from(mapped)
+        valid = magic == MAGIC and len(mapped) == HEADER.size + width * height * 4
+    except struct.error:  # shorter than the header
+        valid = False
+    if not valid:
+        mapped.close()
+        raise AssetError(f'Template asset {key} is corrupt.')
+    return Image.frombuffer(MODE, (width, height), memoryview(mapped)[HEADER.size:], 'raw', MODE, 0, 1)
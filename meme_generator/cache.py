@@ -0,0 +1,62 @@
+from django.conf import settings
+from django.core.cache import cache
+from .compression import precompress
+from .metrics import record_cache
+from .renderers import FastJSONRenderer
+from .singleflight import expire, get_or_compute
+
+TEMPLATES_CACHE_KEY = 'templates:catalogue'
+TOP_MEMES_CACHE_KEY = 'memes:top'
+MEME_COUNT_CACHE_KEY = 'memes:count'
+
+
+def meme_cache_key(meme_id):
+    return f'meme:v{settings.MEME_REPRESENTATION_VERSION}:{meme_id}'
+
+
+def meme_etag(meme_id, fields=None):
+    """Strong ETag for a meme; memes never change, so id + version is enough.
+
+    Sparse fieldsets are a different representation and get their own tag.
+    Fields are joined with '+': a comma would split the tag in If-None-Match.
+    """
+    etag = f'meme-{meme_id}-v{settings.MEME_REPRESENTATION_VERSION}'
+    if fields:
+        etag += ';' + '+'.join(fields)
+    return f'"{etag}"'
+
+
+def get_cached_meme(meme_id):
+    data = cache.get(meme_cache_key(meme_id))
+    record_cache('meme', data is not None)
+    return data
+
+
+def set_cached_meme(meme_id, data):
+    cache.set(meme_cache_key(meme_id), data, settings.MEME_CACHE_TIMEOUT)
+
+
+def invalidate_meme(meme_id):
+    cache.delete(meme_cache_key(meme_id))
+
+
+def invalidate_memes(meme_ids):
+    cache.delete_many([meme_cache_key(meme_id) for meme_id in meme_ids])
+
+
+def get_cached_payload(key, build, timeout, stale_timeout=0):
+    """Return the cached payload for ``key``, building it on a miss.
+
+    A payload holds the response ``data`` plus its rendered JSON body in every
+    supported content encoding, so compression runs once per cache fill.
+    Concurrent misses are coalesced into a single build.
+    """
+    def build_payload():
+        data = build()
+        return {'data': data, 'bodies': precompress(FastJSONRenderer().render(data))}
+
+    return get_or_compute(key, build_payload, timeout, stale_timeout)
+
+
+def invalidate_payload(key):
+    expire(key)
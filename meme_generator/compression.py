@@ -0,0 +1,89 @@
+import gzip
+import zlib
+
+from django.conf import settings
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+
+# Content codings we can produce, most preferred first
+ENCODINGS = [name for name, module in (('zstd', zstandard), ('br', brotli), ('gzip', gzip)) if module is not None]
+
+# Per-response compression has to be cheap; compress-once payloads can afford
+# the maximum level because the cost is paid once per cache fill.
+FAST_LEVELS = {'zstd': 3, 'br': 4, 'gzip': 6}
+BEST_LEVELS = {'zstd': 19, 'br': 11, 'gzip': 9}
+
+
+def negotiate_encoding(accept_encoding):
+    """Pick the preferred encoding from an Accept-Encoding header, or None."""
+    if not accept_encoding:
+        return None
+
+    accepted = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+
+    wildcard = accepted.get('*', 0.0)
+    candidates = [name for name in ENCODINGS if accepted.get(name, wildcard) > 0]
+    if not candidates:
+        return None
+    return max(candidates, key=lambda name: accepted.get(name, wildcard))
+
+
+def compress(data, encoding, best=False):
+    level = (BEST_LEVELS if best else FAST_LEVELS)[encoding]
+    if encoding == 'gzip':
+        return gzip.compress(data, compresslevel=level, mtime=0)
+    if encoding == 'br':
+        return brotli.compress(data, quality=level)
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    raise ValueError(f'Unsupported encoding {encoding!r}')
+
+
+def compressor(encoding):
+    """Return ``(compress_chunk, finish)`` callables for streaming compression.
+
+    Each chunk is flushed so that incremental consumers receive data as soon
+    as it is produced.
+    """
+    level = FAST_LEVELS[encoding]
+    if encoding == 'gzip':
+        stream = zlib.compressobj(level, zlib.DEFLATED, 31)
+        return (lambda chunk: stream.compress(chunk) + stream.flush(zlib.Z_SYNC_FLUSH)), stream.flush
+    if encoding == 'br':
+        stream = brotli.Compressor(quality=level)
+        return (lambda chunk: stream.process(chunk) + stream.flush()), stream.finish
+    if encoding == 'zstd':
+        stream = zstandard.ZstdCompressor(level=level).compressobj()
+        return (lambda chunk: stream.compress(chunk) + stream.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)), stream.flush
+    raise ValueError(f'Unsupported encoding {encoding!r}')
+
+
+def precompress(body):
+    """Return ``{encoding: bytes}`` for ``body`` in every supported encoding.
+
+    Bodies under the compression threshold are only stored uncompressed.
+    """
+    bodies = {'identity': body}
+    if len(body) >= settings.COMPRESSION_MIN_SIZE:
+        for encoding in ENCODINGS:
+            bodies[encoding] = compress(body, encoding, best=True)
+    return bodies
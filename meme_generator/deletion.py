@@ -0,0 +1,156 @@
+"""Deletion of users, templates and memes in the background.
+
+Deleting a user or a template would cascade through all of its memes and
+ratings in one transaction. ``request_deletion`` only marks the entity as
+deleted, which hides it and everything under it from reads (see
+``MemeQuerySet.visible``), and records a ``PendingDeletion``. ``purge``
+then removes the dependents in bounded batches. Each batch runs in its own
+short transaction and keeps ``UserStats`` and the rating histograms
+consistent.
+"""
+import time
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from .cache import (MEME_COUNT_CACHE_KEY,
+                    TEMPLATES_CACHE_KEY,
+                    TOP_MEMES_CACHE_KEY,
+                    invalidate_memes,
+                    invalidate_payload)
+from .events import LEADERBOARD_CHANGED, publish
+from .models import CompactedRating, Meme, MemeTemplate, PendingDeletion, Rating, User
+from .ratings import rating_signals_muted, record_compacted_deleted
+from .singleflight import expire
+from .stats import record_memes_deleted, record_ratings_deleted
+
+MODELS = {
+    PendingDeletion.USER: User,
+    PendingDeletion.TEMPLATE: MemeTemplate,
+    PendingDeletion.MEME: Meme,
+}
+MEME_FIELDS = {
+    PendingDeletion.USER: 'created_by_id',
+    PendingDeletion.TEMPLATE: 'template_id',
+    PendingDeletion.MEME: 'id',
+}
+
+
+def _memes_of(kind, object_id):
+    return Meme.objects.filter(**{MEME_FIELDS[kind]: object_id})
+
+
+def request_deletion(kind, object_id, requested_by=None):
+    """Hide the entity now and queue it for ``purge``. Returns the ``PendingDeletion``."""
+    with transaction.atomic():
+        deletion, created = PendingDeletion.objects.get_or_create(
+            kind=kind, object_id=object_id, defaults={'requested_by': requested_by})
+        if created:
+            if kind == PendingDeletion.USER:
+                User.objects.filter(pk=object_id).update(is_active=False)
+                Token.objects.filter(user_id=object_id).delete()
+            else:
+                MODELS[kind].objects.filter(pk=object_id).update(deleted_at=timezone.now())
+
+    if created:
+        # Meme details are served from the cache without a query, so drop them
+        memes = _memes_of(kind, object_id).order_by('id')
+        last_id = 0
+        while ids := list(memes.filter(id__gt=last_id).values_list('id', flat=True)[:1000]):
+            invalidate_memes(ids)
+            last_id = ids[-1]
+        invalidate_payload(TOP_MEMES_CACHE_KEY)
+        expire(MEME_COUNT_CACHE_KEY)
+        if kind == PendingDeletion.TEMPLATE:
+            invalidate_payload(TEMPLATES_CACHE_KEY)
+    return deletion
+
+
+def _delete_ratings(ratings, batch_size, memes_deleted=False):
+    """Delete up to ``batch_size`` of ``ratings`` (live or compacted) and uncount them."""
+    with transaction.atomic():
+        rows = list(ratings.values_list('id', 'user_id', 'meme_id', 'meme__created_by_id', 'score')[:batch_size])
+        if rows:
+            # The leaderboard is invalidated once per batch below, not per row
+            with rating_signals_muted():
+                ratings.model.objects.filter(id__in=[row[0] for row in rows]).delete()
+            record_ratings_deleted([row[1:] for row in rows], memes_deleted)
+            if ratings.model is CompactedRating and not memes_deleted:
+                record_compacted_deleted([(row[2], row[4]) for row in rows])
+    if rows and not memes_deleted:
+        invalidate_payload(TOP_MEMES_CACHE_KEY)
+    return len(rows)
+
+
+def _delete_memes(meme_ids):
+    with transaction.atomic():
+        owner_ids = list(Meme.objects.filter(id__in=meme_ids).values_list('created_by_id', flat=True))
+        with rating_signals_muted():
+            Meme.objects.filter(id__in=meme_ids).delete()
+        record_memes_deleted(owner_ids)
+    # Hidden since request_deletion, so the leaderboard does not change
+    invalidate_memes(meme_ids)
+    expire(MEME_COUNT_CACHE_KEY)
+
+
+def purge(deletion, batch_size=500, pause=0, progress=None):
+    """Delete the entity of ``deletion`` and its dependents, ``batch_size`` rows at a time.
+
+    Sleeps ``pause`` seconds between batches and calls ``progress(deletion)``
+    after each one.
+    """
+    if deletion.started_at is None:
+        deletion.started_at = timezone.now()
+        deletion.save(update_fields=['started_at'])
+
+    def done(ratings=0, memes=0):
+        PendingDeletion.objects.filter(pk=deletion.pk).update(
+            ratings_deleted=F('ratings_deleted') + ratings, memes_deleted=F('memes_deleted') + memes)
+        deletion.ratings_deleted += ratings
+        deletion.memes_deleted += memes
+        if progress:
+            progress(deletion)
+        if pause:
+            time.sleep(pause)
+
+    kind, object_id = deletion.kind, deletion.object_id
+
+    # Ratings the user gave on other people's memes, which are still listed
+    if kind == PendingDeletion.USER:
+        changed = False
+        for model in (Rating, CompactedRating):
+            while count := _delete_ratings(model.objects.filter(user_id=object_id), batch_size):
+                changed = True
+                done(ratings=count)
+        if changed:
+            # One event for the whole purge; clients refetch the leaderboard anyway
+            publish(LEADERBOARD_CHANGED, {'meme': None})
+
+    # Memes, after the ratings they received
+    memes = _memes_of(kind, object_id).order_by('id')
+    while meme_ids := list(memes.values_list('id', flat=True)[:batch_size]):
+        for model in (Rating, CompactedRating):
+            ratings = model.objects.filter(meme_id__in=meme_ids)
+            while count := _delete_ratings(ratings, batch_size, memes_deleted=True):
+                done(ratings=count)
+        _delete_memes(meme_ids)
+        done(memes=len(meme_ids))
+
+    # Only small dependents (tokens, counters) are left to cascade
+    with transaction.atomic():
+        MODELS[kind].objects.filter(pk=object_id).delete()
+        deletion.finished_at = timezone.now()
+        deletion.save(update_fields=['finished_at'])
+    if progress:
+        progress(deletion)
+
+
+def purge_pending(batch_size=500, pause=0, progress=None):
+    """Purge every unfinished deletion, oldest request first. Returns how many were purged."""
+    purged = 0
+    for deletion in PendingDeletion.objects.filter(finished_at__isnull=True).order_by('requested_at', 'id'):
+        purge(deletion, batch_size, pause, progress)
+        purged += 1
+    return purged
@@ -0,0 +1,354 @@
+"""Server-sent events for new memes and leaderboard changes.
+
+Writes publish events through a backend; every process serving the stream
+runs one ``Broadcaster`` that fans each event out to its connected clients
+on the event loop. Two backends are provided:
+
+* ``LocalBackend`` delivers events within the publishing process only.
+* ``RedisBackend`` appends events to a Redis stream that every process
+  reads, so clients see writes handled by any worker.
+
+Each client has a bounded buffer. Event types in
+``EVENTS_COALESCED_TYPES`` only keep their latest pending event. When other
+events overflow the buffer, the client gets a ``resync`` event telling it to
+reload instead of a partial history. Clients resume after a reconnect with
+``Last-Event-ID``, as long as the backend still holds the events they missed.
+
+``stream_app`` is a plain ASGI app mounted in ``meme_generator.asgi``. It
+bypasses the Django middleware stack, so an idle connection costs a
+coroutine and a small buffer.
+"""
+import asyncio
+import io
+import itertools
+import json
+import logging
+import threading
+import time
+from collections import deque
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.handlers.asgi import ASGIRequest
+from django.db import close_old_connections
+from django.utils.module_loading import import_string
+from rest_framework.exceptions import AuthenticationFailed
+
+from .utils import authenticate_user
+
+try:
+    import redis
+except ImportError:  # optional dependency
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+MEME_CREATED = 'meme'
+LEADERBOARD_CHANGED = 'leaderboard'
+RESYNC = 'resync'
+
+
+class Event:
+    __slots__ = ('id', 'type', 'data', '_encoded')
+
+    def __init__(self, id, type, data):
+        self.id = id
+        self.type = type
+        self.data = data
+        self._encoded = None
+
+    def __eq__(self, other):
+        if not isinstance(other, Event):
+            return NotImplemented
+        return (self.id, self.type, self.data) == (other.id, other.type, other.data)
+
+    def __repr__(self):
+        return f'Event({self.id!r}, {self.type!r}, {self.data!r})'
+
+    def encode(self):
+        # Encoded once and shared by every client the event is sent to
+        if self._encoded is None:
+            data = json.dumps(self.data, separators=(',', ':'))
+            self._encoded = f'id: {self.id}\nevent: {self.type}\ndata: {data}\n\n'.encode()
+        return self._encoded
+
+
+class Subscriber:
+    """Pending events of one client. Only touched from the event loop."""
+    __slots__ = ('queue', 'coalesced', 'max_size', 'resync_id', 'wakeup')
+
+    def __init__(self, max_size):
+        self.queue = deque()
+        self.coalesced = {}
+        self.max_size = max_size
+        self.resync_id = None
+        self.wakeup = asyncio.Event()
+
+    def push(self, event, coalesce=False):
+        if coalesce:
+            self.coalesced[event.type] = event
+        elif self.resync_id is not None or len(self.queue) >= self.max_size:
+            # Too slow: drop the backlog, the client reloads on resync
+            self.queue.clear()
+            self.resync_id = event.id
+        else:
+            self.queue.append(event)
+        self.wakeup.set()
+
+    def drain(self):
+        events = list(self.queue)
+        if self.resync_id is not None:
+            events = [Event(self.resync_id, RESYNC, {})]
+        events.extend(self.coalesced.values())
+        self.queue.clear()
+        self.coalesced.clear()
+        self.resync_id = None
+        self.wakeup.clear()
+        return events
+
+
+class Broadcaster:
+    """Fans the events of the configured backend out to this process's clients."""
+
+    def __init__(self):
+        self.subscribers = set()
+        self.loop = None
+        self._backend = None
+        self._lock = threading.Lock()
+
+    @property
+    def backend(self):
+        with self._lock:
+            if self._backend is None:
+                self._backend = import_string(settings.EVENTS_BACKEND)(self)
+            return self._backend
+
+    def reset(self):
+        with self._lock:
+            if self._backend is not None:
+                self._backend.stop()
+            self._backend = None
+        self.subscribers.clear()
+        self.loop = None
+
+    def publish(self, type, data):
+        try:
+            self.backend.publish(type, data)
+        except Exception:
+            # Events are best effort; never fail the write that triggered them
+            logger.exception('Could not publish event', extra={'event_type': type})
+
+    def deliver(self, event):
+        """Hand ``event`` to the clients. Safe to call from any thread."""
+        loop = self.loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._fan_out, event)
+
+    def _fan_out(self, event):
+        coalesce = event.type in settings.EVENTS_COALESCED_TYPES
+        for subscriber in self.subscribers:
+            subscriber.push(event, coalesce)
+
+    async def subscribe(self, last_event_id=None):
+        self.loop = asyncio.get_running_loop()
+        backend = self.backend
+        backend.start()
+        subscriber = Subscriber(settings.EVENTS_CLIENT_QUEUE_SIZE)
+        # Subscribe before reading the history so nothing falls in between
+        self.subscribers.add(subscriber)
+
+        if last_event_id:
+            missed = await sync_to_async(backend.since, thread_sensitive=False)(last_event_id)
+            if missed is None:
+                subscriber.resync_id = last_event_id
+                subscriber.wakeup.set()
+            elif missed:
+                live = subscriber.drain()
+                seen = {event.id for event in live}
+                coalesced = settings.EVENTS_COALESCED_TYPES
+                for event in [event for event in missed if event.id not in seen] + live:
+                    subscriber.push(event, event.type in coalesced)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.discard(subscriber)
+
+
+class LocalBackend:
+    """In-process backend keeping the latest events in memory for resumes."""
+
+    def __init__(self, broadcaster):
+        self.broadcaster = broadcaster
+        self.history = deque(maxlen=settings.EVENTS_HISTORY_SIZE)
+        # Ids from a previous process must not be mistaken for ours
+        self.prefix = f'{int(time.time() * 1000):x}'
+        self.counter = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def publish(self, type, data):
+        with self.lock:
+            event = Event(f'{self.prefix}-{next(self.counter)}', type, data)
+            self.history.append(event)
+        self.broadcaster.deliver(event)
+
+    def since(self, last_event_id):
+        """Events after ``last_event_id``, or ``None`` if some were lost."""
+        prefix, _, number = last_event_id.partition('-')
+        if prefix != self.prefix or not number.isdigit():
+            return None
+        number = int(number)
+        with self.lock:
+            events = list(self.history)
+        if events and number < int(events[0].id.partition('-')[2]) - 1:
+            return None
+        return [event for event in events if int(event.id.partition('-')[2]) > number]
+
+
+def _stream_id(value):
+    milliseconds, _, sequence = value.partition('-')
+    return int(milliseconds), int(sequence or 0)
+
+
+class RedisBackend:
+    """Cross-process backend on a capped Redis stream (requires ``redis``)."""
+
+    def __init__(self, broadcaster):
+        if redis is None:
+            raise ImproperlyConfigured('RedisBackend requires the redis package.')
+        self.broadcaster = broadcaster
+        self.client = redis.Redis.from_url(settings.EVENTS_REDIS_URL)
+        self.stream = settings.EVENTS_REDIS_STREAM
+        self.thread = None
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+
+    def start(self):
+        # Only processes serving the stream read it
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._listen, name='events-redis', daemon=True)
+                self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def publish(self, type, data):
+        self.client.xadd(self.stream, {'type': type, 'data': json.dumps(data)},
+                         maxlen=settings.EVENTS_HISTORY_SIZE, approximate=True)
+
+    def _decode(self, entry_id, fields):
+        return Event(entry_id.decode(), fields[b'type'].decode(), json.loads(fields[b'data']))
+
+    def _listen(self):
+        last_id = '$'
+        while not self.stopped.is_set():
+            try:
+                for _, entries in self.client.xread({self.stream: last_id}, block=5000) or ():
+                    for entry_id, fields in entries:
+                        last_id = entry_id
+                        self.broadcaster.deliver(self._decode(entry_id, fields))
+            except redis.RedisError:
+                logger.warning('Event stream read failed, retrying', exc_info=True)
+                self.stopped.wait(1)
+
+    def since(self, last_event_id):
+        try:
+            last = _stream_id(last_event_id)
+        except ValueError:
+            return None
+        oldest = self.client.xrange(self.stream, count=1)
+        if oldest and _stream_id(oldest[0][0].decode()) > last:
+            # Entries after the client's last one may have been trimmed
+            return None
+        entries = self.client.xrange(self.stream, min=f'({last_event_id}', count=settings.EVENTS_HISTORY_SIZE)
+        return [self._decode(entry_id, fields) for entry_id, fields in entries]
+
+
+broadcaster = Broadcaster()
+
+
+def publish(type, data):
+    broadcaster.publish(type, data)
+
+
+def _authenticate(request):
+    close_old_connections()
+    try:
+        return authenticate_user(request)
+    finally:
+        close_old_connections()
+
+
+async def _send_json(send, status, data):
+    body = json.dumps(data).encode()
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _disconnected(receive):
+    """Return once the client has disconnected.
+
+    Servers first deliver the (empty) request body as ``http.request``
+    messages; only ``http.disconnect`` means the client is gone.
+    """
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+async def stream_app(scope, receive, send):
+    """ASGI app for ``GET /api/stream/``."""
+    if scope['method'] != 'GET':
+        await _send_json(send, 405, {'detail': f'Method "{scope["method"]}" not allowed.'})
+        return
+
+    # Same header authentication as the REST endpoints
+    request = ASGIRequest(scope, io.BytesIO())
+    try:
+        await sync_to_async(_authenticate)(request)
+    except AuthenticationFailed as e:
+        await _send_json(send, 400, {'non_field_errors': [str(e.detail)]})
+        return
+
+    # EventSource sends Last-Event-ID when it reconnects
+    last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    del request  # keep idle connections small
+
+    subscriber = await broadcaster.subscribe(last_event_id)
+    loop = asyncio.get_running_loop()
+    # A disconnect or the keepalive timer wake the connection like an event,
+    # so an idle client costs one asyncio.Event and one task waiting on receive()
+    disconnect = asyncio.ensure_future(_disconnected(receive))
+    disconnect.add_done_callback(lambda _: subscriber.wakeup.set())
+    try:
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+        ]})
+        await send({'type': 'http.response.body', 'body': b'retry: 3000\n\n', 'more_body': True})
+
+        while True:
+            keepalive = loop.call_later(settings.EVENTS_KEEPALIVE_INTERVAL, subscriber.wakeup.set)
+            await subscriber.wakeup.wait()
+            keepalive.cancel()
+            if disconnect.done():
+                break
+            body = b''.join(event.encode() for event in subscriber.drain()) or b': keepalive\n\n'
+            await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+        # Servers ignore messages after a disconnect, but the response must end
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+    except OSError:
+        pass  # client went away mid-write
+    finally:
+        broadcaster.unsubscribe(subscriber)
+        disconnect.cancel()
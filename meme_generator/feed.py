@@ -0,0 +1,92 @@
+"""Discovery feed of the memes a user has not rated yet.
+
+Unrated memes are found with NOT EXISTS anti-joins against ``Rating`` and
+``CompactedRating``. Both are answered from the (meme, user) unique indexes,
+so the cost depends on the page size rather than on how many ratings the
+user has, as long as those ratings are spread over the feed. A page that
+starts in a long run of consecutive rated memes probes the indexes once per
+skipped meme: ``manage.py bench_feed --pattern newest`` measures that case.
+Pages are walked with keyset cursors instead of offsets:
+
+* ``recent`` orders by descending id.
+* ``shuffle`` orders by the precomputed ``Meme.shuffle_key``. Each feed
+  starts at a random point of the key space and wraps around once, so users
+  do not all see the same sequence.
+"""
+import base64
+import binascii
+import json
+import random
+
+from django.db.models import Exists, OuterRef, Q
+from rest_framework.exceptions import ValidationError
+
+from .models import CompactedRating, Meme, Rating
+
+RECENT = 'recent'
+SHUFFLE = 'shuffle'
+ORDERS = (RECENT, SHUFFLE)
+
+
+def encode_cursor(state):
+    raw = json.dumps(state, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor, order):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        state = json.loads(raw)
+        if state['o'] != order:
+            raise ValueError
+        if order == RECENT:
+            return {'o': order, 'i': int(state['i'])}
+        return {'o': order, 's': float(state['s']), 'w': bool(state['w']),
+                'k': float(state['k']), 'i': int(state['i'])}
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        raise ValidationError({'cursor': ['Invalid cursor.']})
+
+
+def _after(key, meme_id):
+    # (shuffle_key, id) > (key, meme_id)
+    return Q(shuffle_key__gt=key) | Q(shuffle_key=key, id__gt=meme_id)
+
+
+def unrated_feed(user_id, serializer, order=RECENT, cursor=None, limit=20):
+    """Return ``(rows, next_cursor)`` for one page of memes unrated by ``user_id``.
+
+    ``rows`` are ``values_list`` tuples of ``serializer``'s columns;
+    ``next_cursor`` is ``None`` on the last page.
+    """
+    state = decode_cursor(cursor, order) if cursor else None
+    memes = Meme.objects.visible().filter(
+        ~Exists(Rating.objects.filter(user_id=user_id, meme_id=OuterRef('pk'))),
+        ~Exists(CompactedRating.objects.filter(user_id=user_id, meme_id=OuterRef('pk'))),
+    )
+    columns = (*serializer.get_columns(), 'shuffle_key', 'id')
+
+    if order == RECENT:
+        if state:
+            memes = memes.filter(id__lt=state['i'])
+        rows = list(memes.order_by('-id').values_list(*columns)[:limit + 1])
+        next_state = lambda row: {'o': RECENT, 'i': row[-1]}
+    else:
+        if state is None:
+            state = {'o': SHUFFLE, 's': random.random(), 'w': False, 'k': -1.0, 'i': 0}
+        start = state['s']
+        memes = memes.order_by('shuffle_key', 'id')
+
+        rows = []
+        if not state['w']:
+            # First lap: from the random start point to the end of the key space
+            position = _after(state['k'], state['i']) if state['k'] >= start else Q(shuffle_key__gte=start)
+            rows = list(memes.filter(position).values_list(*columns)[:limit + 1])
+            state = dict(state, k=-1.0, i=0)
+        if len(rows) <= limit:
+            # Second lap: from the beginning of the key space up to the start point
+            position = _after(state['k'], state['i']) & Q(shuffle_key__lt=start)
+            rows += memes.filter(position).values_list(*columns)[:limit + 1 - len(rows)]
+        next_state = lambda row: {'o': SHUFFLE, 's': start, 'w': row[-2] < start, 'k': row[-2], 'i': row[-1]}
+
+    next_cursor = encode_cursor(next_state(rows[limit - 1])) if len(rows) > limit else None
+    return [row[:-2] for row in rows[:limit]], next_cursor
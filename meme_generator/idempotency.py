@@ -0,0 +1,94 @@
+"""``Idempotency-Key`` support for write endpoints.
+
+The first response for a (user, endpoint, key) triple is stored in a bounded,
+TTL-expiring cache and replayed for retries without running the view again.
+A retry arriving while the first request is still running waits for its
+result instead of racing it.
+"""
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework import status
+from rest_framework.response import Response
+
+IN_FLIGHT = 'in_flight'
+DONE = 'done'
+
+
+def _store():
+    return caches[settings.IDEMPOTENCY_CACHE_ALIAS]
+
+
+def idempotency_cache_key(user_id, method, path, key):
+    digest = hashlib.sha256(key.encode()).hexdigest()
+    return f'idempotency:{user_id}:{method}:{path}:{digest}'
+
+
+def _fingerprint(request):
+    body = json.dumps(request.data, sort_keys=True, default=str)
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+def _replay(entry):
+    response = Response(entry['data'], status=entry['status'])
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent_response(request, user_id, handler):
+    """Run ``handler()`` at most once per Idempotency-Key and replay its response.
+
+    Requests without the header are passed straight through. Only call this
+    after the request has been authenticated, since ``user_id`` scopes the key.
+    """
+    key = request.headers.get('Idempotency-Key')
+    if not key:
+        return handler()
+    if len(key) > 255:
+        return Response({'Idempotency-Key': 'Must be at most 255 characters.'}, status=status.HTTP_400_BAD_REQUEST)
+
+    store = _store()
+    cache_key = idempotency_cache_key(user_id, request.method, request.path, key)
+    fingerprint = _fingerprint(request)
+
+    if not store.add(cache_key, {'state': IN_FLIGHT, 'fingerprint': fingerprint}, settings.IDEMPOTENCY_LOCK_TIMEOUT):
+        # Someone already used this key: replay its result, waiting if it is still running
+        deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_TIMEOUT
+        entry = store.get(cache_key)
+        while entry is not None and entry['state'] == IN_FLIGHT and time.monotonic() < deadline:
+            time.sleep(settings.IDEMPOTENCY_POLL_INTERVAL)
+            entry = store.get(cache_key)
+
+        if entry is None:
+            # The first attempt failed and released the key; this retry runs it
+            return idempotent_response(request, user_id, handler)
+        if entry['fingerprint'] != fingerprint:
+            return Response({'Idempotency-Key': 'Key was already used with a different request body.'},
+                            status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        if entry['state'] == IN_FLIGHT:
+            response = Response({'Idempotency-Key': 'A request with this key is still being processed.'},
+                                status=status.HTTP_409_CONFLICT)
+            response['Retry-After'] = '1'
+            return response
+        return _replay(entry)
+
+    try:
+        response = handler()
+    except BaseException:
+        store.delete(cache_key)
+        raise
+
+    if response.status_code >= 500 or response.status_code == status.HTTP_429_TOO_MANY_REQUESTS:
+        # Server errors and rate limiting are not final; let the client retry for real
+        store.delete(cache_key)
+    else:
+        store.set(cache_key, {
+            'state': DONE,
+            'fingerprint': fingerprint,
+            'status': response.status_code,
+            'data': response.data,
+        }, settings.IDEMPOTENCY_TTL)
+    return response
@@ -0,0 +1,129 @@
+"""Non-blocking structured logging.
+
+Request threads only run the cheap sampling filter and push the record onto a
+bounded in-memory queue; redaction, JSON formatting and the actual write
+happen on a background listener thread. When the queue is full records are
+dropped (and counted) rather than blocking the request.
+"""
+import json
+import logging
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# Attributes every LogRecord has; anything else was passed through ``extra``
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+REDACTED = '[REDACTED]'
+DEFAULT_REDACT_KEYS = ('token', 'password', 'authorization', 'cookie', 'secret', 'api_key')
+
+
+class SamplingFilter(logging.Filter):
+    """Keep only a fraction of records per logger.
+
+    ``rates`` maps logger names to the probability of keeping a record; the
+    most specific prefix wins. Warnings and errors are never dropped.
+    """
+
+    def __init__(self, rates=None):
+        super().__init__()
+        self.rates = rates or {}
+
+    def rate_for(self, name):
+        while name:
+            if name in self.rates:
+                return self.rates[name]
+            name = name.rpartition('.')[0]
+        return 1.0
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rate_for(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+
+class RedactingFilter(logging.Filter):
+    """Mask values of secret-looking keys in ``extra`` fields and dict arguments."""
+
+    def __init__(self, keys=DEFAULT_REDACT_KEYS):
+        super().__init__()
+        self.keys = tuple(key.lower() for key in keys)
+
+    def is_secret(self, key):
+        key = str(key).lower()
+        return any(secret in key for secret in self.keys)
+
+    def redact(self, value):
+        if isinstance(value, dict):
+            return {k: REDACTED if self.is_secret(k) else self.redact(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return type(value)(self.redact(v) for v in value)
+        return value
+
+    def filter(self, record):
+        for attr, value in list(vars(record).items()):
+            if attr in _RECORD_ATTRS:
+                continue
+            record.__dict__[attr] = REDACTED if self.is_secret(attr) else self.redact(value)
+        if isinstance(record.args, dict):
+            record.args = self.redact(record.args)
+        elif isinstance(record.args, tuple):
+            record.args = tuple(self.redact(arg) for arg in record.args)
+        return True
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line with the message and any ``extra`` fields."""
+
+    def format(self, record):
+        data = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for attr, value in vars(record).items():
+            if attr not in _RECORD_ATTRS:
+                data[attr] = value
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+
+class QueueListenerHandler(QueueHandler):
+    """QueueHandler that owns its background listener and never blocks.
+
+    The listener writes JSON lines to ``stream`` after redacting secrets.
+    """
+
+    def __init__(self, stream=None, queue_size=10000, redact_keys=DEFAULT_REDACT_KEYS):
+        super().__init__(queue.Queue(maxsize=queue_size))
+        self.dropped = 0
+
+        target = logging.StreamHandler(stream or sys.stderr)
+        target.setFormatter(JSONFormatter())
+        target.addFilter(RedactingFilter(redact_keys))
+
+        self.listener = QueueListener(self.queue, target, respect_handler_level=True)
+        self.listener.start()
+        self._listening = True
+
+    def prepare(self, record):
+        # Formatting is left to the listener thread; the record is handed over as-is
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        # Called by logging.shutdown() at exit: drain the queue before leaving
+        if self._listening:
+            self._listening = False
+            self.listener.stop()
+        super().close()
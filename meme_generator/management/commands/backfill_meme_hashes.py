@@ -0,0 +1,78 @@
+import heapq
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+from meme_generator.models import Meme
+
+
+class Command(BaseCommand):
+    help = 'Compute content hashes for memes that have none and report duplicate clusters'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Memes processed per batch')
+        parser.add_argument('--top', type=int, default=10, help='Number of largest duplicate clusters to list')
+        parser.add_argument('--dry-run', action='store_true', help='Report only, do not write hashes')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        dry_run = options['dry_run']
+
+        scanned = hashed = duplicates = cluster_count = 0
+        largest = []  # (canonical meme id, number of duplicates) of the largest clusters
+
+        # Walk the memes without a hash in id order, one keyset batch at a
+        # time, so the oldest meme of a cluster becomes its canonical
+        # (hash-holding) member. A dry run cannot look up the hashes it would
+        # have written, so it remembers them instead; duplicates share their
+        # template, so memes are walked one template at a time and only that
+        # template's hashes are kept
+        template_ids = (
+            Meme.objects.filter(content_hash__isnull=True)
+            .order_by('template_id').values_list('template_id', flat=True).distinct()
+        )
+        for template_id in template_ids:
+            clusters = Counter()  # canonical meme id -> number of duplicates
+            claimed = {}  # hash -> canonical meme id, in this template
+
+            last_id = 0
+            while True:
+                batch = list(
+                    Meme.objects
+                    .filter(template_id=template_id, content_hash__isnull=True, id__gt=last_id)
+                    .order_by('id')
+                    .values_list('id', 'top_text', 'bottom_text')[:batch_size]
+                )
+                if not batch:
+                    break
+                hashes = {meme_id: Meme.compute_content_hash(template_id, top, bottom) for meme_id, top, bottom in batch}
+                unclaimed = set(hashes.values()) - claimed.keys()
+                claimed.update(Meme.objects.filter(content_hash__in=unclaimed).values_list('content_hash', 'id'))
+
+                updates = []
+                for meme_id, content_hash in hashes.items():
+                    owner = claimed.get(content_hash)
+                    if owner is None:
+                        claimed[content_hash] = meme_id
+                        updates.append(Meme(id=meme_id, content_hash=content_hash))
+                    else:
+                        duplicates += 1
+                        clusters[owner] += 1
+
+                hashed += len(updates)
+                if not dry_run:
+                    Meme.objects.bulk_update(updates, ['content_hash'])
+                    # Written hashes are found by the next batch's lookup
+                    claimed.clear()
+                scanned += len(batch)
+                last_id = batch[-1][0]
+                self.stdout.write(f'  scanned {scanned} memes...')
+
+            cluster_count += len(clusters)
+            largest = heapq.nlargest(options['top'], largest + list(clusters.items()), key=lambda item: item[1])
+
+        verb = 'Would hash' if dry_run else 'Hashed'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {hashed} of {scanned} memes; {duplicates} duplicates in {cluster_count} clusters.'
+        ))
+        for meme_id, count in largest:
+            self.stdout.write(f'  meme {meme_id}: {count} duplicates')
@@ -0,0 +1,62 @@
+import sys
+import tempfile
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import RequestFactory
+from rest_framework.authtoken.models import Token
+from meme_generator.utils import authenticate_user
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Compare authenticate_user latency with the old print() logging and the queued logger'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000, help='Number of authentications per run')
+        parser.add_argument('--sink', help='File the print() variant writes to (default: a temporary file)')
+
+    def handle(self, *args, **options):
+        count = options['requests']
+        try:
+            # Work on a throwaway user inside a transaction that is rolled back
+            with transaction.atomic():
+                user = User.objects.create_user(username='bench-auth-user', password='bench-password')
+                token = Token.objects.create(user=user)
+                request = RequestFactory().get('/api/memes/', HTTP_TOKEN=token.key, HTTP_ID=str(user.id))
+                self.report(request, count, options['sink'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def report(self, request, count, sink):
+        def with_print(request):
+            # What authenticate_user used to do on every request
+            print('headers in authenticate', request.headers)
+            return authenticate_user(request)
+
+        def run(func):
+            start = time.perf_counter()
+            for _ in range(count):
+                func(request)
+            return (time.perf_counter() - start) / count
+
+        run(authenticate_user)  # warm up connections and caches
+
+        with (open(sink, 'a') if sink else tempfile.TemporaryFile('w')) as f:
+            stdout, sys.stdout = sys.stdout, f
+            try:
+                printed = run(with_print)
+            finally:
+                sys.stdout = stdout
+        queued = run(authenticate_user)
+
+        self.stdout.write(f'{count} authentications')
+        self.stdout.write(f'print() of all headers: {printed * 1e6:9.1f} us/request')
+        self.stdout.write(f'queued JSON logging:    {queued * 1e6:9.1f} us/request')
+        self.stdout.write(f'change:                 {(queued - printed) * 1e6:+9.1f} us/request')
@@ -0,0 +1,179 @@
+import random
+import threading
+import time
+from collections import defaultdict
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from meme_generator.models import Meme, MemeTemplate, Rating
+
+PREFIX = 'bench-db-'
+
+
+class Command(BaseCommand):
+    help = ('Run a mixed read/write API workload from several threads against the configured database. '
+            'Run it once per DATABASE_URL to compare profiles on the same seeded dataset.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50, help='Seeded users')
+        parser.add_argument('--memes', type=int, default=2000, help='Seeded memes')
+        parser.add_argument('--ratings', type=int, default=20000, help='Seeded ratings')
+        parser.add_argument('--threads', type=int, default=8, help='Concurrent clients')
+        parser.add_argument('--duration', type=float, default=10, help='Seconds to run the workload')
+        parser.add_argument('--write-ratio', type=float, default=0.2, help='Share of requests that write')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed of the dataset and workload')
+        parser.add_argument('--keep', action='store_true', help='Keep the seeded dataset for the next run')
+        parser.add_argument('--untuned', action='store_true',
+                            help="SQLite only: run with Django's default connection options and a rollback journal")
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        users = self.seed(rng, options['users'], options['memes'], options['ratings'])
+        meme_ids = list(Meme.objects.filter(created_by__username__startswith=PREFIX).values_list('id', flat=True))
+        template_ids = list(MemeTemplate.objects.visible().values_list('id', flat=True))
+        # Only measure the database: no cached meme details or leaderboards
+        cache.clear()
+        tuned_options = connection.settings_dict.get('OPTIONS', {})
+        if options['untuned']:
+            self.untune()
+
+        latencies = defaultdict(list)
+        errors = defaultdict(int)
+        lock = threading.Lock()
+        deadline = time.perf_counter() + options['duration']
+
+        def worker(number):
+            client_rng = random.Random(options['seed'] * 1000 + number)
+            user_id, token = users[number % len(users)]
+            client = APIClient(SERVER_NAME='localhost')
+            client.credentials(HTTP_TOKEN=token, HTTP_ID=str(user_id))
+            local_latencies = defaultdict(list)
+            local_errors = defaultdict(int)
+            requests = 0
+            try:
+                while time.perf_counter() < deadline:
+                    requests += 1
+                    name, call = self.pick(client, client_rng, options['write_ratio'], meme_ids, template_ids,
+                                           f'{number}-{requests}')
+                    start = time.perf_counter()
+                    try:
+                        response = call()
+                        if response.status_code >= 400:
+                            local_errors[f'{name} HTTP {response.status_code}'] += 1
+                            continue
+                    except OperationalError as exc:
+                        local_errors[f'{name} {exc}'] += 1
+                        continue
+                    local_latencies[name].append(time.perf_counter() - start)
+            finally:
+                connection.close()
+                with lock:
+                    for name, values in local_latencies.items():
+                        latencies[name].extend(values)
+                    for name, count in local_errors.items():
+                        errors[name] += count
+
+        threads = [threading.Thread(target=worker, args=(number,)) for number in range(options['threads'])]
+        # Every client shares one address: the per-IP rate limits would measure themselves
+        with override_settings(RATE_LIMIT_ENABLED=False):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        if options['untuned']:
+            # Worker threads share this settings dict; reconnect with the profile
+            connection.settings_dict['OPTIONS'] = tuned_options
+            connection.close()
+        self.report(options, latencies, errors)
+        if not options['keep']:
+            self.cleanup()
+
+    def untune(self):
+        if connection.vendor != 'sqlite':
+            raise CommandError('--untuned only applies to SQLite.')
+        # The journal mode is stored in the database file; switch it while this is the only connection
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode=DELETE')
+        connection.close()
+        connection.settings_dict['OPTIONS'] = {}
+
+    def seed(self, rng, user_count, meme_count, rating_count):
+        """Create the dataset unless a previous --keep run left it. Returns ``[(user_id, token)]``."""
+        users = list(User.objects.filter(username__startswith=PREFIX).order_by('id'))
+        if not users:
+            self.stdout.write(f'Seeding {user_count} users, {meme_count} memes and {rating_count} ratings...')
+            password = make_password('bench-password')
+            User.objects.bulk_create([User(username=f'{PREFIX}{n}', password=password) for n in range(user_count)])
+            users = list(User.objects.filter(username__startswith=PREFIX).order_by('id'))
+            Token.objects.bulk_create([Token(user=user, key=Token.generate_key()) for user in users])
+
+            templates = list(MemeTemplate.objects.visible().values_list('id', flat=True))
+            Meme.objects.bulk_create([
+                Meme(template_id=rng.choice(templates), created_by=rng.choice(users),
+                     top_text=f'bench top {n}', bottom_text=f'bench bottom {n}')
+                for n in range(meme_count)
+            ], batch_size=1000)
+            meme_ids = list(Meme.objects.filter(created_by__username__startswith=PREFIX).values_list('id', flat=True))
+
+            pairs = set()
+            while len(pairs) < min(rating_count, len(meme_ids) * len(users)):
+                pairs.add((rng.choice(meme_ids), rng.choice(users).id))
+            Rating.objects.bulk_create([
+                Rating(meme_id=meme_id, user_id=user_id, score=rng.randint(1, 5)) for meme_id, user_id in sorted(pairs)
+            ], batch_size=1000)
+        return [(user.id, user.auth_token.key) for user in users]
+
+    def pick(self, client, rng, write_ratio, meme_ids, template_ids, tag):
+        """Choose the next request. Returns ``(name, call)``."""
+        if rng.random() < write_ratio:
+            if rng.random() < 0.75:
+                meme_id = rng.choice(meme_ids)
+                return 'rate', lambda: client.post(reverse('rate_meme', args=[meme_id]), {'score': rng.randint(1, 5)})
+            data = {'template': rng.choice(template_ids), 'top_text': f'bench {tag}', 'bottom_text': 'bench'}
+            return 'create', lambda: client.post(reverse('meme_request'), data)
+
+        kind = rng.random()
+        if kind < 0.4:
+            ids = ','.join(map(str, rng.sample(meme_ids, 20)))
+            return 'batch-get', lambda: client.get(reverse('meme_request'), {'ids': ids})
+        if kind < 0.7:
+            return 'feed', lambda: client.get(reverse('meme_feed'))
+        if kind < 0.9:
+            meme_id = rng.choice(meme_ids)
+            return 'detail', lambda: client.get(reverse('retrieve_meme', args=[meme_id]), {'expand': 'rating'})
+        # Bypasses the leaderboard cache: every call runs the aggregate
+        return 'top', lambda: (cache.clear(), client.get(reverse('top memes')))[1]
+
+    def report(self, options, latencies, errors):
+        def percentile(values, q):
+            return values[min(len(values) - 1, int(q * len(values)))] * 1000
+
+        settings_dict = connection.settings_dict
+        profile = 'untuned' if options['untuned'] else 'tuned'
+        self.stdout.write(f"{settings_dict['ENGINE'].rsplit('.', 1)[-1]} ({profile}) {settings_dict['NAME']}, "
+                          f"{options['threads']} threads, {options['duration']:g}s, "
+                          f"write ratio {options['write_ratio']:g}")
+        self.stdout.write(f"{'request':10} {'count':>7} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8}")
+        total = 0
+        for name in sorted(latencies):
+            values = sorted(latencies[name])
+            total += len(values)
+            self.stdout.write(f'{name:10} {len(values):7d} {len(values) / options["duration"]:8.1f} '
+                              f'{percentile(values, 0.5):8.2f} {percentile(values, 0.99):8.2f}')
+        self.stdout.write(f"{'total':10} {total:7d} {total / options['duration']:8.1f}")
+        for name, count in sorted(errors.items()):
+            self.stdout.write(self.style.ERROR(f'{count:7d} x {name}'))
+        if not errors:
+            self.stdout.write(self.style.SUCCESS('No errors.'))
+
+    def cleanup(self):
+        Meme.objects.filter(top_text__startswith='bench ', created_by__username__startswith=PREFIX).delete()
+        User.objects.filter(username__startswith=PREFIX).delete()
@@ -0,0 +1,61 @@
+import asyncio
+import time
+import tracemalloc
+from unittest import mock
+
+from django.core.management.base import BaseCommand
+from meme_generator import events
+
+
+class Command(BaseCommand):
+    help = 'Measure the memory of idle /api/stream/ connections and the fan-out latency of one event'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=10000, help='Number of idle connections')
+
+    def handle(self, *args, **options):
+        count = options['connections']
+        events.broadcaster.reset()
+        # Authentication is a single query per connection and not what is measured here
+        with mock.patch.object(events, '_authenticate'):
+            per_connection, fan_out = asyncio.run(self.run(count))
+        events.broadcaster.reset()
+
+        self.stdout.write(f'connections:      {count:8d}')
+        self.stdout.write(f'memory:           {per_connection / 1024:8.2f} KiB/connection')
+        self.stdout.write(f'fan-out:          {fan_out * 1000:8.2f} ms for one event to all connections')
+
+    async def run(self, count):
+        disconnect = asyncio.Event()
+        received = 0
+        all_received = asyncio.Event()
+
+        async def receive():
+            await disconnect.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            nonlocal received
+            if b'event: meme' in message.get('body', b''):
+                received += 1
+                if received == count:
+                    all_received.set()
+
+        scope = {'type': 'http', 'method': 'GET', 'path': '/api/stream/', 'query_string': b'', 'headers': []}
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        tasks = [asyncio.ensure_future(events.stream_app(scope, receive, send)) for _ in range(count)]
+        while len(events.broadcaster.subscribers) < count:
+            await asyncio.sleep(0.05)
+        await asyncio.sleep(0.1)
+        per_connection = (tracemalloc.get_traced_memory()[0] - before) / count
+        tracemalloc.stop()
+
+        start = time.perf_counter()
+        events.broadcaster.publish(events.MEME_CREATED, {'id': 0})
+        await all_received.wait()
+        fan_out = time.perf_counter() - start
+
+        disconnect.set()
+        await asyncio.gather(*tasks)
+        return per_connection, fan_out
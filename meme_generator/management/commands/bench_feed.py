@@ -0,0 +1,88 @@
+import random
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from meme_generator.feed import ORDERS, unrated_feed
+from meme_generator.models import Meme, MemeTemplate, Rating
+from meme_generator.serializers import FeedMemeRowSerializer
+
+PREFIX = 'bench-feed-'
+
+
+class Command(BaseCommand):
+    help = ('Time unrated-feed pages for a user with many ratings and print the query plan. '
+            '--pattern newest rates the most recent memes (a long rated run at the head of the feed), '
+            'scattered rates memes at random.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--memes', type=int, default=120000, help='Seeded memes')
+        parser.add_argument('--ratings', type=int, default=100000, help='Ratings of the benchmarked user')
+        parser.add_argument('--pattern', choices=('newest', 'scattered'), default='scattered',
+                            help='Which memes the user has rated')
+        parser.add_argument('--pages', type=int, default=20, help='Pages walked per order')
+        parser.add_argument('--limit', type=int, default=20, help='Page size')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed of the dataset')
+        parser.add_argument('--keep', action='store_true', help='Keep the seeded dataset')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        rater = self.seed(rng, options)
+        serializer = FeedMemeRowSerializer()
+        self.stdout.write(f"{options['ratings']} ratings ({options['pattern']}) on {options['memes']} memes, "
+                          f"pages of {options['limit']}")
+
+        for order in ORDERS:
+            timings = []
+            cursor = None
+            for _ in range(options['pages']):
+                start = time.perf_counter()
+                with CaptureQueriesContext(connection) as queries:
+                    rows, cursor = unrated_feed(rater.id, serializer, order, cursor, options['limit'])
+                timings.append(time.perf_counter() - start)
+                if cursor is None:
+                    break
+            self.stdout.write(f'{order:8} first page {timings[0] * 1000:8.2f} ms, '
+                              f'median {statistics.median(timings) * 1000:8.2f} ms, '
+                              f'max {max(timings) * 1000:8.2f} ms over {len(timings)} pages')
+            self.explain(queries.captured_queries[-1]['sql'])
+
+        if not options['keep']:
+            self.cleanup()
+
+    def explain(self, sql):
+        prefix = connection.ops.explain_query_prefix()
+        with connection.cursor() as cursor:
+            # The captured SQL has its parameters inlined already
+            cursor.execute(f'{prefix} {sql}')
+            for row in cursor.fetchall():
+                self.stdout.write('    ' + ' '.join(str(column) for column in row))
+
+    def seed(self, rng, options):
+        author, _ = User.objects.get_or_create(username=f'{PREFIX}author')
+        rater, created = User.objects.get_or_create(username=f'{PREFIX}rater')
+        if not created:
+            return rater
+
+        self.stdout.write(f"Seeding {options['memes']} memes and {options['ratings']} ratings...")
+        templates = list(MemeTemplate.objects.visible().values_list('id', flat=True))
+        Meme.objects.bulk_create([
+            Meme(template_id=rng.choice(templates), created_by=author, top_text=f'bench top {n}',
+                 bottom_text='bench', shuffle_key=rng.random())
+            for n in range(options['memes'])
+        ], batch_size=5000)
+        meme_ids = list(Meme.objects.filter(created_by=author).order_by('-id').values_list('id', flat=True))
+        count = min(options['ratings'], len(meme_ids))
+        if options['pattern'] == 'newest':
+            rated = meme_ids[:count]
+        else:
+            rated = rng.sample(meme_ids, count)
+        Rating.objects.bulk_create([Rating(meme_id=meme_id, user=rater, score=rng.randint(1, 5))
+                                    for meme_id in rated], batch_size=5000)
+        return rater
+
+    def cleanup(self):
+        User.objects.filter(username__startswith=PREFIX).delete()
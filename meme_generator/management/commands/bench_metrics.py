@@ -0,0 +1,49 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.urls import resolve
+from meme_generator import metrics
+from meme_generator.middleware import MetricsMiddleware
+
+
+class Command(BaseCommand):
+    help = 'Measure the per-request overhead of MetricsMiddleware'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50000, help='Number of requests per run')
+        parser.add_argument('--repeat', type=int, default=5, help='Best of N runs')
+
+    def handle(self, *args, **options):
+        count = options['requests']
+        request = RequestFactory().get('/api/memes/')
+        request.resolver_match = resolve('/api/memes/')
+        response = HttpResponse()
+
+        def view(request):
+            return response
+
+        middleware = MetricsMiddleware(view)
+
+        def best(handler):
+            timings = []
+            for _ in range(options['repeat']):
+                start = time.perf_counter()
+                for _ in range(count):
+                    handler(request)
+                timings.append(time.perf_counter() - start)
+            return min(timings) / count
+
+        bare = best(view)
+        instrumented = best(middleware)
+        metrics.registry.reset()
+
+        overhead = (instrumented - bare) * 1e6
+        self.stdout.write(f'bare view:        {bare * 1e6:8.2f} us/request')
+        self.stdout.write(f'with metrics:     {instrumented * 1e6:8.2f} us/request')
+        self.stdout.write(f'overhead:         {overhead:8.2f} us/request')
+        if overhead < 50:
+            self.stdout.write(self.style.SUCCESS('Overhead is within the 50us budget.'))
+        else:
+            self.stdout.write(self.style.WARNING('Overhead exceeds the 50us budget.'))
@@ -0,0 +1,64 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.http import HttpResponse
+from django.test import RequestFactory, override_settings
+from meme_generator.middleware import AdmissionControlMiddleware
+from meme_generator.ratelimit import buckets, rate_limit_response
+
+
+class Command(BaseCommand):
+    help = 'Measure the per-request cost of rate limiting and admission control'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=20000, help='Number of requests per run')
+        parser.add_argument('--repeat', type=int, default=5, help='Best of N runs')
+        parser.add_argument('--users', type=int, default=1000, help='Distinct users (and buckets) to spread requests over')
+        parser.add_argument('--cache', help='Keep buckets in this cache alias instead of in the process')
+
+    def handle(self, *args, **options):
+        count = options['requests']
+        users = [str(n) for n in range(options['users'])]
+        request = RequestFactory().post('/api/memes/')
+        response = HttpResponse()
+
+        def view(request):
+            return response
+
+        admission = AdmissionControlMiddleware(view)
+
+        def limited(scope):
+            def call(request, user_id):
+                return rate_limit_response(request, scope, user_id) or response
+            return call
+
+        def best(handler):
+            timings = []
+            for _ in range(options['repeat']):
+                start = time.perf_counter()
+                for n in range(count):
+                    handler(request, users[n % len(users)])
+                timings.append(time.perf_counter() - start)
+            return min(timings) / count
+
+        # Buckets large enough that every request is admitted, then so small that every one is refused
+        generous = {'bench': {'user': ('1000000/s', 1000000), 'ip': ('1000000/s', 1000000)}}
+        strict = {'bench': {'user': ('1/d', 1), 'ip': ('1/d', 1)}}
+        with override_settings(RATE_LIMIT_ENABLED=True, RATE_LIMIT_CACHE_ALIAS=options['cache']):
+            store = buckets()
+            with override_settings(RATE_LIMITS=generous):
+                store.clear()
+                bare = best(lambda request, user_id: view(request))
+                admitted = best(limited('bench'))
+                middleware = best(lambda request, user_id: admission(request))
+            with override_settings(RATE_LIMITS=strict):
+                store.clear()
+                refused = best(limited('bench'))
+            store.clear()
+
+        backend = options['cache'] or 'in-process'
+
+        self.stdout.write(f'bare view:               {bare * 1e6:8.2f} us/request')
+        self.stdout.write(f'rate limit, admitted:    {(admitted - bare) * 1e6:8.2f} us/request ({backend}, 2 buckets)')
+        self.stdout.write(f'rate limit, refused:     {(refused - bare) * 1e6:8.2f} us/request')
+        self.stdout.write(f'admission control:       {(middleware - bare) * 1e6:8.2f} us/request')
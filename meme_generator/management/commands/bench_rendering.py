@@ -0,0 +1,55 @@
+import io
+import os
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from meme_generator.assets import ingest
+from meme_generator.rendering import Image, render_derivatives, render_many
+
+
+class Command(BaseCommand):
+    help = 'Measure meme rendering throughput (all sizes per render) in renders/sec and renders/sec per core'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--renders', type=int, default=200, help='Renders per run')
+        parser.add_argument('--width', type=int, default=1200, help='Width of the synthetic template image')
+        parser.add_argument('--height', type=int, default=900, help='Height of the synthetic template image')
+        parser.add_argument('--workers', type=int, nargs='+',
+                            help='Pool sizes to run (default: 1 and the number of cores)')
+
+    def handle(self, *args, **options):
+        if Image is None:
+            raise CommandError('Rendering needs Pillow (pip install Pillow).')
+
+        # A noisy image compresses like a photo, unlike a flat colour
+        image = Image.effect_noise((options['width'], options['height']), 64).convert('RGB')
+        out = io.BytesIO()
+        image.save(out, format='JPEG', quality=90)
+        source = out.getvalue()
+        # The same template, decoded for every render and mapped from a scratch asset store
+        with tempfile.TemporaryDirectory() as asset_dir, override_settings(TEMPLATE_ASSET_DIR=asset_dir):
+            inputs = {'decoded': source, 'mapped asset': ingest(source)}
+
+            for label, template in inputs.items():
+                jobs = [(template, f'top text {n}', f'bottom text {n}') for n in range(options['renders'])]
+
+                # In-process baseline, then the pool (its start-up is included)
+                start = time.perf_counter()
+                for job in jobs:
+                    render_derivatives(*job, settings.RENDER_SIZES)
+                self.report(f'{label}, in process', 1, len(jobs), time.perf_counter() - start)
+
+                cores = os.cpu_count() or 1
+                for workers in options['workers'] or sorted({1, cores}):
+                    start = time.perf_counter()
+                    for _ in render_many(jobs, workers):
+                        pass
+                    elapsed = time.perf_counter() - start
+                    self.report(f'{label}, {workers} workers', min(workers, cores), len(jobs), elapsed)
+
+    def report(self, label, cores, count, elapsed):
+        rate = count / elapsed
+        self.stdout.write(f'{label:26} {rate:8.1f} renders/s {rate / cores:8.1f} renders/s/core')
@@ -0,0 +1,67 @@
+import json
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from meme_generator.models import Meme, MemeTemplate
+from meme_generator.renderers import FastJSONRenderer, MessagePackRenderer, msgpack, orjson
+from meme_generator.serializers import (MemeSerializer,
+                                        RecieveMemeSerializer,
+                                        MemeRowSerializer,
+                                        RecieveMemeRowSerializer)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the ModelSerializer read path against the row serializers and renderers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=10000, help='Number of memes to serialize')
+        parser.add_argument('--repeat', type=int, default=3, help='Best of N runs')
+
+    def handle(self, *args, **options):
+        count = options['count']
+        repeat = options['repeat']
+
+        # Build the dataset in memory so the numbers only reflect serialization cost
+        user = User(id=1, username='bench')
+        template = MemeTemplate(id=1, name='Bench', image_url='https://example.com/bench.png')
+        now = timezone.now()
+        memes = [
+            Meme(id=i, template=template, created_by=user, top_text=f'Top {i}', bottom_text=f'Bottom {i}',
+                 created_at=now - timedelta(seconds=i))
+            for i in range(1, count + 1)
+        ]
+        rows = [(m.id, m.top_text, m.bottom_text, m.created_at, m.created_by_id, m.template_id) for m in memes]
+        list_rows = [(m.template_id, m.top_text, m.bottom_text) for m in memes]
+
+        def best(func):
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                func()
+                timings.append(time.perf_counter() - start)
+            return min(timings)
+
+        results = [
+            ('MemeSerializer', best(lambda: MemeSerializer(memes, many=True).data)),
+            ('MemeRowSerializer', best(lambda: MemeRowSerializer(list_rows, many=True).data)),
+            ('RecieveMemeSerializer', best(lambda: RecieveMemeSerializer(memes, many=True).data)),
+            ('RecieveMemeRowSerializer', best(lambda: RecieveMemeRowSerializer(rows, many=True).data)),
+        ]
+
+        payload = RecieveMemeRowSerializer(rows, many=True).data
+        results.append(('JSONRenderer', best(lambda: JSONRenderer().render(payload))))
+        if orjson is not None:
+            results.append(('FastJSONRenderer (orjson)', best(lambda: FastJSONRenderer().render(payload))))
+        if msgpack is not None:
+            results.append(('MessagePackRenderer', best(lambda: MessagePackRenderer().render(payload))))
+
+        self.stdout.write(f'{count} memes, best of {repeat}')
+        for name, seconds in results:
+            self.stdout.write(f'{name:<28} {count / seconds:>14,.0f} memes/sec  {seconds * 1000:>9.1f} ms')
+
+        if options['verbosity'] > 1:
+            self.stdout.write(json.dumps(payload[:1], default=str))
@@ -0,0 +1,25 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from meme_generator.ratings import compact
+
+
+class Command(BaseCommand):
+    help = 'Fold ratings older than the retention horizon into per-meme aggregates'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.RATING_RETENTION_DAYS,
+                            help='Retention horizon in days (default: RATING_RETENTION_DAYS)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Ratings moved per transaction')
+        parser.add_argument('--sleep', type=float, default=0, help='Seconds to pause between batches')
+
+    def handle(self, *args, **options):
+        horizon = timezone.now() - timedelta(days=options['days'])
+
+        def progress(count):
+            self.stdout.write(f'  compacted {count} ratings...')
+
+        count = compact(horizon, options['batch_size'], options['sleep'], progress)
+        self.stdout.write(self.style.SUCCESS(f'Compacted {count} ratings created before {horizon:%Y-%m-%d %H:%M}.'))
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+from meme_generator.assets import AssetError, Image, ingest, ingest_file
+from meme_generator.models import MemeTemplate
+from meme_generator.rendering import SourceUnavailable, fetch_source
+
+
+class Command(BaseCommand):
+    help = 'Store template images pre-decoded in the template asset store, fetching each image_url once'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', nargs=2, metavar=('TEMPLATE_ID', 'PATH'),
+                            help="Ingest a local image file as the template's image instead")
+
+    def handle(self, *args, **options):
+        if Image is None:
+            raise CommandError('Template assets need Pillow (pip install Pillow).')
+
+        if options['path']:
+            template_id, path = options['path']
+            try:
+                key = ingest_file(path)
+            except AssetError as exc:
+                raise CommandError(str(exc))
+            if not MemeTemplate.objects.filter(pk=template_id).update(image_asset=key):
+                raise CommandError(f'Template {template_id} does not exist.')
+            self.stdout.write(self.style.SUCCESS(f'Template {template_id}: stored {key}.'))
+            return
+
+        ingested = failed = 0
+        templates = MemeTemplate.objects.visible().filter(image_asset__isnull=True).order_by('id')
+        for template in templates.iterator():
+            try:
+                key = ingest(fetch_source(template.image_url))
+            except (AssetError, SourceUnavailable) as exc:
+                self.stderr.write(f'Template {template.id}: {exc}')
+                failed += 1
+                continue
+            MemeTemplate.objects.filter(pk=template.pk).update(image_asset=key)
+            ingested += 1
+        self.stdout.write(self.style.SUCCESS(f'Ingested {ingested} template images ({failed} failed).'))
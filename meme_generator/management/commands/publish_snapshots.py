@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+from meme_generator.snapshots import SNAPSHOTS, publish
+
+
+class Command(BaseCommand):
+    help = 'Publish the template catalogue and leaderboard as static, precompressed JSON files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--only', choices=SNAPSHOTS, action='append', help='Publish only this snapshot')
+        parser.add_argument('--dir', help='Target directory (default: SNAPSHOT_DIR)')
+        parser.add_argument('--watch', type=float, metavar='SECONDS',
+                            help='Keep running, republishing changed snapshots every SECONDS')
+
+    def handle(self, *args, **options):
+        names = options['only'] or SNAPSHOTS
+        while True:
+            for name, (version, changed) in publish(names, options['dir']).items():
+                if changed:
+                    self.stdout.write(self.style.SUCCESS(f'{name}: published {version}'))
+                elif not options['watch']:
+                    self.stdout.write(f'{name}: {version} unchanged')
+            if not options['watch']:
+                break
+            time.sleep(options['watch'])
@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+from meme_generator.deletion import purge_pending, request_deletion
+from meme_generator.models import PendingDeletion
+
+
+class Command(BaseCommand):
+    help = 'Purge deleted users, templates and memes in bounded batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Rows deleted per transaction')
+        parser.add_argument('--sleep', type=float, default=0.05, help='Seconds to pause between batches')
+        parser.add_argument('--watch', type=float, metavar='SECONDS',
+                            help='Keep running, checking for new deletions every SECONDS')
+        parser.add_argument('--delete', nargs=2, metavar=('KIND', 'ID'),
+                            help='Request the deletion of an entity (user, template or meme) first')
+
+    def handle(self, *args, **options):
+        if options['delete']:
+            kind, object_id = options['delete']
+            if kind not in dict(PendingDeletion.KIND_CHOICES):
+                self.stderr.write(self.style.ERROR(f'Unknown kind {kind!r}.'))
+                return
+            deletion = request_deletion(kind, int(object_id))
+            self.stdout.write(f'Deletion {deletion.id} of {kind} {object_id} requested.')
+
+        while True:
+            purged = purge_pending(options['batch_size'], options['sleep'], self.report)
+            self.stdout.write(self.style.SUCCESS(f'Purged {purged} deletions.'))
+            if not options['watch']:
+                break
+            time.sleep(options['watch'])
+
+    def report(self, deletion):
+        state = 'done' if deletion.finished_at else 'in progress'
+        self.stdout.write(f'  {deletion.kind} {deletion.object_id}: {deletion.memes_deleted} memes, '
+                          f'{deletion.ratings_deleted} ratings deleted ({state})')
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from meme_generator.models import User, UserStats
+from meme_generator.stats import STATS_FIELDS, compute_user_stats
+
+
+class Command(BaseCommand):
+    help = 'Recompute the per-user stats counters from the meme and rating tables and fix any drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Users processed per batch')
+        parser.add_argument('--dry-run', action='store_true', help='Report drift only, do not write counters')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        dry_run = options['dry_run']
+        scanned = fixed = 0
+
+        last_id = 0
+        while True:
+            user_ids = list(User.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size])
+            if not user_ids:
+                break
+            last_id = user_ids[-1]
+            scanned += len(user_ids)
+
+            # Lock the batch's counters so concurrent writes wait for the fix
+            with transaction.atomic():
+                current = {
+                    row[0]: dict(zip(STATS_FIELDS, row[1:]))
+                    for row in UserStats.objects.select_for_update().filter(pk__in=user_ids)
+                    .values_list('pk', *STATS_FIELDS)
+                }
+                expected = compute_user_stats(user_ids)
+
+                missing, drifted = [], []
+                for user_id, stats in expected.items():
+                    if user_id not in current:
+                        if any(stats.values()):
+                            missing.append(UserStats(user_id=user_id, **stats))
+                    elif current[user_id] != stats:
+                        drifted.append(UserStats(user_id=user_id, **stats))
+                        self.stdout.write(f'  user {user_id}: {current[user_id]} -> {stats}')
+                fixed += len(missing) + len(drifted)
+
+                if not dry_run:
+                    UserStats.objects.bulk_create(missing)
+                    UserStats.objects.bulk_update(drifted, STATS_FIELDS)
+
+        verb = 'Would fix' if dry_run else 'Fixed'
+        self.stdout.write(self.style.SUCCESS(f'{verb} counters of {fixed} of {scanned} users.'))
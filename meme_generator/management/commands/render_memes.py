@@ -0,0 +1,68 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from meme_generator.models import Meme
+from meme_generator.rendering import (Image,
+                                      SourceUnavailable,
+                                      fetch_source,
+                                      has_render,
+                                      render_key,
+                                      render_many,
+                                      store_render,
+                                      template_source)
+
+
+class Command(BaseCommand):
+    help = 'Render every size of the meme images that are not in the render store yet, on a process pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.RENDER_WORKERS, help='Render processes')
+        parser.add_argument('--batch-size', type=int, default=200, help='Memes submitted to the pool at a time')
+
+    def handle(self, *args, **options):
+        if Image is None:
+            raise CommandError('Rendering needs Pillow (pip install Pillow).')
+
+        sources = {}
+        rendered = failed = 0
+        start = time.perf_counter()
+        memes = Meme.objects.visible().select_related('template').order_by('id')
+        last_id = 0
+        while batch := list(memes.filter(id__gt=last_id)[:options['batch_size']]):
+            last_id = batch[-1].id
+            jobs = []
+            for meme in batch:
+                source = template_source(meme.template)
+                if all(has_render(render_key(source, meme.top_text, meme.bottom_text, size))
+                       for size in settings.RENDER_SIZES):
+                    continue
+                # Templates are shared by many memes: fetch each image once per run.
+                # Stored assets are passed by key and mapped by the workers.
+                if source not in sources:
+                    try:
+                        sources[source] = meme.template.image_asset or fetch_source(source)
+                    except SourceUnavailable as exc:
+                        sources[source] = exc
+                        self.stderr.write(str(exc))
+                if isinstance(sources[source], SourceUnavailable):
+                    failed += 1
+                    continue
+                jobs.append(meme)
+
+            results = render_many([(sources[template_source(meme.template)], meme.top_text, meme.bottom_text)
+                                   for meme in jobs], options['workers'])
+            for meme, result in zip(jobs, results):
+                if isinstance(result, SourceUnavailable):
+                    self.stderr.write(f'Meme {meme.id}: {result}')
+                    failed += 1
+                    continue
+                for size, data in result.items():
+                    store_render(render_key(template_source(meme.template), meme.top_text, meme.bottom_text, size),
+                                 data)
+                rendered += 1
+            self.stdout.write(f'  rendered {rendered} memes...')
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Rendered {rendered} memes ({failed} failed) in {elapsed:.1f}s with {options["workers"]} workers.'))
@@ -0,0 +1,86 @@
+import io
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from meme_generator import phash
+from meme_generator.assets import AssetError, open_raster
+from meme_generator.models import MemeTemplate
+from meme_generator.rendering import SourceUnavailable, fetch_source
+
+
+class Command(BaseCommand):
+    help = 'Report clusters of near-duplicate templates by perceptual hash'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--distance', type=int, default=settings.TEMPLATE_SIMILARITY_DISTANCE,
+                            help='Maximum pHash Hamming distance between near-duplicates')
+        parser.add_argument('--backfill', action='store_true',
+                            help="First hash templates that have no hashes yet (fetching image_url when there "
+                                 "is no stored asset)")
+        parser.add_argument('--batch-size', type=int, default=64, help='Images hashed per vectorized batch')
+
+    def handle(self, *args, **options):
+        if not phash.available():
+            raise CommandError('Perceptual hashing needs NumPy and Pillow (pip install numpy Pillow).')
+        if options['backfill']:
+            self.backfill(options['batch_size'])
+
+        templates = dict(MemeTemplate.objects.visible().filter(phash__isnull=False)
+                         .values_list('id', 'phash'))
+        names = dict(MemeTemplate.objects.filter(id__in=templates).values_list('id', 'name'))
+
+        # Union-find over the pairs found by the index
+        parent = {template_id: template_id for template_id in templates}
+
+        def find(template_id):
+            while parent[template_id] != template_id:
+                parent[template_id] = parent[parent[template_id]]
+                template_id = parent[template_id]
+            return template_id
+
+        index = phash.template_index()
+        for template_id, value in templates.items():
+            for _, other_id in index.search(value, options['distance']):
+                if other_id in parent:  # hidden templates are still in the index
+                    parent[find(other_id)] = find(template_id)
+
+        clusters = {}
+        for template_id in sorted(templates):
+            clusters.setdefault(find(template_id), []).append(template_id)
+        clusters = [members for members in clusters.values() if len(members) > 1]
+
+        for members in clusters:
+            first = members[0]
+            self.stdout.write(f'Cluster of {len(members)}:')
+            for template_id in members:
+                d = phash.distance(templates[first], templates[template_id])
+                self.stdout.write(f'  {template_id:6d} {names[template_id]!r} (distance {d} to {first})')
+        duplicates = sum(len(members) - 1 for members in clusters)
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(clusters)} clusters, {duplicates} near-duplicate templates among {len(templates)} hashed.'))
+
+    def backfill(self, batch_size):
+        hashed = failed = 0
+        templates = MemeTemplate.objects.visible().filter(phash__isnull=True).order_by('id')
+        last_id = 0
+        while batch := list(templates.filter(id__gt=last_id)[:batch_size]):
+            last_id = batch[-1].id
+            loaded = []
+            for template in batch:
+                try:
+                    if template.image_asset:
+                        image = open_raster(template.image_asset)
+                    else:
+                        image = phash.Image.open(io.BytesIO(fetch_source(template.image_url)))
+                        image.load()
+                except (AssetError, SourceUnavailable, OSError, ValueError) as exc:
+                    self.stderr.write(f'Template {template.id}: {exc}')
+                    failed += 1
+                    continue
+                loaded.append((template, image))
+
+            for (template, _), hashes in zip(loaded, phash.perceptual_hashes([image for _, image in loaded])):
+                phash.save_hashes(template.pk, hashes)
+                hashed += 1
+        phash.invalidate_index()
+        self.stdout.write(f'Hashed {hashed} templates ({failed} failed).')
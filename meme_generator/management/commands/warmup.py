@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from meme_generator.warmup import warm_up
+
+
+class Command(BaseCommand):
+    help = ('Warm up imports, database connections and the shared caches, and report where the time goes. '
+            'Only caches shared between processes (not the local-memory default) stay warm for the workers.')
+
+    def handle(self, *args, **options):
+        report = warm_up()
+
+        self.stdout.write('imports:')
+        for name, seconds in report['imports'].items():
+            self.stdout.write(f'  {name:32} {seconds * 1000:8.1f} ms')
+        self.stdout.write('caches:')
+        for name, seconds in report['caches'].items():
+            self.stdout.write(f'  {name:32} {seconds * 1000:8.1f} ms')
+        self.stdout.write('steps:')
+        for name, seconds in report['steps'].items():
+            self.stdout.write(f'  {name:32} {seconds * 1000:8.1f} ms')
+        self.stdout.write(self.style.SUCCESS(f"Warm-up finished in {report['total'] * 1000:.1f} ms."))
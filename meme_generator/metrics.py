@@ -0,0 +1,217 @@
+"""In-process request metrics exposed in the Prometheus text format.
+
+Every worker process keeps its own registry. When ``METRICS_DIR`` is set each
+process also writes periodic snapshots of its registry to that directory, and
+the ``/metrics`` endpoint merges the snapshots of all live workers so a scrape
+of any one worker sees the whole server. A worker removes its snapshot when it
+exits, and a scrape removes those of workers that died without doing so; the
+counters of the server then drop, which Prometheus treats as a counter reset.
+"""
+import atexit
+import bisect
+import json
+import os
+import threading
+import time
+
+from django.conf import settings
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Registry:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.in_flight = 0
+        # (route, method) -> [bucket counts..., +Inf count, latency sum]
+        self.latency = {}
+        # (route, method, status) -> count
+        self.responses = {}
+        # (route,) -> [query count, query seconds]
+        self.db = {}
+        # (cache,) -> [hits, misses]
+        self.cache = {}
+        self.next_flush = 0.0
+
+    def observe_request(self, route, method, status_code, seconds, queries, query_seconds):
+        index = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+        with self.lock:
+            latency = self.latency.get((route, method))
+            if latency is None:
+                latency = self.latency[(route, method)] = [0] * (len(LATENCY_BUCKETS) + 2)
+            latency[index] += 1
+            latency[-1] += seconds
+
+            key = (route, method, str(status_code))
+            self.responses[key] = self.responses.get(key, 0) + 1
+
+            db = self.db.get((route,))
+            if db is None:
+                db = self.db[(route,)] = [0, 0.0]
+            db[0] += queries
+            db[1] += query_seconds
+
+    def observe_cache(self, name, hit):
+        with self.lock:
+            counts = self.cache.get((name,))
+            if counts is None:
+                counts = self.cache[(name,)] = [0, 0]
+            counts[0 if hit else 1] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'in_flight': self.in_flight,
+                'latency': [[list(k), list(v)] for k, v in self.latency.items()],
+                'responses': [[list(k), v] for k, v in self.responses.items()],
+                'db': [[list(k), list(v)] for k, v in self.db.items()],
+                'cache': [[list(k), list(v)] for k, v in self.cache.items()],
+            }
+
+
+registry = Registry()
+
+
+def record_cache(name, hit):
+    if settings.METRICS_ENABLED:
+        registry.observe_cache(name, hit)
+
+
+def _snapshot_path(pid):
+    return os.path.join(settings.METRICS_DIR, f'metrics-{pid}.json')
+
+
+def flush(force=False):
+    """Write this process's snapshot to ``METRICS_DIR`` (at most once per interval)."""
+    if not settings.METRICS_DIR:
+        return
+    now = time.monotonic()
+    if not force and now < registry.next_flush:
+        return
+    registry.next_flush = now + settings.METRICS_FLUSH_INTERVAL
+
+    path = _snapshot_path(os.getpid())
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(registry.snapshot(), f)
+    os.replace(tmp_path, path)
+
+
+def _remove_snapshot():
+    if settings.METRICS_DIR:
+        try:
+            os.remove(_snapshot_path(os.getpid()))
+        except FileNotFoundError:
+            pass
+
+
+atexit.register(_remove_snapshot)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _merge(into, snapshot):
+    into['in_flight'] += snapshot['in_flight']
+    for section in ('latency', 'responses', 'db', 'cache'):
+        target = into[section]
+        for labels, value in snapshot[section]:
+            labels = tuple(labels)
+            if isinstance(value, list):
+                current = target.setdefault(labels, [0] * len(value))
+                for i, v in enumerate(value):
+                    current[i] += v
+            else:
+                target[labels] = target.get(labels, 0) + value
+
+
+def collect():
+    """Merge the snapshots of every worker (or just this process) into one view."""
+    merged = {'in_flight': 0, 'latency': {}, 'responses': {}, 'db': {}, 'cache': {}}
+
+    if not settings.METRICS_DIR:
+        _merge(merged, registry.snapshot())
+        return merged
+
+    flush(force=True)
+    for name in os.listdir(settings.METRICS_DIR):
+        if not (name.startswith('metrics-') and name.endswith('.json')):
+            continue
+        pid = int(name[len('metrics-'):-len('.json')])
+        path = os.path.join(settings.METRICS_DIR, name)
+        if not _pid_alive(pid):
+            # Left behind by a worker that was killed
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            continue
+        try:
+            with open(path) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            continue
+        _merge(merged, snapshot)
+    return merged
+
+
+def _labels(**labels):
+    return ','.join(f'{name}="{value}"' for name, value in labels.items())
+
+
+def render_prometheus(merged):
+    lines = [
+        '# HELP meme_http_requests_in_flight Requests currently being served.',
+        '# TYPE meme_http_requests_in_flight gauge',
+        f'meme_http_requests_in_flight {merged["in_flight"]}',
+        '# HELP meme_http_request_duration_seconds Request latency by route.',
+        '# TYPE meme_http_request_duration_seconds histogram',
+    ]
+    for (route, method), values in sorted(merged['latency'].items()):
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), values[:-1]):
+            cumulative += count
+            lines.append(f'meme_http_request_duration_seconds_bucket{{{_labels(route=route, method=method, le=bound)}}} {cumulative}')
+        lines.append(f'meme_http_request_duration_seconds_sum{{{_labels(route=route, method=method)}}} {values[-1]}')
+        lines.append(f'meme_http_request_duration_seconds_count{{{_labels(route=route, method=method)}}} {cumulative}')
+
+    lines += [
+        '# HELP meme_http_responses_total Responses by route and status code.',
+        '# TYPE meme_http_responses_total counter',
+    ]
+    for (route, method, status_code), count in sorted(merged['responses'].items()):
+        lines.append(f'meme_http_responses_total{{{_labels(route=route, method=method, status=status_code)}}} {count}')
+
+    lines += [
+        '# HELP meme_db_queries_total SQL queries executed by route.',
+        '# TYPE meme_db_queries_total counter',
+    ]
+    for (route,), (queries, _) in sorted(merged['db'].items()):
+        lines.append(f'meme_db_queries_total{{{_labels(route=route)}}} {queries}')
+    lines += [
+        '# HELP meme_db_query_seconds_total Time spent in SQL queries by route.',
+        '# TYPE meme_db_query_seconds_total counter',
+    ]
+    for (route,), (_, seconds) in sorted(merged['db'].items()):
+        lines.append(f'meme_db_query_seconds_total{{{_labels(route=route)}}} {seconds}')
+
+    lines += [
+        '# HELP meme_cache_requests_total Cache lookups by cache and result.',
+        '# TYPE meme_cache_requests_total counter',
+    ]
+    for (name,), (hits, misses) in sorted(merged['cache'].items()):
+        lines.append(f'meme_cache_requests_total{{{_labels(cache=name, result="hit")}}} {hits}')
+        lines.append(f'meme_cache_requests_total{{{_labels(cache=name, result="miss")}}} {misses}')
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,211 @@
+import hmac
+import json
+import random
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.http import JsonResponse
+from django.utils.cache import patch_vary_headers
+from . import metrics
+from .compression import compressor, compress, negotiate_encoding
+from .profiling import PROFILERS, QueryRecorder
+
+
+class CompressionMiddleware:
+    """Compress JSON responses with the best encoding the client accepts.
+
+    Supports zstd and brotli when their packages are installed, gzip always.
+    Buffered responses smaller than ``COMPRESSION_MIN_SIZE`` are sent as-is;
+    streaming responses are compressed chunk by chunk. Responses that already
+    carry a Content-Encoding (e.g. precompressed cache entries) are untouched.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+
+        if response.has_header('Content-Encoding'):
+            return response
+        content_type = response.get('Content-Type', '').split(';')[0].strip()
+        if content_type not in settings.COMPRESSION_CONTENT_TYPES:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = negotiate_encoding(request.headers.get('Accept-Encoding'))
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            compress_chunk, finish = compressor(encoding)
+            if response.is_async:
+                response.streaming_content = self._compress_async(response.streaming_content, compress_chunk, finish)
+            else:
+                response.streaming_content = self._compress(response.streaming_content, compress_chunk, finish)
+            del response.headers['Content-Length']
+        else:
+            if len(response.content) < settings.COMPRESSION_MIN_SIZE:
+                return response
+            compressed = compress(response.content, encoding)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response['Content-Length'] = str(len(compressed))
+
+        # The compressed bytes differ from the identity representation
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoding
+        return response
+
+    @staticmethod
+    def _compress(chunks, compress_chunk, finish):
+        for chunk in chunks:
+            data = compress_chunk(chunk)
+            if data:
+                yield data
+        yield finish()
+
+    @staticmethod
+    async def _compress_async(chunks, compress_chunk, finish):
+        async for chunk in chunks:
+            data = compress_chunk(chunk)
+            if data:
+                yield data
+        yield finish()
+
+
+class MetricsMiddleware:
+    """Record per-route latency, status codes and SQL usage for ``/metrics``."""
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = [0, 0.0]
+
+        def timed_execute(execute, sql, params, many, context):
+            start = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                queries[0] += 1
+                queries[1] += time.perf_counter() - start
+
+        registry = metrics.registry
+        with registry.lock:
+            registry.in_flight += 1
+        start = time.perf_counter()
+        try:
+            with connection.execute_wrapper(timed_execute):
+                response = self.get_response(request)
+        finally:
+            with registry.lock:
+                registry.in_flight -= 1
+        elapsed = time.perf_counter() - start
+
+        match = request.resolver_match
+        route = match.route if match else '<unmatched>'
+        registry.observe_request(route, request.method, response.status_code, elapsed, queries[0], queries[1])
+        metrics.flush()
+        return response
+
+
+class AdmissionControlMiddleware:
+    """Shed load once too many requests are in flight in this worker process.
+
+    At most ``ADMISSION_MAX_IN_FLIGHT`` requests run at once. A request that
+    finds every slot taken waits up to ``ADMISSION_QUEUE_TIMEOUT`` seconds for
+    one and is otherwise answered 503 with a Retry-After before it reaches
+    the database. Paths in ``ADMISSION_EXEMPT_PATHS`` always go through.
+    """
+
+    def __init__(self, get_response):
+        if not settings.ADMISSION_MAX_IN_FLIGHT:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.slots = threading.BoundedSemaphore(settings.ADMISSION_MAX_IN_FLIGHT)
+
+    def __call__(self, request):
+        if request.path.startswith(settings.ADMISSION_EXEMPT_PATHS):
+            return self.get_response(request)
+
+        timeout = settings.ADMISSION_QUEUE_TIMEOUT
+        admitted = self.slots.acquire(timeout=timeout) if timeout > 0 else self.slots.acquire(blocking=False)
+        if not admitted:
+            response = JsonResponse({'detail': 'The server is overloaded, retry later.'}, status=503)
+            response['Retry-After'] = str(settings.ADMISSION_RETRY_AFTER)
+            return response
+        try:
+            return self.get_response(request)
+        finally:
+            self.slots.release()
+
+
+class ProfilingMiddleware:
+    """Profile individual requests on demand.
+
+    A request is profiled when it carries an ``X-Profile`` header matching
+    ``PROFILING_TOKEN`` or when it is picked by ``PROFILING_SAMPLE_RATE``. The
+    profile (folded stacks or pstats, see ``PROFILING_MODE``) and the SQL
+    statements with timings are written to ``PROFILING_DIR``, and the response
+    links to the profile. When ``PROFILING_ENABLED`` is off the middleware
+    removes itself from the stack entirely.
+    """
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.profiler_class = PROFILERS[settings.PROFILING_MODE]
+
+    def should_profile(self, request):
+        header = request.headers.get('X-Profile')
+        if header and settings.PROFILING_TOKEN and hmac.compare_digest(header, settings.PROFILING_TOKEN):
+            return True
+        return settings.PROFILING_SAMPLE_RATE > 0 and random.random() < settings.PROFILING_SAMPLE_RATE
+
+    def __call__(self, request):
+        if not self.should_profile(request):
+            return self.get_response(request)
+
+        profiler = self.profiler_class(settings.PROFILING_INTERVAL)
+        queries = QueryRecorder()
+        start = time.perf_counter()
+        profiler.start()
+        try:
+            with connection.execute_wrapper(queries):
+                response = self.get_response(request)
+        finally:
+            profiler.stop()
+        elapsed = time.perf_counter() - start
+
+        directory = Path(settings.PROFILING_DIR)
+        directory.mkdir(parents=True, exist_ok=True)
+        name = f'{time.strftime("%Y%m%d-%H%M%S")}-{uuid.uuid4().hex[:8]}'
+        profile_path = directory / f'{name}.{profiler.extension}'
+        profiler.write(profile_path)
+        with open(directory / f'{name}.sql.json', 'w') as f:
+            json.dump({
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'seconds': elapsed,
+                'queries': queries.queries,
+            }, f, indent=2)
+
+        if settings.PROFILING_URL:
+            url = settings.PROFILING_URL + profile_path.name
+        else:
+            url = profile_path.resolve().as_uri()
+        response['Link'] = f'<{url}>; rel="profile"'
+        return response
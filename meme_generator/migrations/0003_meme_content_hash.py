@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('meme_generator', '0002_alter_meme_bottom_text_alter_meme_created_by_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='meme',
+            name='content_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, unique=True),
+        ),
+    ]
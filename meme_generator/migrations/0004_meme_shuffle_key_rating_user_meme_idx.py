@@ -0,0 +1,45 @@
+import random
+
+from django.db import migrations, models
+
+
+def randomize_shuffle_keys(apps, schema_editor):
+    # AddField evaluates a callable default once for every existing row, so
+    # give each meme its own key here
+    Meme = apps.get_model('meme_generator', 'Meme')
+    last_id = 0
+    while True:
+        ids = list(Meme.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:2000])
+        if not ids:
+            break
+        Meme.objects.bulk_update([Meme(id=meme_id, shuffle_key=random.random()) for meme_id in ids], ['shuffle_key'])
+        last_id = ids[-1]
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('meme_generator', '0003_meme_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='meme',
+            name='shuffle_key',
+            field=models.FloatField(default=0.0, editable=False),
+            preserve_default=False,
+        ),
+        migrations.RunPython(randomize_shuffle_keys, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='meme',
+            name='shuffle_key',
+            field=models.FloatField(default=random.random, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='meme',
+            index=models.Index(fields=['shuffle_key', 'id'], name='meme_shuffle_key_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rating',
+            index=models.Index(fields=['user', 'meme'], name='rating_user_meme_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:46
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('meme_generator', '0004_meme_shuffle_key_rating_user_meme_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='meme_stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('memes_created', models.PositiveIntegerField(default=0)),
+                ('ratings_given', models.PositiveIntegerField(default=0)),
+                ('ratings_received', models.PositiveIntegerField(default=0)),
+                ('score_sum', models.BigIntegerField(default=0)),
+            ],
+        ),
+    ]
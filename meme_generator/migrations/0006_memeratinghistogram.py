@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def build_histograms(apps, schema_editor):
+    Meme = apps.get_model('meme_generator', 'Meme')
+    Rating = apps.get_model('meme_generator', 'Rating')
+    MemeRatingHistogram = apps.get_model('meme_generator', 'MemeRatingHistogram')
+    last_id = 0
+    while True:
+        ids = list(Meme.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:2000])
+        if not ids:
+            break
+        histograms = {}
+        counts = (
+            Rating.objects.filter(meme_id__in=ids, score__gte=1, score__lte=5)
+            .values_list('meme_id', 'score').annotate(n=Count('id'))
+        )
+        for meme_id, score, n in counts:
+            histogram = histograms.setdefault(meme_id, MemeRatingHistogram(meme_id=meme_id))
+            setattr(histogram, f'score_{score}', n)
+        MemeRatingHistogram.objects.bulk_create(histograms.values())
+        last_id = ids[-1]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('meme_generator', '0005_userstats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MemeRatingHistogram',
+            fields=[
+                ('meme', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rating_histogram', serialize=False, to='meme_generator.meme')),
+                ('score_1', models.PositiveIntegerField(default=0)),
+                ('score_2', models.PositiveIntegerField(default=0)),
+                ('score_3', models.PositiveIntegerField(default=0)),
+                ('score_4', models.PositiveIntegerField(default=0)),
+                ('score_5', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(build_histograms, migrations.RunPython.noop),
+    ]
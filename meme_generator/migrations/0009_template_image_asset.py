@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('meme_generator', '0008_compacted_ratings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='memetemplate',
+            name='image_asset',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True),
+        ),
+    ]
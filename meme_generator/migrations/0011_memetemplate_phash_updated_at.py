@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('meme_generator', '0010_template_perceptual_hashes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='memetemplate',
+            name='phash_updated_at',
+            field=models.DateTimeField(blank=True, db_index=True, editable=False, null=True),
+        ),
+    ]
@@ -1,11 +1,38 @@
+import hashlib
+import random
+
 from django.db import models
 from django.contrib.auth.models import User
 
+class MemeTemplateQuerySet(models.QuerySet):
+    def visible(self):
+        return self.filter(deleted_at__isnull=True)
+
+
 class MemeTemplate(models.Model):
     name = models.CharField(max_length=100)
     image_url = models.URLField()
     default_top_text = models.CharField(max_length=100, blank=True)
     default_bottom_text = models.CharField(max_length=100, blank=True)
+    # Key of the pre-decoded image in the template asset store (see meme_generator.assets)
+    image_asset = models.CharField(max_length=64, null=True, blank=True, editable=False)
+    # Perceptual hashes of the image as signed 64-bit integers (see meme_generator.phash)
+    ahash = models.BigIntegerField(null=True, blank=True, editable=False, db_index=True)
+    dhash = models.BigIntegerField(null=True, blank=True, editable=False, db_index=True)
+    phash = models.BigIntegerField(null=True, blank=True, editable=False, db_index=True)
+    # Database time of the last hashing; tells every worker's index to rebuild
+    phash_updated_at = models.DateTimeField(null=True, blank=True, editable=False, db_index=True)
+    # Set when deletion is requested; the row is purged later by purge_deleted
+    deleted_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    objects = MemeTemplateQuerySet.as_manager()
+
+
+class MemeQuerySet(models.QuerySet):
+    def visible(self):
+        """Memes that are not deleted and whose template and creator are not deleted."""
+        return self.filter(deleted_at__isnull=True, template__deleted_at__isnull=True, created_by__is_active=True)
+
 
 class Meme(models.Model):
     template = models.ForeignKey(MemeTemplate, on_delete=models.CASCADE)
@@ -13,12 +40,110 @@ class Meme(models.Model):
     top_text = models.CharField(max_length=255, blank=True)
     bottom_text = models.CharField(max_length=255, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Hash of the normalized content; only the first meme with a given content
+    # holds it, later duplicates (if allowed) leave it empty
+    content_hash = models.CharField(max_length=64, null=True, blank=True, unique=True, editable=False)
+    # Random sort key fixed at creation, so feeds can be shuffled and still be
+    # paginated with an index-backed keyset cursor
+    shuffle_key = models.FloatField(default=random.random, editable=False)
+    # Set when deletion is requested; the row is purged later by purge_deleted
+    deleted_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    objects = MemeQuerySet.as_manager()
+
+    class Meta:
+        indexes = [models.Index(fields=['shuffle_key', 'id'], name='meme_shuffle_key_idx')]
+
+    @staticmethod
+    def compute_content_hash(template_id, top_text, bottom_text):
+        def normalize(text):
+            return ' '.join(text.split()).casefold()
+
+        content = f'{template_id}\x1f{normalize(top_text)}\x1f{normalize(bottom_text)}'
+        return hashlib.sha256(content.encode()).hexdigest()
+
+
+# Valid rating scores; each has a counter in MemeRatingHistogram
+RATING_SCORES = range(1, 6)
 
 
 class Rating(models.Model):
     meme = models.ForeignKey(Meme, on_delete=models.CASCADE)
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='meme_generator_ratings')  # Add related_name here
     score = models.IntegerField()
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
     class Meta:
         unique_together = ('meme', 'user')
+        # The unique index leads with meme; this one serves "rated by user" lookups
+        indexes = [models.Index(fields=['user', 'meme'], name='rating_user_meme_idx')]
+
+
+class CompactedRating(models.Model):
+    """A rating older than the retention horizon, moved out of ``Rating`` by ``compact_ratings``.
+
+    Only the user's latest score is kept, so a user still rates a meme at
+    most once across both tables. Aggregate queries read its totals from
+    ``RatingAggregate`` instead of scanning these rows.
+    """
+    meme = models.ForeignKey(Meme, on_delete=models.CASCADE, related_name='compacted_ratings')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    score = models.IntegerField()
+
+    class Meta:
+        unique_together = ('meme', 'user')
+        indexes = [models.Index(fields=['user', 'meme'], name='compacted_user_meme_idx')]
+
+
+class RatingAggregate(models.Model):
+    """Number and score sum of the compacted ratings of a meme."""
+    meme = models.OneToOneField(Meme, on_delete=models.CASCADE, primary_key=True, related_name='rating_aggregate')
+    count = models.PositiveIntegerField(default=0)
+    score_sum = models.BigIntegerField(default=0)
+
+
+class UserStats(models.Model):
+    """Per-user counters kept up to date by the meme and rating endpoints.
+
+    Rows are written in the same transaction as the meme or rating they count,
+    and ``reconcile_user_stats`` recomputes them from the source tables.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='meme_stats')
+    memes_created = models.PositiveIntegerField(default=0)
+    ratings_given = models.PositiveIntegerField(default=0)
+    # Ratings received by the user's memes; their average is score_sum / ratings_received
+    ratings_received = models.PositiveIntegerField(default=0)
+    score_sum = models.BigIntegerField(default=0)
+
+
+class MemeRatingHistogram(models.Model):
+    """Number of ratings of a meme per score, updated with every rating write."""
+    meme = models.OneToOneField(Meme, on_delete=models.CASCADE, primary_key=True, related_name='rating_histogram')
+    score_1 = models.PositiveIntegerField(default=0)
+    score_2 = models.PositiveIntegerField(default=0)
+    score_3 = models.PositiveIntegerField(default=0)
+    score_4 = models.PositiveIntegerField(default=0)
+    score_5 = models.PositiveIntegerField(default=0)
+
+
+class PendingDeletion(models.Model):
+    """A deletion request processed in bounded batches by ``purge_deleted``.
+
+    The entity is hidden from reads as soon as the request exists. The
+    counters report the purge's progress.
+    """
+    USER = 'user'
+    TEMPLATE = 'template'
+    MEME = 'meme'
+    KIND_CHOICES = [(USER, 'User'), (TEMPLATE, 'Meme template'), (MEME, 'Meme')]
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    object_id = models.PositiveBigIntegerField()
+    requested_by = models.ForeignKey(User, null=True, on_delete=models.SET_NULL, related_name='+')
+    requested_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    memes_deleted = models.PositiveIntegerField(default=0)
+    ratings_deleted = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['kind', 'object_id'], name='unique_pending_deletion')]
@@ -0,0 +1,213 @@
+"""Perceptual hashes of template images and near-duplicate search.
+
+``perceptual_hashes`` computes three 64-bit hashes per image with NumPy,
+vectorized over a batch of images:
+
+* aHash: 8x8 grayscale thumbnail, pixels above the mean.
+* dHash: 9x8 thumbnail, each pixel brighter than its left neighbour.
+* pHash: 32x32 thumbnail, the 8x8 lowest DCT frequencies above their median.
+
+Images that look alike have hashes a few bits apart, whatever their size,
+format or compression. Hashes are stored as signed 64-bit integers in indexed
+``MemeTemplate`` columns.
+
+``similar_templates`` finds templates within a Hamming distance of a pHash
+through a multi-index hash (``MultiIndex``), which only looks at templates
+sharing a nearly identical 16-bit chunk with the query. Each process builds
+the index once and rebuilds it when a template is saved or deleted: through
+a version token in the cache for changes made by this process (or by any
+process, with a shared cache), and through the count and highest id of hashed
+templates for templates hashed by other workers. NumPy and Pillow are
+optional dependencies; without them no hashes are computed.
+"""
+import threading
+import uuid
+
+from django.core.cache import cache
+from django.db.models import Count, Max
+from django.db.models.functions import Now
+
+from .models import MemeTemplate
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover - optional dependency
+    numpy = None
+
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover - optional dependency
+    Image = None
+
+HASHES = ('ahash', 'dhash', 'phash')
+CHUNKS = 4
+CHUNK_BITS = 16
+# Per-chunk radius from which a search scans all entries instead (2,517 masks
+# per chunk at 4 flips)
+LINEAR_CHUNK_RADIUS = 4
+INDEX_VERSION_KEY = 'templates:phash:version'
+
+_DCT_SIZE = 32
+
+
+def available():
+    return numpy is not None and Image is not None
+
+
+def _dct_matrix(n):
+    # Orthonormal DCT-II: dct(x) = D @ x
+    k = numpy.arange(n)[:, None]
+    i = numpy.arange(n)[None, :]
+    matrix = numpy.cos(numpy.pi * (2 * i + 1) * k / (2 * n)) * numpy.sqrt(2 / n)
+    matrix[0] /= numpy.sqrt(2)
+    return matrix
+
+
+def _grays(images, width, height):
+    """Stack ``images`` as a float array of shape (count, height, width)."""
+    return numpy.stack([
+        numpy.asarray(image.convert('L').resize((width, height), Image.LANCZOS), dtype=numpy.float64)
+        for image in images
+    ])
+
+
+def _pack(bits):
+    """Turn a (count, 8, 8) boolean array into signed 64-bit integers."""
+    packed = numpy.packbits(bits.reshape(len(bits), 64), axis=1)
+    return [to_signed(int.from_bytes(row.tobytes(), 'big')) for row in packed]
+
+
+def to_signed(value):
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def distance(a, b):
+    """Hamming distance between two stored (signed) hashes."""
+    return ((a ^ b) & 0xFFFFFFFFFFFFFFFF).bit_count()
+
+
+def perceptual_hashes(images):
+    """Return ``[{'ahash': int, 'dhash': int, 'phash': int}]`` for Pillow ``images``."""
+    if not images:
+        return []
+    small = _grays(images, 8, 8)
+    ahash = _pack(small > small.mean(axis=(1, 2), keepdims=True))
+
+    wide = _grays(images, 9, 8)
+    dhash = _pack(wide[:, :, 1:] > wide[:, :, :-1])
+
+    dct = _dct_matrix(_DCT_SIZE)
+    frequencies = dct @ _grays(images, _DCT_SIZE, _DCT_SIZE) @ dct.T
+    low = frequencies[:, :8, :8].reshape(len(images), 64)
+    # The DC term is the average brightness and would dominate the median
+    median = numpy.median(low[:, 1:], axis=1, keepdims=True)
+    phash = _pack(low > median)
+
+    return [{'ahash': a, 'dhash': d, 'phash': p} for a, d, p in zip(ahash, dhash, phash)]
+
+
+_flips = {}
+
+
+def _chunk_flips(radius):
+    """All 16-bit masks with at most ``radius`` bits set."""
+    if radius not in _flips:
+        _flips[radius] = [mask for mask in range(1 << CHUNK_BITS) if mask.bit_count() <= radius]
+    return _flips[radius]
+
+
+class MultiIndex:
+    """Multi-index hashing of 64-bit hashes for Hamming range search.
+
+    Every hash is filed under each of its four 16-bit chunks. Two hashes
+    within distance ``r`` agree to within ``r // 4`` bits on at least one
+    chunk, so a search only probes, per chunk, the buckets within that many
+    bit flips and checks the hashes found there.
+    """
+
+    def __init__(self):
+        self.tables = [{} for _ in range(CHUNKS)]
+        self.entries = []
+
+    def _chunks(self, value):
+        value &= 0xFFFFFFFFFFFFFFFF
+        return [(value >> (CHUNK_BITS * i)) & 0xFFFF for i in range(CHUNKS)]
+
+    def add(self, value, item):
+        self.entries.append((value, item))
+        for table, chunk in zip(self.tables, self._chunks(value)):
+            table.setdefault(chunk, []).append((value, item))
+
+    def search(self, value, radius):
+        """Return ``[(distance, item)]`` for the items within ``radius`` of ``value``."""
+        if radius // CHUNKS >= LINEAR_CHUNK_RADIUS:
+            # Probing every 16-bit mask within that many flips costs more than a scan
+            return [(d, item) for candidate, item in self.entries if (d := distance(value, candidate)) <= radius]
+        flips = _chunk_flips(radius // CHUNKS)
+        seen = set()
+        found = []
+        for table, chunk in zip(self.tables, self._chunks(value)):
+            for flip in flips:
+                for candidate, item in table.get(chunk ^ flip, ()):
+                    if item not in seen:
+                        seen.add(item)
+                        d = distance(value, candidate)
+                        if d <= radius:
+                            found.append((d, item))
+        return found
+
+
+def invalidate_index():
+    cache.set(INDEX_VERSION_KEY, uuid.uuid4().hex, None)
+
+
+def _index_version():
+    token = cache.get(INDEX_VERSION_KEY)
+    if token is None:
+        cache.add(INDEX_VERSION_KEY, uuid.uuid4().hex, None)
+        token = cache.get(INDEX_VERSION_KEY)
+    # The token only reaches other workers through a shared cache; templates
+    # hashed, re-hashed or deleted elsewhere change these (one indexed aggregate)
+    hashed = MemeTemplate.objects.filter(phash__isnull=False).aggregate(
+        count=Count('id'), last=Max('id'), updated=Max('phash_updated_at'))
+    return token, hashed['count'], hashed['last'], hashed['updated']
+
+
+_index_lock = threading.Lock()
+_index = (None, None)
+
+
+def template_index():
+    """The multi-index of all hashed templates' pHashes, rebuilt when templates change."""
+    global _index
+    version = _index_version()
+    with _index_lock:
+        if _index[0] != version:
+            index = MultiIndex()
+            for template_id, phash in MemeTemplate.objects.filter(phash__isnull=False).values_list('id', 'phash'):
+                index.add(phash, template_id)
+            _index = (version, index)
+        return _index[1]
+
+
+def similar_templates(phash, radius, exclude=None):
+    """``[(distance, template_id)]`` of visible templates within ``radius`` of ``phash``, closest first."""
+    matches = [(d, template_id) for d, template_id in template_index().search(phash, radius) if template_id != exclude]
+    visible = set(MemeTemplate.objects.visible().filter(id__in=[template_id for _, template_id in matches])
+                  .values_list('id', flat=True))
+    return sorted(match for match in matches if match[1] in visible)
+
+
+def save_hashes(template_id, hashes):
+    """Store ``hashes`` on a template, stamped with the database's clock."""
+    MemeTemplate.objects.filter(pk=template_id).update(phash_updated_at=Now(), **hashes)
+
+
+def hash_template(template, image):
+    """Store the hashes of ``image`` on ``template``."""
+    hashes = perceptual_hashes([image])[0]
+    save_hashes(template.pk, hashes)
+    for name, value in hashes.items():
+        setattr(template, name, value)
+    invalidate_index()
+    return hashes
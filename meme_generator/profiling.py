@@ -0,0 +1,83 @@
+"""Per-request profilers used by ProfilingMiddleware."""
+import cProfile
+import sys
+import threading
+import time
+from collections import Counter
+
+
+class SamplingProfiler:
+    """Statistical profiler sampling one thread's stack at a fixed interval.
+
+    Samples are aggregated as folded stacks (``frame;frame;frame count``), the
+    input format of flamegraph.pl, speedscope and most flame-graph tools.
+    """
+    extension = 'folded'
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.samples = Counter()
+        self._thread_id = threading.get_ident()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+
+    def start(self):
+        self._sampler.start()
+
+    def stop(self):
+        self._stop.set()
+        self._sampler.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_filename}:{code.co_name}:{frame.f_lineno}')
+                frame = frame.f_back
+            self.samples[';'.join(reversed(stack))] += 1
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.samples.most_common():
+                f.write(f'{stack} {count}\n')
+
+
+class DeterministicProfiler:
+    """cProfile-based profiler; writes pstats files (flameprof, snakeviz)."""
+    extension = 'prof'
+
+    def __init__(self, interval=None):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def write(self, path):
+        self.profile.dump_stats(path)
+
+
+PROFILERS = {
+    'sampling': SamplingProfiler,
+    'cprofile': DeterministicProfiler,
+}
+
+
+class QueryRecorder:
+    """``connection.execute_wrapper`` recording every statement with its duration."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({'sql': sql, 'many': many, 'seconds': time.perf_counter() - start})
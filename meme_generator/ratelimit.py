@@ -0,0 +1,159 @@
+"""Token-bucket rate limits for write endpoints.
+
+Every scope in ``RATE_LIMITS`` has a bucket per user and/or per client IP.
+A bucket holds up to ``burst`` tokens and refills at ``rate`` (e.g.
+``'30/min'``); each request takes a token, and a request finding its bucket
+empty is answered 429 with a Retry-After.
+
+A bucket is a single integer: the time in microseconds at which it will be
+full again (the "theoretical arrival time" of GCRA). By default buckets are
+kept in a dict of the worker process (``LocalBuckets``). With
+``RATE_LIMIT_CACHE_ALIAS`` naming a memcached or redis cache they are shared
+by all workers (``CacheBuckets``): taking a token is one atomic ``incr`` of
+that time by the refill interval, and a ``decr`` hands it back when the
+bucket was already empty, so concurrent requests never lose each other's
+updates.
+"""
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework import status
+from rest_framework.response import Response
+
+PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+
+# A key expiring while its bucket is in use starts it over full, which grants
+# at most one extra burst per this many seconds
+MIN_KEY_TTL = 60 * 60
+
+
+def parse_rate(rate):
+    """``'30/min'`` -> microseconds between two tokens."""
+    count, period = rate.split('/')
+    return PERIODS[period[0]] * 1_000_000 // int(count)
+
+
+def client_ip(request):
+    """The client address, as appended to X-Forwarded-For by the trusted proxies."""
+    proxies = settings.RATE_LIMIT_TRUSTED_PROXIES
+    if proxies:
+        forwarded = [part.strip() for part in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',')]
+        if len(forwarded) >= proxies and forwarded[-proxies]:
+            return forwarded[-proxies]
+    return request.META.get('REMOTE_ADDR', '')
+
+
+class LocalBuckets:
+    """Buckets of this process, in a dict under a lock.
+
+    ``take`` returns 0, or the seconds until the bucket has a token again.
+    """
+
+    def __init__(self, max_entries=100000):
+        self.lock = threading.Lock()
+        self.full_at = {}
+        self.max_entries = max_entries
+
+    def take(self, key, interval, burst, now):
+        with self.lock:
+            full_at = max(self.full_at.get(key, now), now) + interval
+            excess = full_at - now - burst * interval
+            if excess > 0:
+                return excess / 1_000_000
+            if key not in self.full_at and len(self.full_at) >= self.max_entries:
+                # Buckets that are full again carry no state
+                self.full_at = {k: v for k, v in self.full_at.items() if v > now}
+            self.full_at[key] = full_at
+            return 0
+
+    def give_back(self, key, interval):
+        """Return a token taken by ``take``."""
+        with self.lock:
+            if key in self.full_at:
+                self.full_at[key] -= interval
+
+    def clear(self):
+        with self.lock:
+            self.full_at.clear()
+
+
+class CacheBuckets:
+    """Buckets in a Django cache, shared by every process using it."""
+
+    def __init__(self, alias):
+        self.alias = alias
+
+    def take(self, key, interval, burst, now):
+        store = caches[self.alias]
+        ttl = max(MIN_KEY_TTL, burst * interval // 1_000_000)
+        try:
+            full_at = store.incr(key, interval)
+        except ValueError:
+            # No bucket yet: it starts full, minus this token
+            if store.add(key, now + interval, ttl):
+                return 0
+            full_at = store.incr(key, interval)
+
+        if full_at < now + interval:
+            # The bucket had refilled completely. Not atomic: requests racing
+            # here each get a token, at most one extra each.
+            store.set(key, now + interval, ttl)
+            return 0
+        excess = full_at - now - burst * interval
+        if excess > 0:
+            store.decr(key, interval)
+            return excess / 1_000_000
+        return 0
+
+    def give_back(self, key, interval):
+        try:
+            caches[self.alias].decr(key, interval)
+        except ValueError:
+            pass  # Expired meanwhile: the bucket is full anyway
+
+    def clear(self):
+        caches[self.alias].clear()
+
+
+_local = LocalBuckets()
+
+
+def buckets():
+    """Where buckets are kept, per ``RATE_LIMIT_CACHE_ALIAS``."""
+    alias = settings.RATE_LIMIT_CACHE_ALIAS
+    return CacheBuckets(alias) if alias else _local
+
+
+def rate_limit_response(request, scope, user_id=None):
+    """Take a token from each of ``scope``'s buckets for this request.
+
+    Returns None when the request may go ahead, else a 429 response. A
+    refused request costs nothing: tokens already taken from the scope's other
+    buckets are handed back. Call it after authentication so ``user_id``
+    cannot be forged.
+    """
+    if not settings.RATE_LIMIT_ENABLED:
+        return None
+    limits = settings.RATE_LIMITS.get(scope, {})
+    store = buckets()
+    now = int(time.time() * 1_000_000)
+    taken = []
+    for kind, identity in (('user', user_id), ('ip', client_ip(request))):
+        if kind not in limits or identity is None:
+            continue
+        rate, burst = limits[kind]
+        key, interval = f'ratelimit:{scope}:{kind}:{identity}', parse_rate(rate)
+        wait = store.take(key, interval, burst, now)
+        if wait:
+            for taken_key, taken_interval in taken:
+                store.give_back(taken_key, taken_interval)
+            retry_after = math.ceil(wait)
+            response = Response({'detail': f'Too many requests, retry in {retry_after} seconds.'},
+                                status=status.HTTP_429_TOO_MANY_REQUESTS)
+            response['Retry-After'] = str(retry_after)
+            return response
+        taken.append((key, interval))
+    return None
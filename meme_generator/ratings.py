@@ -0,0 +1,111 @@
+"""Two-tier rating storage: live ratings and compacted aggregates.
+
+Recent ratings are rows of ``Rating``. ``compact`` moves ratings older than
+``RATING_RETENTION_DAYS`` into ``CompactedRating``, which keeps one row per
+user and meme with the latest score so ratings stay unique, and folds them
+into the per-meme ``RatingAggregate`` totals. ``with_rating_totals`` combines
+both tiers, so aggregate queries only scan the live ratings inside the
+retention window plus one aggregate row per meme.
+"""
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.db.models import Count, F, FloatField, IntegerField, Sum
+from django.db.models.functions import Cast, Coalesce, NullIf
+
+from .models import CompactedRating, Rating, RatingAggregate
+
+_muted = threading.local()
+
+
+@contextmanager
+def rating_signals_muted():
+    """Skip the per-row cache invalidation and events of rating and meme signals.
+
+    For moves that change no totals, and for bulk deletes that invalidate
+    once per batch instead.
+    """
+    _muted.active = True
+    try:
+        yield
+    finally:
+        _muted.active = False
+
+
+def rating_signals_are_muted():
+    return getattr(_muted, 'active', False)
+
+
+def with_rating_totals(queryset):
+    """Annotate memes with ``rating_count`` and ``avg_rating`` over both tiers."""
+    count = Count('rating') + Coalesce(F('rating_aggregate__count'), 0, output_field=IntegerField())
+    total = (Coalesce(Sum('rating__score'), 0, output_field=IntegerField())
+             + Coalesce(F('rating_aggregate__score_sum'), 0, output_field=IntegerField()))
+    return queryset.annotate(rating_count=count, avg_rating=Cast(total, FloatField()) / NullIf(count, 0))
+
+
+def _apply_totals(deltas, sign=1):
+    """Add ``deltas[meme_id] = (count, score_sum)`` to the aggregates, grouping equal deltas."""
+    if sign > 0:
+        RatingAggregate.objects.bulk_create([RatingAggregate(meme_id=meme_id) for meme_id in deltas],
+                                            ignore_conflicts=True)
+    groups = defaultdict(list)
+    for meme_id, delta in deltas.items():
+        groups[delta].append(meme_id)
+    for (count, score_sum), meme_ids in groups.items():
+        RatingAggregate.objects.filter(pk__in=meme_ids).update(
+            count=F('count') + sign * count, score_sum=F('score_sum') + sign * score_sum)
+
+
+def record_compacted_score_change(meme_id, score, old_score):
+    RatingAggregate.objects.filter(pk=meme_id).update(score_sum=F('score_sum') + (score - old_score))
+
+
+def record_compacted_deleted(ratings):
+    """Remove deleted compacted ratings, given as ``(meme_id, score)`` pairs, from the aggregates."""
+    deltas = defaultdict(lambda: (0, 0))
+    for meme_id, score in ratings:
+        count, score_sum = deltas[meme_id]
+        deltas[meme_id] = (count + 1, score_sum + score)
+    _apply_totals(dict(deltas), sign=-1)
+
+
+def compact(horizon, batch_size=1000, pause=0, progress=None):
+    """Move the ratings created before ``horizon`` to the compacted tier.
+
+    Works through ``batch_size`` ratings per transaction, sleeping ``pause``
+    seconds between batches and calling ``progress(compacted)`` after each.
+    Returns the number of ratings compacted.
+    """
+    compacted = 0
+    while True:
+        with transaction.atomic():
+            rows = list(
+                Rating.objects.select_for_update()
+                .filter(created_at__lt=horizon)
+                .order_by('id')
+                .values_list('id', 'meme_id', 'user_id', 'score')[:batch_size]
+            )
+            if not rows:
+                break
+            CompactedRating.objects.bulk_create([
+                CompactedRating(meme_id=meme_id, user_id=user_id, score=score) for _, meme_id, user_id, score in rows
+            ])
+            deltas = defaultdict(lambda: (0, 0))
+            for _, meme_id, _, score in rows:
+                count, score_sum = deltas[meme_id]
+                deltas[meme_id] = (count + 1, score_sum + score)
+            _apply_totals(dict(deltas))
+            # Totals are unchanged: no leaderboard invalidation or events
+            with rating_signals_muted():
+                Rating.objects.filter(id__in=[row[0] for row in rows]).delete()
+
+        compacted += len(rows)
+        if progress:
+            progress(compacted)
+        if pause:
+            time.sleep(pause)
+    return compacted
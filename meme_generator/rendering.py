@@ -0,0 +1,236 @@
+"""Meme images in several sizes.
+
+``render_derivatives`` draws the meme texts on a template image and derives
+every size in ``RENDER_SIZES`` from that single render, each from the next
+larger one. Templates with a stored asset (see ``meme_generator.assets``)
+are read from their memory-mapped raster; others are fetched from their URL
+and decoded once per render. Jobs only carry bytes or asset keys, so batches
+fan out over a process pool (``render_many``).
+
+Rendered images go to a content-addressed store under ``RENDER_CACHE_DIR``:
+the file name is a hash of everything the image depends on (renderer
+version, template asset or image URL, texts and size), so an entry never
+changes and is never invalidated. Pillow is an optional dependency; without it
+``Image`` is ``None`` and nothing can be rendered.
+"""
+import hashlib
+import http.client
+import io
+import ipaddress
+import socket
+import urllib.parse
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+
+from .assets import AssetError, open_raster
+from .snapshots import write_atomic
+
+try:
+    from PIL import Image, ImageDraw, ImageFont
+except ImportError:  # pragma: no cover - optional dependency
+    Image = ImageDraw = ImageFont = None
+
+# Bump when the drawing changes to re-render everything
+RENDER_VERSION = 1
+
+# Photo-like templates barely compress past zlib level 1, while level 6 made
+# PNG encoding ~3.5x slower and the whole render ~2.5x slower
+PNG_COMPRESS_LEVEL = 1
+
+
+class SourceUnavailable(Exception):
+    """The template image could not be fetched or decoded."""
+
+
+def template_source(template):
+    """What a template's renders are made from: its stored asset key, or else its image URL."""
+    return template.image_asset or template.image_url
+
+
+def render_key(source, top_text, bottom_text, size):
+    parts = (str(RENDER_VERSION), source, top_text, bottom_text, size, str(settings.RENDER_SIZES[size]))
+    return hashlib.sha256('\0'.join(parts).encode()).hexdigest()
+
+
+def _path(key):
+    return Path(settings.RENDER_CACHE_DIR) / key[:2] / f'{key}.png'
+
+
+def get_render(key):
+    """Stored PNG bytes for ``key``, or None."""
+    try:
+        return _path(key).read_bytes()
+    except FileNotFoundError:
+        return None
+
+
+def has_render(key):
+    return _path(key).exists()
+
+
+def store_render(key, data):
+    path = _path(key)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    write_atomic(path, data)
+
+
+def _connect_public(address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, source_address=None):
+    """``socket.create_connection`` refusing hosts with a non-global address.
+
+    The check is made on the addresses actually connected to, so redirects
+    and DNS answers changing between lookups cannot reach internal services.
+    """
+    host, port = address
+    addresses = [info[4][0] for info in socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)]
+    for ip in addresses:
+        ip = ipaddress.ip_address(ip.split('%')[0])
+        if ip.version == 6 and ip.ipv4_mapped:
+            ip = ip.ipv4_mapped
+        if not ip.is_global:
+            raise OSError(f'{host} resolves to the non-public address {ip}')
+    error = None
+    for ip in addresses:
+        try:
+            return socket.create_connection((ip, port), timeout, source_address)
+        except OSError as exc:
+            error = exc
+    raise error
+
+
+class _PublicHTTPConnection(http.client.HTTPConnection):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = _connect_public
+
+
+class _PublicHTTPSConnection(http.client.HTTPSConnection):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = _connect_public
+
+
+class _PublicHTTPHandler(urllib.request.HTTPHandler):
+
+    def http_open(self, req):
+        return self.do_open(_PublicHTTPConnection, req)
+
+
+class _PublicHTTPSHandler(urllib.request.HTTPSHandler):
+
+    def https_open(self, req):
+        return self.do_open(_PublicHTTPSConnection, req, context=self._context)
+
+
+def _public_opener():
+    # Only http(s), without proxies: redirects cannot switch to ftp:// or file://
+    opener = urllib.request.OpenerDirector()
+    for handler in (_PublicHTTPHandler(), _PublicHTTPSHandler(), urllib.request.HTTPDefaultErrorHandler(),
+                    urllib.request.HTTPRedirectHandler(), urllib.request.HTTPErrorProcessor(),
+                    urllib.request.UnknownHandler()):
+        opener.add_handler(handler)
+    return opener
+
+
+def fetch_source(image_url):
+    """Download a template image, up to ``RENDER_MAX_SOURCE_BYTES``.
+
+    This is a server-side request to a user-supplied URL, so it is off unless
+    ``RENDER_FETCH_REMOTE`` is set, limited to http(s) and only connects to
+    public addresses, redirects included.
+    """
+    if not settings.RENDER_FETCH_REMOTE:
+        raise SourceUnavailable('Templates without a stored image cannot be rendered.')
+    if urllib.parse.urlsplit(image_url).scheme not in ('http', 'https'):
+        raise SourceUnavailable(f'{image_url} is not an http(s) URL')
+    try:
+        with _public_opener().open(image_url, timeout=settings.RENDER_FETCH_TIMEOUT) as response:
+            data = response.read(settings.RENDER_MAX_SOURCE_BYTES + 1)
+    except (OSError, ValueError, http.client.HTTPException) as exc:
+        raise SourceUnavailable(f'Could not fetch {image_url}: {exc}')
+    if len(data) > settings.RENDER_MAX_SOURCE_BYTES:
+        raise SourceUnavailable(f'{image_url} is larger than {settings.RENDER_MAX_SOURCE_BYTES} bytes')
+    return data
+
+
+def _font(size):
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:  # Pillow < 10.1 has a single bitmap font
+        return ImageFont.load_default()
+
+
+def _draw_text(draw, text, width, height, top):
+    if not text:
+        return
+    font = _font(max(12, height // 10))
+    stroke = max(1, height // 200)
+    left, upper, right, lower = draw.textbbox((0, 0), text, font=font, stroke_width=stroke)
+    x = (width - (right - left)) / 2 - left
+    margin = height // 40
+    y = margin - upper if top else height - margin - lower
+    draw.text((x, y), text, font=font, fill='white', stroke_width=stroke, stroke_fill='black')
+
+
+def render_derivatives(source, top_text, bottom_text, sizes):
+    """Render a meme and return ``{size: png_bytes}`` for ``sizes`` (``{size: width or None}``).
+
+    ``source`` is the encoded template image, or the key of its stored asset.
+    """
+    try:
+        # Opening only reads the header; the pixels are decoded by convert(),
+        # which for mapped assets copies them, the only per-render cost of the template
+        image = open_raster(source) if isinstance(source, str) else Image.open(io.BytesIO(source))
+        if image.width * image.height > settings.TEMPLATE_MAX_PIXELS:
+            raise SourceUnavailable(f'The template image is larger than {settings.TEMPLATE_MAX_PIXELS} pixels.')
+        image = image.convert('RGB')
+    except AssetError as exc:
+        raise SourceUnavailable(str(exc))
+    except (OSError, ValueError, Image.DecompressionBombError) as exc:
+        raise SourceUnavailable(f'Could not decode the template image: {exc}')
+
+    draw = ImageDraw.Draw(image)
+    _draw_text(draw, top_text.upper(), image.width, image.height, top=True)
+    _draw_text(draw, bottom_text.upper(), image.width, image.height, top=False)
+
+    # Largest first, so every size is reduced from the closest larger one
+    rendered = {}
+    for name, width in sorted(sizes.items(), key=lambda item: -(item[1] or image.width)):
+        if width and width < image.width:
+            image = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+        out = io.BytesIO()
+        image.save(out, format='PNG', compress_level=PNG_COMPRESS_LEVEL)
+        rendered[name] = out.getvalue()
+    return rendered
+
+
+def render_meme(meme):
+    """Render ``meme`` (with its template loaded) in every size and store the images."""
+    template = meme.template
+    source = template.image_asset or fetch_source(template.image_url)
+    rendered = render_derivatives(source, meme.top_text, meme.bottom_text, settings.RENDER_SIZES)
+    for name, data in rendered.items():
+        store_render(render_key(template_source(template), meme.top_text, meme.bottom_text, name), data)
+    return rendered
+
+
+def render_many(jobs, workers=None):
+    """Render ``(source, top_text, bottom_text)`` jobs on a process pool.
+
+    Sources are encoded images or asset keys, as for ``render_derivatives``.
+
+    Yields ``{size: png_bytes}`` (or the ``SourceUnavailable`` raised) per job,
+    in order.
+    """
+    sizes = settings.RENDER_SIZES
+    with ProcessPoolExecutor(workers or settings.RENDER_WORKERS) as pool:
+        futures = [pool.submit(render_derivatives, source, top, bottom, sizes) for source, top, bottom in jobs]
+        for future in futures:
+            try:
+                yield future.result()
+            except SourceUnavailable as exc:
+                yield exc
@@ -1,10 +1,21 @@
+import logging
+
+from django.conf import settings
 from django.contrib.auth import authenticate
 from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.utils import timezone
 from rest_framework import serializers
 from rest_framework.authtoken.models import Token
 from .utils import authenticate_user
-from rest_framework.exceptions import AuthenticationFailed
-from .models import Meme, MemeTemplate, Rating
+from .stats import record_meme_created
+from .ratings import with_rating_totals
+from .assets import AssetError, Image, ingest, open_raster
+from . import phash
+from rest_framework.exceptions import APIException, AuthenticationFailed
+from .models import RATING_SCORES, Meme, MemeTemplate, PendingDeletion, Rating
+
+logger = logging.getLogger(__name__)
 
 class UserSignupSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True)
@@ -44,10 +55,9 @@ class UserLoginSerializer(serializers.Serializer):
     password = serializers.CharField()
 
     def validate(self, data):
-        print(data)
-
         user = authenticate(**data)
         if user is None:
+            logger.info('Failed login', extra={'username': data['username']})
             raise serializers.ValidationError("Invalid credentials")
         
         token, created = Token.objects.get_or_create(user=user)
@@ -62,7 +72,6 @@ class UserLogoutSerializer(serializers.Serializer):
         # Check if the user exists
         try:
             user = User.objects.get(username=value)
-            print('user:',user)
         except User.DoesNotExist:
             raise serializers.ValidationError("User not found.")
         return user
@@ -87,6 +96,16 @@ class AuthenticateSerializer(serializers.Serializer):
         except AuthenticationFailed as e:
             raise serializers.ValidationError(str(e))  # Raise a validation error
 
+class DuplicateMeme(APIException):
+    status_code = 409
+    default_detail = 'An identical meme already exists.'
+    default_code = 'duplicate_meme'
+
+    def __init__(self, meme_id):
+        super().__init__()
+        # Keep the id numeric so clients can fetch the existing meme directly
+        self.detail = {'detail': self.detail, 'id': meme_id}
+
 class MemeSerializer(serializers.ModelSerializer):
     top_text = serializers.CharField(required=False, allow_blank=True)
     bottom_text = serializers.CharField(required=False, allow_blank=True)
@@ -94,6 +113,7 @@ class MemeSerializer(serializers.ModelSerializer):
     class Meta:
         model = Meme
         fields = ['template', 'top_text', 'bottom_text']
+        extra_kwargs = {'template': {'queryset': MemeTemplate.objects.visible()}}
 
     def create(self, validated_data):
         # Extract the template and get the corresponding MemeTemplate instance
@@ -108,29 +128,93 @@ class MemeSerializer(serializers.ModelSerializer):
         validated_data['top_text'] = top_text
         validated_data['bottom_text'] = bottom_text
 
+        # Look for an identical meme according to MEME_DEDUP_MODE
+        content_hash = Meme.compute_content_hash(meme_template.id, top_text, bottom_text)
+        mode = settings.MEME_DEDUP_MODE
+        existing = Meme.objects.filter(content_hash=content_hash).first()
+        if existing is not None and not Meme.objects.visible().filter(pk=existing.pk).exists():
+            # The holder is being deleted: not a duplicate, but its hash stays taken
+            existing, content_hash = None, None
+        if existing is not None:
+            if mode == 'reuse':
+                existing.reused = True
+                return existing
+            if mode == 'reject':
+                raise DuplicateMeme(existing.id)
+            # 'allow': store the duplicate without claiming the hash
+            content_hash = None
+
         # Create the Meme instance with the final values
-        meme = Meme.objects.create(
-            template=meme_template,
-            created_by=validated_data['created_by'],  # Ensure you pass the correct fields
-            top_text=top_text,
-            bottom_text=bottom_text
-        )
+        try:
+            with transaction.atomic():
+                meme = Meme.objects.create(
+                    template=meme_template,
+                    created_by=validated_data['created_by'],  # Ensure you pass the correct fields
+                    top_text=top_text,
+                    bottom_text=bottom_text,
+                    content_hash=content_hash
+                )
+                record_meme_created(meme.created_by_id)
+        except IntegrityError:
+            # An identical meme was inserted concurrently; resolve as if we had seen it
+            if content_hash is None or not Meme.objects.filter(content_hash=content_hash).exists():
+                raise
+            validated_data['top_text'], validated_data['bottom_text'] = top_text, bottom_text
+            validated_data['template'] = meme_template
+            return self.create(validated_data)
         return meme
 
 class MemeTemplateSerializer(serializers.ModelSerializer):
+    # Optional upload of the template image, stored pre-decoded for the renderers
+    image = serializers.FileField(write_only=True, required=False)
+
     class Meta:
         model = MemeTemplate
-        fields = ['name', 'image_url', 'default_top_text', 'default_bottom_text']
+        fields = ['name', 'image_url', 'default_top_text', 'default_bottom_text', 'image']
+
+    def validate_image(self, value):
+        if Image is None:
+            raise serializers.ValidationError('Image uploads require Pillow.')
+        if value.size > settings.RENDER_MAX_SOURCE_BYTES:
+            raise serializers.ValidationError(f'The image is larger than {settings.RENDER_MAX_SOURCE_BYTES} bytes.')
+        try:
+            return ingest(value.read())
+        except AssetError as e:
+            raise serializers.ValidationError(str(e))
+
+    def create(self, validated_data):
+        validated_data['image_asset'] = validated_data.pop('image', None)
+        template = super().create(validated_data)
+        if template.image_asset and phash.available():
+            phash.hash_template(template, open_raster(template.image_asset))
+        return template
 
 class RecieveMemeSerializer(serializers.ModelSerializer):
     class Meta:
         model = Meme
         fields = ['id','top_text','bottom_text','created_at','created_by_id','template_id']
 
+class MemeIdsSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.MEME_BATCH_MAX_IDS
+    )
+
+class BatchMemeSerializer(serializers.ModelSerializer):
+    template = MemeTemplateSerializer(read_only=True)
+    avg_rating = serializers.FloatField(read_only=True)
+    rating_count = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Meme
+        fields = ['id','top_text','bottom_text','created_at','created_by_id','template_id','template','avg_rating','rating_count']
+
 class RateMemeSerializer(serializers.ModelSerializer):
     class Meta:
         model = Rating
         fields = ['score']
+        extra_kwargs = {'score': {'min_value': RATING_SCORES[0], 'max_value': RATING_SCORES[-1]}}
 
     def create(self, validated_data):
         # Retrieve meme and user from context
@@ -140,3 +224,178 @@ class RateMemeSerializer(serializers.ModelSerializer):
         # Create and return the Rating instance
         return Rating.objects.create(meme=meme, user=user, **validated_data)
 
+
+class PendingDeletionSerializer(serializers.ModelSerializer):
+    status = serializers.SerializerMethodField()
+
+    class Meta:
+        model = PendingDeletion
+        fields = ['id', 'kind', 'object_id', 'status', 'requested_at', 'started_at', 'finished_at',
+                  'memes_deleted', 'ratings_deleted']
+
+    def get_status(self, deletion):
+        if deletion.finished_at:
+            return 'done'
+        return 'running' if deletion.started_at else 'pending'
+
+
+class RowSerializer:
+    """Read-only serializer for tuples produced by ``QuerySet.values_list()``.
+
+    Unlike a ModelSerializer it builds no model instances and no per-row field
+    objects, which makes it much cheaper for list responses. Subclasses declare
+    the output ``fields`` and, when they differ, the ORM ``columns`` to fetch in
+    the same order. Values of ``datetime_fields`` are rendered the same way as
+    DRF's DateTimeField.
+    """
+    fields = ()
+    columns = ()
+    datetime_fields = ()
+
+    def __init__(self, rows=None, many=False):
+        self.rows = rows
+        self.many = many
+        self._datetime_indexes = [self.fields.index(field) for field in self.datetime_fields if field in self.fields]
+
+    def get_columns(self):
+        return self.columns or self.fields
+
+    def values(self, queryset):
+        return queryset.values_list(*self.get_columns())
+
+    def to_representation(self, row, tz=None):
+        if self._datetime_indexes:
+            row = list(row)
+            for index in self._datetime_indexes:
+                if row[index] is not None:
+                    row[index] = datetime_to_representation(row[index], tz)
+        return dict(zip(self.fields, row))
+
+    @property
+    def data(self):
+        # Resolve the current timezone once rather than once per value
+        tz = timezone.get_current_timezone() if self._datetime_indexes else None
+        if not self.many:
+            return self.to_representation(self.rows, tz)
+        return [self.to_representation(row, tz) for row in self.rows]
+
+def datetime_to_representation(value, tz):
+    """Same output as DRF's DateTimeField for the default ISO 8601 format."""
+    if timezone.is_aware(value):
+        value = value.astimezone(tz)
+    value = value.isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+class MemeRowSerializer(RowSerializer):
+    """Row equivalent of MemeSerializer."""
+    fields = ('template', 'top_text', 'bottom_text')
+    columns = ('template_id', 'top_text', 'bottom_text')
+
+class RecieveMemeRowSerializer(RowSerializer):
+    """Row equivalent of RecieveMemeSerializer."""
+    fields = ('id', 'top_text', 'bottom_text', 'created_at', 'created_by_id', 'template_id')
+    datetime_fields = ('created_at',)
+
+class FeedMemeRowSerializer(RowSerializer):
+    """Memes returned by the discovery feed."""
+    fields = ('id', 'template', 'top_text', 'bottom_text', 'created_at', 'created_by')
+    columns = ('id', 'template_id', 'top_text', 'bottom_text', 'created_at', 'created_by_id')
+    datetime_fields = ('created_at',)
+
+class TemplateRowSerializer(RowSerializer):
+    """Row equivalent of MemeTemplateSerializer."""
+    fields = ('name', 'image_url', 'default_top_text', 'default_bottom_text')
+
+class TopRatedMemeRowSerializer(RowSerializer):
+    fields = ('id', 'template', 'top_text', 'bottom_text', 'avg_rating')
+    columns = ('id', 'template_id', 'top_text', 'bottom_text', 'avg_rating')
+
+class SparseMemeSerializer(RowSerializer):
+    """Row serializer for meme requests using ``?fields=`` and ``?expand=``.
+
+    Only the columns needed for the requested fields are fetched, and
+    expansions are embedded as nested objects from the same joined query.
+    """
+    available_fields = {
+        'id': 'id',
+        'template': 'template_id',
+        'template_id': 'template_id',
+        'top_text': 'top_text',
+        'bottom_text': 'bottom_text',
+        'created_at': 'created_at',
+        'created_by_id': 'created_by_id',
+    }
+    expansions = {
+        'template': {
+            'id': 'template_id',
+            'name': 'template__name',
+            'image_url': 'template__image_url',
+            'default_top_text': 'template__default_top_text',
+            'default_bottom_text': 'template__default_bottom_text',
+        },
+        'rating': {
+            'avg': 'avg_rating',
+            'count': 'rating_count',
+        },
+        # Read from the maintained per-score counters, no aggregation needed
+        'histogram': {
+            str(score): f'rating_histogram__score_{score}' for score in RATING_SCORES
+        },
+    }
+    datetime_fields = ('created_at',)
+
+    def __init__(self, rows=None, many=False, fields=(), expand=()):
+        self.expand = tuple(expand)
+        # An expanded relation replaces the plain id under the same key
+        self.fields = tuple(field for field in fields if field not in self.expand)
+        super().__init__(rows, many)
+
+    def get_columns(self):
+        columns = [self.available_fields[field] for field in self.fields]
+        for name in self.expand:
+            columns.extend(self.expansions[name].values())
+        return columns
+
+    def values(self, queryset):
+        if 'rating' in self.expand:
+            queryset = with_rating_totals(queryset)
+        return super().values(queryset)
+
+    def to_representation(self, row, tz=None):
+        offset = len(self.fields)
+        data = super().to_representation(row[:offset], tz)
+        for name in self.expand:
+            keys = self.expansions[name]
+            values = row[offset:offset + len(keys)]
+            if name == 'histogram':
+                # Memes that were never rated have no histogram row
+                values = [count or 0 for count in values]
+            data[name] = dict(zip(keys, values))
+            offset += len(keys)
+        return data
+
+def parse_fieldset(query_params, default_fields):
+    """Validate ``?fields=`` and ``?expand=`` and return ``(fields, expand)``."""
+    errors = {}
+
+    fields = default_fields
+    if query_params.get('fields'):
+        fields = [field for field in query_params['fields'].split(',') if field]
+        unknown = [field for field in fields if field not in SparseMemeSerializer.available_fields]
+        if not fields:
+            errors['fields'] = ['fields must not be empty.']
+        elif unknown:
+            errors['fields'] = [f"Unknown field '{field}'." for field in unknown]
+
+    expand = []
+    if query_params.get('expand'):
+        expand = [name for name in query_params['expand'].split(',') if name]
+        unknown = [name for name in expand if name not in SparseMemeSerializer.expansions]
+        if unknown:
+            errors['expand'] = [f"Unknown expansion '{name}'." for name in unknown]
+
+    if errors:
+        raise serializers.ValidationError(errors)
+    return list(dict.fromkeys(fields)), list(dict.fromkeys(expand))
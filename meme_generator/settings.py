@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+from importlib.util import find_spec
 from pathlib import Path
 import dj_database_url
 import os
@@ -46,13 +47,204 @@ INSTALLED_APPS = [
 ]
 
 REST_FRAMEWORK = {
+    # orjson is used when installed; MessagePack is offered only if msgpack is available
+    'DEFAULT_RENDERER_CLASSES': [
+        'meme_generator.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ] + (['meme_generator.renderers.MessagePackRenderer'] if find_spec('msgpack') else []),
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 2
 }
 
+# Upper bound on the number of ids accepted by the meme multi-get endpoints
+MEME_BATCH_MAX_IDS = 200
+
+# Ratings older than this many days are moved by compact_ratings into per-meme
+# aggregates (see meme_generator.ratings)
+RATING_RETENTION_DAYS = int(os.getenv('RATING_RETENTION_DAYS', 90))
+
+# Default and maximum page sizes of the unrated-memes feed (?limit=)
+MEME_FEED_PAGE_SIZE = 20
+MEME_FEED_MAX_PAGE_SIZE = 100
+
+# What MemeView.post does when an identical meme (same template and normalized
+# texts) already exists: 'allow' creates it anyway, 'reuse' returns the
+# existing meme and 'reject' answers 409 Conflict.
+MEME_DEDUP_MODE = os.getenv('MEME_DEDUP_MODE', 'allow')
+
+# Memes are immutable once created, so their representation can be cached for a
+# long time. Bump MEME_REPRESENTATION_VERSION whenever the meme detail fields
+# change to invalidate cached entries and client ETags.
+MEME_REPRESENTATION_VERSION = 1
+MEME_CACHE_TIMEOUT = 60 * 60 * 24
+MEME_HTTP_MAX_AGE = 60 * 60 * 24 * 365
+
+# Rendered template catalogue / leaderboard payloads are cached precompressed.
+# After the timeout an entry is served stale for *_STALE_TIMEOUT more seconds
+# while a single worker recomputes it.
+TEMPLATES_CACHE_TIMEOUT = 60 * 60
+TEMPLATES_STALE_TIMEOUT = 60 * 60
+TOP_MEMES_CACHE_TIMEOUT = 60
+TOP_MEMES_STALE_TIMEOUT = 5 * 60
+MEME_COUNT_CACHE_TIMEOUT = 60
+MEME_COUNT_STALE_TIMEOUT = 5 * 60
+
+# Static snapshots of the template catalogue and leaderboard for a plain file
+# server (see meme_generator.snapshots and the publish_snapshots command)
+SNAPSHOT_DIR = os.getenv('SNAPSHOT_DIR', str(BASE_DIR / 'snapshots'))
+# Superseded versions kept for clients that still hold an older manifest
+SNAPSHOT_KEEP_VERSIONS = 5
+
+# Meme images (GET /api/memes/<id>/image.png?size=..., needs Pillow). Every
+# render produces all of these sizes, as widths in pixels (None keeps the
+# template's size), and stores them in the content-addressed RENDER_CACHE_DIR.
+RENDER_SIZES = {'thumb': 160, 'preview': 480, 'full': None}
+RENDER_CACHE_DIR = os.getenv('RENDER_CACHE_DIR', str(BASE_DIR / 'renders'))
+# Pre-decoded template images, memory-mapped by the renderers
+TEMPLATE_ASSET_DIR = os.getenv('TEMPLATE_ASSET_DIR', str(BASE_DIR / 'template_assets'))
+# Templates whose image pHashes differ in at most this many of 64 bits are
+# reported as near-duplicates (needs NumPy and Pillow)
+TEMPLATE_SIMILARITY_DISTANCE = 10
+# Largest ?distance accepted by /api/meme_template/<id>/similar/
+TEMPLATE_SIMILARITY_MAX_DISTANCE = 16
+# Processes used by render_memes and bench_rendering
+RENDER_WORKERS = int(os.getenv('RENDER_WORKERS', os.cpu_count() or 1))
+RENDER_FETCH_TIMEOUT = 10
+RENDER_MAX_SOURCE_BYTES = 10 * 1024 * 1024
+# Template images with more pixels are refused: a small PNG can decode to
+# gigabytes of pixels
+TEMPLATE_MAX_PIXELS = 25_000_000
+# Templates without a stored asset can be rendered from their image_url,
+# fetched by the server itself during the image request. That URL is chosen
+# by whoever created the template, so fetching is off by default; when
+# enabled only http(s) URLs on public addresses are fetched, redirects
+# included. Otherwise only templates with a stored asset (see
+# ingest_template_images) are rendered.
+RENDER_FETCH_REMOTE = os.getenv('RENDER_FETCH_REMOTE', '') == '1'
+
+# Idempotency-Key handling for meme creation and rating writes
+IDEMPOTENCY_CACHE_ALIAS = 'idempotency'
+IDEMPOTENCY_TTL = 24 * 60 * 60
+IDEMPOTENCY_LOCK_TIMEOUT = 60
+IDEMPOTENCY_WAIT_TIMEOUT = 10
+IDEMPOTENCY_POLL_INTERVAL = 0.05
+
+# Token-bucket rate limits of write endpoints (see meme_generator.ratelimit).
+# Per scope, a bucket per user and/or per client IP: (refill rate, burst).
+# Buckets are kept per worker process unless RATE_LIMIT_CACHE_ALIAS names a
+# cache shared by the workers (memcached or redis).
+RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', '1') == '1'
+RATE_LIMIT_CACHE_ALIAS = os.getenv('RATE_LIMIT_CACHE_ALIAS')
+RATE_LIMITS = {
+    'create_meme': {'user': ('30/min', 10), 'ip': ('120/min', 30)},
+    'rate_meme': {'user': ('120/min', 30), 'ip': ('600/min', 100)},
+    'signup': {'ip': ('10/hour', 5)},
+}
+# Reverse proxies in front of the app; the client IP is taken from the
+# X-Forwarded-For entry they appended instead of REMOTE_ADDR
+RATE_LIMIT_TRUSTED_PROXIES = int(os.getenv('RATE_LIMIT_TRUSTED_PROXIES', 0))
+
+# Admission control (see meme_generator.middleware.AdmissionControlMiddleware):
+# requests beyond ADMISSION_MAX_IN_FLIGHT running at once in a worker process
+# wait up to ADMISSION_QUEUE_TIMEOUT seconds for a slot, then get a 503 with
+# Retry-After. 0 disables it. Probes and scrapes are never shed.
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv('ADMISSION_MAX_IN_FLIGHT', 32))
+ADMISSION_QUEUE_TIMEOUT = 0.05
+ADMISSION_RETRY_AFTER = 1
+ADMISSION_EXEMPT_PATHS = ('/metrics', '/ready')
+
+# Single-flight cache fills (see meme_generator.singleflight)
+SINGLEFLIGHT_LOCK_TIMEOUT = 30
+SINGLEFLIGHT_WAIT_TIMEOUT = 10
+SINGLEFLIGHT_POLL_INTERVAL = 0.05
+
+# Response compression (see meme_generator.middleware.CompressionMiddleware)
+COMPRESSION_MIN_SIZE = 1024
+COMPRESSION_CONTENT_TYPES = ('application/json', 'application/msgpack')
+
+# Request metrics served at /metrics. With several worker processes, point
+# METRICS_DIR at a directory shared by the workers so scrapes see all of them.
+# /metrics reveals routes and traffic: with METRICS_TOKEN set it requires
+# "Authorization: Bearer <METRICS_TOKEN>". Without a token it is open, so do
+# not expose it beyond the network of the scraper.
+METRICS_ENABLED = True
+METRICS_DIR = os.getenv('METRICS_DIR')
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+METRICS_FLUSH_INTERVAL = 5
+
+# Server-sent events at /api/stream/ (ASGI only, see meme_generator.events).
+# The local backend only reaches clients of the publishing process; with
+# several processes use 'meme_generator.events.RedisBackend'.
+EVENTS_BACKEND = os.getenv('EVENTS_BACKEND', 'meme_generator.events.LocalBackend')
+EVENTS_REDIS_URL = os.getenv('EVENTS_REDIS_URL', 'redis://localhost:6379/0')
+EVENTS_REDIS_STREAM = 'meme_generator:events'
+# Events kept for clients resuming with Last-Event-ID
+EVENTS_HISTORY_SIZE = 1000
+# Events buffered per client before it is considered too slow and told to resync
+EVENTS_CLIENT_QUEUE_SIZE = 100
+# Event types for which a slow client only gets the latest event
+EVENTS_COALESCED_TYPES = ('leaderboard',)
+EVENTS_KEEPALIVE_INTERVAL = 15
+
+# Warm a worker up (imports, database connections, template catalogue and
+# leaderboard caches) before it accepts requests, see meme_generator.warmup.
+# /ready answers 503 until warm-up has finished.
+WARMUP_ON_STARTUP = os.getenv('WARMUP_ON_STARTUP', '1') == '1'
+
+# Logging
+# https://docs.djangoproject.com/en/5.1/topics/logging/
+# Application logs are sampled per logger, redacted and written as JSON lines
+# by a background thread (see meme_generator.log).
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'sample': {
+            '()': 'meme_generator.log.SamplingFilter',
+            'rates': {
+                # Authentication runs on every request; keep 1% of its debug/info records
+                'meme_generator.auth': 0.01,
+            },
+        },
+    },
+    'handlers': {
+        'json_queue': {
+            'class': 'meme_generator.log.QueueListenerHandler',
+            'filters': ['sample'],
+            'stream': 'ext://sys.stdout',
+            'queue_size': 10000,
+        },
+    },
+    'loggers': {
+        'meme_generator': {
+            'handlers': ['json_queue'],
+            'level': os.getenv('LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
+
+# On-demand request profiling (see meme_generator.middleware.ProfilingMiddleware).
+# Requests are profiled when they send "X-Profile: <PROFILING_TOKEN>" or are
+# sampled at PROFILING_SAMPLE_RATE. PROFILING_MODE is 'sampling' (folded stacks
+# for flame graphs) or 'cprofile' (pstats). Profiles are linked from the
+# response through PROFILING_URL, or as file:// URIs when it is unset.
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', '') == '1'
+PROFILING_TOKEN = os.getenv('PROFILING_TOKEN')
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', '0'))
+PROFILING_MODE = os.getenv('PROFILING_MODE', 'sampling')
+PROFILING_INTERVAL = 0.001
+PROFILING_DIR = os.getenv('PROFILING_DIR', str(BASE_DIR / 'profiles'))
+PROFILING_URL = os.getenv('PROFILING_URL')
+
 
 MIDDLEWARE = [
+    'meme_generator.middleware.MetricsMiddleware',
+    'meme_generator.middleware.ProfilingMiddleware',
+    'meme_generator.middleware.AdmissionControlMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'meme_generator.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -103,6 +295,54 @@ DATABASES = {
     )
 }
 
+# Single-node profile, selected with DATABASE_URL=sqlite:///path/to/memes.sqlite3.
+# WAL lets reads run concurrently with the single writer. Transactions begin
+# IMMEDIATE so writers queue on busy_timeout for the write lock up front,
+# instead of failing with "database is locked" when a transaction that has
+# already read (e.g. rate_meme's select_for_update) tries to write.
+SQLITE_BUSY_TIMEOUT = int(os.getenv('SQLITE_BUSY_TIMEOUT', 5000))  # milliseconds
+SQLITE_CACHE_SIZE = int(os.getenv('SQLITE_CACHE_SIZE', 64 * 1024))  # KiB per connection
+SQLITE_MMAP_SIZE = int(os.getenv('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))  # bytes
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    # In WAL mode NORMAL is still crash-safe; only the last commits can be lost on power failure
+    'synchronous': 'NORMAL',
+    'busy_timeout': SQLITE_BUSY_TIMEOUT,
+    'cache_size': -SQLITE_CACHE_SIZE,
+    'mmap_size': SQLITE_MMAP_SIZE,
+    'temp_store': 'MEMORY',
+}
+
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    DATABASES['default'].setdefault('OPTIONS', {}).update({
+        'transaction_mode': 'IMMEDIATE',
+        'timeout': SQLITE_BUSY_TIMEOUT / 1000,
+        'init_command': ';'.join(f'PRAGMA {name}={value}' for name, value in SQLITE_PRAGMAS.items()),
+    })
+
+# Keep connections (and the SQLite page cache) across requests. Warm-up opens
+# them before a worker takes traffic.
+DATABASES['default']['CONN_MAX_AGE'] = int(os.getenv('CONN_MAX_AGE', 600))
+DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'meme-generator',
+    },
+    # Stored responses for Idempotency-Key replays; use a backend shared by
+    # all workers in production so retries hitting another worker are replayed
+    'idempotency': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'meme-generator-idempotency',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -0,0 +1,66 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .cache import (MEME_COUNT_CACHE_KEY,
+                    TEMPLATES_CACHE_KEY,
+                    TOP_MEMES_CACHE_KEY,
+                    invalidate_meme,
+                    invalidate_payload)
+from .singleflight import expire
+from .events import LEADERBOARD_CHANGED, MEME_CREATED, publish
+from .models import CompactedRating, Meme, MemeTemplate, Rating
+from .phash import invalidate_index
+from .ratings import rating_signals_are_muted
+from .serializers import FeedMemeRowSerializer
+
+
+@receiver(post_save, sender=Meme)
+def expire_meme_count(sender, created, **kwargs):
+    if created:
+        expire(MEME_COUNT_CACHE_KEY)
+
+
+@receiver(post_save, sender=Meme)
+def publish_new_meme(sender, instance, created, **kwargs):
+    if created:
+        row = tuple(getattr(instance, column) for column in FeedMemeRowSerializer.columns)
+        data = FeedMemeRowSerializer(row).data
+        transaction.on_commit(lambda: publish(MEME_CREATED, data))
+
+
+@receiver(post_delete, sender=Meme)
+def invalidate_deleted_meme(sender, instance, **kwargs):
+    if rating_signals_are_muted():
+        return
+    invalidate_meme(instance.id)
+    invalidate_payload(TOP_MEMES_CACHE_KEY)
+    expire(MEME_COUNT_CACHE_KEY)
+
+
+@receiver(post_save, sender=MemeTemplate)
+@receiver(post_delete, sender=MemeTemplate)
+def invalidate_templates(sender, **kwargs):
+    invalidate_payload(TEMPLATES_CACHE_KEY)
+    invalidate_index()
+
+
+@receiver(post_save, sender=Rating)
+@receiver(post_delete, sender=Rating)
+@receiver(post_save, sender=CompactedRating)
+@receiver(post_delete, sender=CompactedRating)
+def invalidate_top_memes(sender, **kwargs):
+    if rating_signals_are_muted():
+        return
+    invalidate_payload(TOP_MEMES_CACHE_KEY)
+
+
+@receiver(post_save, sender=Rating)
+@receiver(post_delete, sender=Rating)
+@receiver(post_save, sender=CompactedRating)
+@receiver(post_delete, sender=CompactedRating)
+def publish_leaderboard_change(sender, instance, **kwargs):
+    if rating_signals_are_muted():
+        return
+    # Clients refetch /api/memes/top/ (cached) when they see this event
+    meme_id = instance.meme_id
+    transaction.on_commit(lambda: publish(LEADERBOARD_CHANGED, {'meme': meme_id}))
@@ -0,0 +1,131 @@
+"""Request coalescing for expensive cache fills.
+
+``get_or_compute`` makes sure that concurrent misses for the same key run the
+computation once: threads of the same process wait on an in-process call,
+and other processes wait on a lock held in the cache backend (atomic with
+memcached/redis; per-process with the local memory backend). Entries stay in
+the cache for ``stale_timeout`` seconds after going stale, during which one
+worker refreshes them while everybody else keeps serving the old value.
+"""
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from .metrics import record_cache
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+_calls = {}
+_calls_lock = threading.Lock()
+
+
+def _lock_key(key):
+    return f'{key}:lock'
+
+
+def _acquire(key):
+    token = uuid.uuid4().hex
+    if cache.add(_lock_key(key), token, settings.SINGLEFLIGHT_LOCK_TIMEOUT):
+        return token
+    return None
+
+
+def _release(key, token):
+    if cache.get(_lock_key(key)) == token:
+        cache.delete(_lock_key(key))
+
+
+def _refresh(key, build, timeout, stale_timeout):
+    value = build()
+    entry = {'value': value, 'fresh_until': time.time() + timeout, 'stale_timeout': stale_timeout}
+    cache.set(key, entry, timeout + stale_timeout)
+    return value
+
+
+def _share(key, func):
+    """Run ``func`` once for all threads of this process asking for ``key``."""
+    with _calls_lock:
+        call = _calls.get(key)
+        leader = call is None
+        if leader:
+            call = _calls[key] = _Call()
+
+    if not leader:
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.value
+
+    try:
+        call.value = func()
+        return call.value
+    except BaseException as e:
+        call.error = e
+        raise
+    finally:
+        with _calls_lock:
+            del _calls[key]
+        call.done.set()
+
+
+def _fill(key, build, timeout, stale_timeout):
+    deadline = time.monotonic() + settings.SINGLEFLIGHT_WAIT_TIMEOUT
+    while True:
+        token = _acquire(key)
+        if token is not None:
+            try:
+                return _refresh(key, build, timeout, stale_timeout)
+            finally:
+                _release(key, token)
+
+        # Another process is computing the value, wait for it to land
+        time.sleep(settings.SINGLEFLIGHT_POLL_INTERVAL)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry['value']
+        if time.monotonic() >= deadline:
+            # The lock holder is too slow (or died); compute it ourselves
+            return _refresh(key, build, timeout, stale_timeout)
+
+
+def get_or_compute(key, build, timeout, stale_timeout=0):
+    """Return the cached value for ``key``, calling ``build()`` at most once on a miss."""
+    entry = cache.get(key)
+    record_cache(key, entry is not None)
+    if entry is not None:
+        if entry['fresh_until'] > time.time():
+            return entry['value']
+
+        # Stale: whoever takes the lock refreshes, everyone else serves the old value
+        token = _acquire(key)
+        if token is None:
+            return entry['value']
+        try:
+            return _share(key, lambda: _refresh(key, build, timeout, stale_timeout))
+        finally:
+            _release(key, token)
+
+    return _share(key, lambda: _fill(key, build, timeout, stale_timeout))
+
+
+def expire(key):
+    """Mark ``key`` stale so the next reader refreshes it.
+
+    Entries without a stale window are deleted outright.
+    """
+    entry = cache.get(key)
+    if entry is None:
+        return
+    if entry['stale_timeout']:
+        entry['fresh_until'] = 0
+        cache.set(key, entry, entry['stale_timeout'])
+    else:
+        cache.delete(key)
@@ -0,0 +1,132 @@
+"""Static snapshots of the template catalogue and the leaderboard.
+
+``publish`` renders the same JSON as ``ReceiveAllTemplatesView`` and
+``TopRatedMemesView`` into ``SNAPSHOT_DIR`` so a plain file server can serve
+it without Python. A snapshot's version is a hash of its content:
+
+    snapshot_dir/
+        manifest.json                           current version of every snapshot
+        templates.json                          -> templates.current/templates.json
+        templates.current                       -> templates/<version>
+        templates/<version>/templates.json      immutable versions
+
+Every file is written to a temporary name and renamed into place, so readers
+never see a partial file. Precompressed variants sit next to each file under
+the names nginx's ``gzip_static``/``brotli_static`` look for (.gz/.br/.zst),
+and the current alias of each variant links through ``<name>.current``:
+replacing that one link switches all of them at once, so a file server never
+serves new content next to an old variant. Unchanged content writes nothing,
+so publishing often is cheap.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.utils import timezone
+
+from .compression import precompress
+from .renderers import FastJSONRenderer
+
+MANIFEST = 'manifest.json'
+SNAPSHOTS = ('templates', 'top_memes')
+
+# File name suffix of each precompressed variant
+SUFFIXES = {'identity': '', 'gzip': '.gz', 'br': '.br', 'zstd': '.zst'}
+
+
+def _builders():
+    from .views import build_templates, build_top_memes
+
+    return {'templates': build_templates, 'top_memes': build_top_memes}
+
+
+def write_atomic(path, data):
+    """Atomically replace ``path`` with ``data``."""
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f'.{path.name}.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        # mkstemp creates the file readable by its owner only
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def link_atomic(path, target):
+    """Atomically make ``path`` a symlink to ``target``."""
+    tmp = path.with_name(f'.{path.name}.{os.getpid()}')
+    tmp.unlink(missing_ok=True)
+    os.symlink(target, tmp)
+    os.replace(tmp, path)
+
+
+def read_manifest(directory=None):
+    path = Path(directory or settings.SNAPSHOT_DIR) / MANIFEST
+    try:
+        return json.loads(path.read_bytes())
+    except FileNotFoundError:
+        return {'snapshots': {}}
+
+
+def _prune(directory, name, keep):
+    """Delete all but the ``keep`` most recent versions of ``name``."""
+    versions = sorted((path for path in (directory / name).iterdir() if path.is_dir()),
+                      key=lambda path: path.stat().st_mtime, reverse=True)
+    for path in versions[keep:]:
+        shutil.rmtree(path)
+
+
+def publish(names=SNAPSHOTS, directory=None):
+    """Render and publish the snapshots ``names``. Returns ``{name: (version, changed)}``."""
+    directory = Path(directory or settings.SNAPSHOT_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    manifest = read_manifest(directory)
+    builders = _builders()
+    results = {}
+
+    for name in names:
+        body = FastJSONRenderer().render(builders[name]())
+        version = hashlib.sha256(body).hexdigest()[:16]
+        current = manifest['snapshots'].get(name)
+        current_link = directory / f'{name}.current'
+        if (current and current['version'] == version and (directory / current['path']).exists()
+                and current_link.is_symlink()):
+            results[name] = (version, False)
+            continue
+
+        bodies = precompress(body)
+        # The immutable version first, then the current alias
+        version_dir = directory / name / version
+        version_dir.mkdir(parents=True, exist_ok=True)
+        for encoding, data in bodies.items():
+            write_atomic(version_dir / f'{name}.json{SUFFIXES[encoding]}', data)
+        link_atomic(current_link, Path(name) / version)
+        # Variants this version lacks dangle, which file servers treat as missing
+        for suffix in SUFFIXES.values():
+            alias = directory / f'{name}.json{suffix}'
+            if not alias.is_symlink():
+                link_atomic(alias, Path(current_link.name) / alias.name)
+
+        manifest['snapshots'][name] = {
+            'version': version,
+            'path': f'{name}/{version}/{name}.json',
+            'encodings': list(bodies),
+            'size': len(body),
+            'published_at': timezone.now().isoformat(),
+        }
+        results[name] = (version, True)
+
+    if any(changed for _, changed in results.values()):
+        manifest['generated_at'] = timezone.now().isoformat()
+        # Swapping the manifest in is what publishes the new versions
+        write_atomic(directory / MANIFEST, json.dumps(manifest, indent=2).encode())
+        for name, (_, changed) in results.items():
+            if changed:
+                _prune(directory, name, settings.SNAPSHOT_KEEP_VERSIONS)
+    return results
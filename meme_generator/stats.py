@@ -0,0 +1,123 @@
+"""Maintenance of the ``UserStats`` and ``MemeRatingHistogram`` counters.
+
+The ``record_*`` functions must run inside the transaction that writes the
+meme or rating they count, so counters and rows commit or roll back
+together. Increments are applied with ``F()`` expressions, so concurrent
+writers never overwrite each other.
+"""
+from collections import Counter, defaultdict
+
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Greatest
+
+from .models import RATING_SCORES, CompactedRating, Meme, MemeRatingHistogram, Rating, User, UserStats
+
+STATS_FIELDS = ('memes_created', 'ratings_given', 'ratings_received', 'score_sum')
+
+
+def _ensure_stats(*user_ids):
+    UserStats.objects.bulk_create([UserStats(user_id=user_id) for user_id in set(user_ids)], ignore_conflicts=True)
+
+
+def record_meme_created(user_id):
+    _ensure_stats(user_id)
+    UserStats.objects.filter(pk=user_id).update(memes_created=F('memes_created') + 1)
+
+
+def record_rating(rater_id, meme_id, meme_owner_id, score, old_score=None):
+    """Count a new rating, or a changed score when ``old_score`` is given."""
+    _ensure_stats(rater_id, meme_owner_id)
+    MemeRatingHistogram.objects.bulk_create([MemeRatingHistogram(meme_id=meme_id)], ignore_conflicts=True)
+    histogram = MemeRatingHistogram.objects.filter(pk=meme_id)
+    if old_score is None:
+        UserStats.objects.filter(pk=rater_id).update(ratings_given=F('ratings_given') + 1)
+        UserStats.objects.filter(pk=meme_owner_id).update(
+            ratings_received=F('ratings_received') + 1, score_sum=F('score_sum') + score)
+        histogram.update(**{f'score_{score}': F(f'score_{score}') + 1})
+    elif score != old_score:
+        UserStats.objects.filter(pk=meme_owner_id).update(score_sum=F('score_sum') + (score - old_score))
+        changes = {f'score_{score}': F(f'score_{score}') + 1}
+        # Ratings stored before scores were validated have no counter, and
+        # ratings written outside the API were never counted
+        if old_score in RATING_SCORES:
+            changes[f'score_{old_score}'] = Greatest(F(f'score_{old_score}') - 1, 0)
+        histogram.update(**changes)
+
+
+def _apply_decrements(queryset, deltas):
+    """Subtract ``deltas[pk] = {field: amount}``, grouping rows with equal deltas."""
+    groups = defaultdict(list)
+    for pk, delta in deltas.items():
+        groups[frozenset(delta.items())].append(pk)
+    for delta, pks in groups.items():
+        # Never below zero: rows written outside the API were never counted
+        queryset.filter(pk__in=pks).update(**{
+            field: Greatest(F(field) - amount, 0) if field != 'score_sum' else F(field) - amount
+            for field, amount in delta
+        })
+
+
+def record_ratings_deleted(ratings, memes_deleted=False):
+    """Uncount ``ratings``, given as ``(rater_id, meme_id, meme_owner_id, score)`` tuples.
+
+    Pass ``memes_deleted=True`` when the rated memes are deleted as well, so
+    their histograms (removed with them) are left alone.
+    """
+    users = defaultdict(Counter)
+    histograms = defaultdict(Counter)
+    for rater_id, meme_id, meme_owner_id, score in ratings:
+        users[rater_id]['ratings_given'] += 1
+        users[meme_owner_id]['ratings_received'] += 1
+        users[meme_owner_id]['score_sum'] += score
+        if not memes_deleted and score in RATING_SCORES:
+            histograms[meme_id][f'score_{score}'] += 1
+    _apply_decrements(UserStats.objects, users)
+    _apply_decrements(MemeRatingHistogram.objects, histograms)
+
+
+def record_memes_deleted(owner_ids):
+    """Uncount deleted memes, given by the ids of their creators."""
+    _apply_decrements(UserStats.objects, {
+        owner_id: {'memes_created': count} for owner_id, count in Counter(owner_ids).items()
+    })
+
+
+def get_user_stats(user_id):
+    """Return the stats of ``user_id`` as a dict, or ``None`` if there is no such (active) user."""
+    row = UserStats.objects.filter(pk=user_id, user__is_active=True).values_list(*STATS_FIELDS).first()
+    if row is None:
+        # Users that never created or rated anything have no row yet
+        if not User.objects.filter(pk=user_id, is_active=True).exists():
+            return None
+        row = (0,) * len(STATS_FIELDS)
+    stats = dict(zip(STATS_FIELDS, row))
+    received = stats['ratings_received']
+    return {
+        'user': int(user_id),
+        'memes_created': stats['memes_created'],
+        'ratings_given': stats['ratings_given'],
+        'ratings_received': received,
+        'avg_score': stats['score_sum'] / received if received else None,
+    }
+
+
+def compute_user_stats(user_ids):
+    """Recompute the counters of ``user_ids`` from the meme and (live and compacted) rating tables."""
+    stats = {user_id: dict.fromkeys(STATS_FIELDS, 0) for user_id in user_ids}
+    created = Meme.objects.filter(created_by_id__in=user_ids).values('created_by_id').annotate(n=Count('id'))
+    for row in created:
+        stats[row['created_by_id']]['memes_created'] = row['n']
+    # Ratings count whether they are live or compacted
+    for model in (Rating, CompactedRating):
+        given = model.objects.filter(user_id__in=user_ids).values('user_id').annotate(n=Count('id'))
+        for row in given:
+            stats[row['user_id']]['ratings_given'] += row['n']
+        received = (
+            model.objects.filter(meme__created_by_id__in=user_ids)
+            .values('meme__created_by_id')
+            .annotate(n=Count('id'), total=Sum('score'))
+        )
+        for row in received:
+            stats[row['meme__created_by_id']]['ratings_received'] += row['n']
+            stats[row['meme__created_by_id']]['score_sum'] += row['total']
+    return stats
@@ -0,0 +1,151 @@
+"""Memory-footprint regression suite.
+
+Each endpoint is run under ``tracemalloc`` against datasets of increasing
+size. Paginated endpoints must stay O(page): their peak allocation may not
+grow with the table. Every endpoint is also checked against the recorded
+baseline in ``memory_baseline.json``, which must cover every endpoint and
+dataset size; run with ``UPDATE_MEMORY_BASELINE=1`` to rewrite it after an
+intended change.
+"""
+import json
+import os
+import sys
+import tracemalloc
+from pathlib import Path
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+from .models import Meme, MemeTemplate, Rating
+
+BASELINE_PATH = Path(__file__).with_name('memory_baseline.json')
+DATASET_SIZES = (100, 400, 1600)
+
+# Allowed growth of an O(page) endpoint's peak from the smallest to the largest dataset
+CONSTANT_GROWTH = 1.5
+# Allowed regression against the recorded baseline
+BASELINE_TOLERANCE = 2.0
+# How close to the peak usage must get for the allocation sites to be taken
+PEAK_SNAPSHOT_RATIO = 0.9
+
+
+def measure(func, reset):
+    """Run ``func`` under tracemalloc and return ``(peak_bytes, sites, when)``.
+
+    ``sites`` are the largest allocation sites at the peak: ``func`` runs a
+    second time (after ``reset``) and the traces are snapshotted the first
+    time usage comes within ``PEAK_SNAPSHOT_RATIO`` of the first run's peak.
+    Should it not get there, the sites are those retained after the call,
+    and ``when`` says which of the two they are.
+    """
+    snapshot = None
+
+    def at_peak(frame, event, arg):
+        nonlocal snapshot
+        if snapshot is None and tracemalloc.get_traced_memory()[0] >= peak * PEAK_SNAPSHOT_RATIO:
+            snapshot = tracemalloc.take_snapshot()
+
+    reset()
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    reset()
+    tracemalloc.start()
+    try:
+        sys.setprofile(at_peak)
+        try:
+            func()
+        finally:
+            sys.setprofile(None)
+        when = 'at the peak'
+        if snapshot is None:
+            snapshot = tracemalloc.take_snapshot()
+            when = 'retained after the call'
+    finally:
+        tracemalloc.stop()
+    snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+    sites = [f'{stat.traceback[0].filename}:{stat.traceback[0].lineno} {stat.size} B'
+             for stat in snapshot.statistics('lineno')[:5]]
+    return peak, sites, when
+
+
+class EndpointMemoryTest(APITestCase):
+    # name -> (url name, query params, O(page)?)
+    endpoints = {
+        'list_memes': ('meme_request', {}, True),
+        'random_meme': ('random_meme', {}, True),
+        'top_memes': ('top memes', {}, True),
+        'templates_page': ('receive_all_templates', {'page': 1}, True),
+        # The full catalogue is O(templates) by design; only the baseline applies
+        'templates': ('receive_all_templates', {}, False),
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='testuser', password='password')
+        cls.token = Token.objects.create(user=cls.user)
+
+    def setUp(self):
+        self.client.credentials(HTTP_TOKEN=self.token.key, HTTP_ID=str(self.user.id))
+
+    def seed(self, size):
+        """Grow the dataset to ``size`` templates, memes and ratings."""
+        templates = MemeTemplate.objects.count()
+        MemeTemplate.objects.bulk_create(
+            MemeTemplate(name=f'Template {i}', image_url=f'http://example.com/{i}.png')
+            for i in range(templates, size)
+        )
+        template = MemeTemplate.objects.first()
+        memes = Meme.objects.count()
+        created = Meme.objects.bulk_create(
+            Meme(template=template, created_by=self.user, top_text=f'Top {i}', bottom_text=f'Bottom {i}')
+            for i in range(memes, size)
+        )
+        Rating.objects.bulk_create(Rating(meme=meme, user=self.user, score=meme.id % 5 + 1) for meme in created)
+
+    def profile(self):
+        results = {name: {} for name in self.endpoints}
+        for size in DATASET_SIZES:
+            self.seed(size)
+            for name, (url_name, params, _) in self.endpoints.items():
+                url = reverse(url_name)
+                self.client.get(url, params)  # warm up imports and lazy state
+                # cache.clear(): measure the computing path, not a cache hit
+                peak, sites, when = measure(lambda: self.client.get(url, params), cache.clear)
+                results[name][size] = {'peak': peak, 'top_sites': sites, 'sites_taken': when}
+        return results
+
+    def test_endpoint_memory(self):
+        results = self.profile()
+
+        if os.environ.get('UPDATE_MEMORY_BASELINE'):
+            baseline = {name: {str(size): r['peak'] for size, r in sizes.items()} for name, sizes in results.items()}
+            BASELINE_PATH.write_text(json.dumps(baseline, indent=2, sort_keys=True) + '\n')
+            return
+
+        baseline = json.loads(BASELINE_PATH.read_text()) if BASELINE_PATH.exists() else {}
+        smallest, largest = DATASET_SIZES[0], DATASET_SIZES[-1]
+
+        for name, (_, _, constant) in self.endpoints.items():
+            sizes = results[name]
+            with self.subTest(endpoint=name):
+                report = '\n'.join(
+                    [f'{name} peak by dataset size: ' + ', '.join(f'{s}: {r["peak"]} B' for s, r in sizes.items()),
+                     f'top allocation sites at the largest size, {sizes[largest]["sites_taken"]}:']
+                    + [f'  {site}' for site in sizes[largest]['top_sites']]
+                )
+                if constant:
+                    self.assertLessEqual(sizes[largest]['peak'], sizes[smallest]['peak'] * CONSTANT_GROWTH,
+                                         f'{name} is not O(page)\n{report}')
+                missing = [size for size in sizes if str(size) not in baseline.get(name, {})]
+                self.assertFalse(missing, f'{name} has no baseline for dataset sizes {missing}; record it with '
+                                          f'UPDATE_MEMORY_BASELINE=1\n{report}')
+                for size, result in sizes.items():
+                    self.assertLessEqual(result['peak'], baseline[name][str(size)] * BASELINE_TOLERANCE,
+                                         f'{name} regressed against the baseline\n{report}')
@@ -1,14 +1,56 @@
+import asyncio
+import gzip
+import io
+import json
+import logging
+import os
+import random
+import socket
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pathlib import Path
+from unittest import mock, skipUnless
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
-from rest_framework.test import APITestCase
+from rest_framework.test import APIClient, APITestCase
 from django.contrib.auth.models import User
+from django.core.cache import cache, caches
 from rest_framework.authtoken.models import Token
-from .models import Meme, MemeTemplate, Rating
+from rest_framework.renderers import JSONRenderer
+from . import metrics, phash, warmup
+from .assets import HEADER, MAGIC, AssetError, asset_key, open_raster
+from .events import Event, Subscriber, broadcaster, stream_app
+from .cache import MEME_COUNT_CACHE_KEY, TEMPLATES_CACHE_KEY, TOP_MEMES_CACHE_KEY
+from .compression import ENCODINGS, negotiate_encoding
+from .idempotency import idempotency_cache_key
+from .log import JSONFormatter, QueueListenerHandler, RedactingFilter, SamplingFilter, REDACTED
+from .middleware import AdmissionControlMiddleware, CompressionMiddleware, ProfilingMiddleware
+from .ratelimit import CacheBuckets, LocalBuckets, buckets, client_ip
+from .models import CompactedRating, Meme, MemeTemplate, PendingDeletion, Rating, RatingAggregate
+from .renderers import FastJSONRenderer, msgpack
+from .rendering import Image, SourceUnavailable, fetch_source
+from .singleflight import expire, get_or_compute
+from .snapshots import SUFFIXES, publish, read_manifest
+from .serializers import MemeSerializer, MemeRowSerializer, RecieveMemeSerializer, RecieveMemeRowSerializer
 
 
 class UserSignupViewTest(APITestCase):
     
     def setUp(self):
+        # Rate limit buckets are per process and outlive each test
+        buckets().clear()
         self.signup_url = reverse('signup')
 
     def test_user_signup_success(self):
@@ -171,6 +213,7 @@ class UserLogoutViewTest(APITestCase):
 class MemeViewTest(APITestCase):
 
     def setUp(self):
+        buckets().clear()
         # Create a test user and token for authentication
         self.user = User.objects.create_user(username='testuser', password='testpassword')
         self.token = Token.objects.create(user=self.user)
@@ -311,6 +354,9 @@ class CreateMemeTemplateTest(APITestCase):
 
 class RetrieveMemeTest(APITestCase):
     def setUp(self):
+        # Cached meme representations outlive the per-test transaction
+        cache.clear()
+
         # Create a test user and authenticate
         self.user = User.objects.create_user(username='testuser', password='testpass')
         self.token = Token.objects.create(user=self.user)
@@ -358,9 +404,48 @@ class RetrieveMemeTest(APITestCase):
         # Assert that the response contains the appropriate error message
         self.assertEqual(response.data['error'], 'Meme not found.')
 
+    def test_retrieve_meme_cache_headers(self):
+        """Test that meme responses carry a strong ETag and immutable caching headers."""
+        response = self.client.get(self.url)
+
+        self.assertEqual(response['ETag'], f'"meme-{self.meme.id}-v1"')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn('private', response['Cache-Control'])
+
+    def test_retrieve_meme_repeat_fetch_is_cached(self):
+        """Test that a repeat fetch only costs the authentication query."""
+        self.client.get(self.url)
+
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['id'], self.meme.id)
+
+    def test_retrieve_meme_if_none_match(self):
+        """Test that a matching If-None-Match returns 304 without a body."""
+        etag = self.client.get(self.url)['ETag']
+
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+        self.assertFalse(response.content)
+
+    def test_retrieve_meme_deleted_invalidates_cache(self):
+        """Test that deleting a meme evicts its cached representation."""
+        self.client.get(self.url)
+        self.meme.delete()
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
 class ReceiveAllTemplatesTest(APITestCase):
 
     def setUp(self):
+        cache.clear()
+
         # Create a test user and authenticate
         self.user = User.objects.create_user(username='testuser', password='testpass')
         self.token = Token.objects.create(user=self.user)
@@ -416,6 +501,7 @@ class ReceiveAllTemplatesTest(APITestCase):
 class RateMemeViewTestCase(APITestCase):
 
     def setUp(self):
+        buckets().clear()
         # Create a user and authentication token
         self.user = User.objects.create_user(username='testuser', password='password')
         self.token = Token.objects.create(user=self.user)
@@ -491,6 +577,9 @@ class RateMemeViewTestCase(APITestCase):
 class RandomMemeViewTestCase(APITestCase):
 
     def setUp(self):
+        buckets().clear()
+        cache.clear()
+
         # Create a user and authentication token
         self.user = User.objects.create_user(username='testuser', password='password')
         self.token = Token.objects.create(user=self.user)
@@ -549,6 +638,8 @@ class TopRatedMemesViewTestCase(APITestCase):
 
 
     def setUp(self):
+        cache.clear()
+
         # Create a user and authentication token
         self.user = User.objects.create_user(username='testuser', password='password')
         user_2 = User.objects.create_user(username='otheruser', password='password')
@@ -614,3 +705,1659 @@ class TopRatedMemesViewTestCase(APITestCase):
         # Check that the response indicates no memes with ratings
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data, [])  # Expecting an empty list since there are no ratings
+
+
+class BatchGetMemesTestCase(APITestCase):
+
+    def setUp(self):
+        buckets().clear()
+        # Create a user and authentication token
+        self.user = User.objects.create_user(username='testuser', password='password')
+        other_user = User.objects.create_user(username='otheruser', password='password')
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_TOKEN=self.token.key, HTTP_ID=str(self.user.id))
+
+        # Create a meme template and some memes
+        self.template = MemeTemplate.objects.create(
+            name="Funny Template",
+            image_url="http://example.com/image.png",
+            default_top_text="Default Top",
+            default_bottom_text="Default Bottom"
+        )
+        self.memes = [
+            Meme.objects.create(template=self.template, top_text=f"Top {i}", bottom_text=f"Bottom {i}", created_by=self.user)
+            for i in range(5)
+        ]
+        Rating.objects.create(meme=self.memes[0], user=self.user, score=5)
+        Rating.objects.create(meme=self.memes[0], user=other_user, score=2)
+
+        self.batch_url = reverse('batch_get_memes')
+        self.meme_url = reverse('meme_request')
+
+    def test_get_by_ids_preserves_order_and_reports_misses(self):
+        ids = [self.memes[3].id, 9999, self.memes[0].id]
+        response = self.client.get(self.meme_url, {'ids': ','.join(str(i) for i in ids)})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results[0]['id'], self.memes[3].id)
+        self.assertIsNone(results[1])
+        self.assertEqual(results[2]['id'], self.memes[0].id)
+        self.assertEqual(response.data['missing'], [9999])
+
+        # Template and rating aggregates are embedded
+        self.assertEqual(results[2]['template']['name'], 'Funny Template')
+        self.assertAlmostEqual(results[2]['avg_rating'], 3.5)
+        self.assertEqual(results[2]['rating_count'], 2)
+        self.assertIsNone(results[0]['avg_rating'])
+        self.assertEqual(results[0]['rating_count'], 0)
+
+    def test_batch_get_uses_a_single_meme_query(self):
+        ids = [meme.id for meme in self.memes]
+
+        # One query for authentication, one for the memes
+        with self.assertNumQueries(2):
+            response = self.client.post(self.batch_url, {'ids': ids}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([meme['id'] for meme in response.data['results']], ids)
+        self.assertEqual(response.data['missing'], [])
+
+    def test_batch_get_invalid_ids(self):
+        response = self.client.get(self.meme_url, {'ids': '1,abc'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('ids', response.data)
+
+    def test_batch_get_too_many_ids(self):
+        ids = list(range(1, 202))
+        response = self.client.post(self.batch_url, {'ids': ids}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('ids', response.data)
+
+    def test_batch_get_missing_auth(self):
+        self.client.credentials()
+        response = self.client.post(self.batch_url, {'ids': [self.memes[0].id]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('Token or user_id missing', response.data['non_field_errors'])
+
+
+class RowSerializerTestCase(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='password')
+        self.token = Token.objects.create(user=self.user)
+        self.template = MemeTemplate.objects.create(name="Funny Template", image_url="http://example.com/image.png")
+        self.meme = Meme.objects.create(template=self.template, top_text="Top", bottom_text="Bottom", created_by=self.user)
+
+    def test_row_serializers_match_model_serializers(self):
+        """Test that the row serializers produce the same output as the ModelSerializers."""
+        queryset = Meme.objects.filter(id=self.meme.id)
+
+        self.assertEqual(
+            RecieveMemeRowSerializer(RecieveMemeRowSerializer().values(queryset), many=True).data,
+            [dict(item) for item in RecieveMemeSerializer(queryset, many=True).data]
+        )
+        self.assertEqual(
+            MemeRowSerializer(MemeRowSerializer().values(queryset).get()).data,
+            dict(MemeSerializer(self.meme).data)
+        )
+
+    def test_fast_json_renderer_matches_json_renderer(self):
+        """Test that the orjson renderer produces the same document as the stock renderer."""
+        data = RecieveMemeRowSerializer(RecieveMemeRowSerializer().values(Meme.objects.all()), many=True).data
+        self.assertEqual(json.loads(FastJSONRenderer().render(data)), json.loads(JSONRenderer().render(data)))
+
+    @skipUnless(msgpack, 'msgpack is not installed')
+    def test_messagepack_negotiation(self):
+        """Test that clients can ask for MessagePack responses."""
+        response = self.client.get(
+            reverse('retrieve_meme', kwargs={'meme_id': self.meme.id}),
+            HTTP_TOKEN=self.token.key, HTTP_ID=str(self.user.id), HTTP_ACCEPT='application/msgpack'
+        )
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(response.content)['id'], self.meme.id)
+
+
+class SparseFieldsetTestCase(APITestCase):
+
+    def setUp(self):
+        buckets().clear()
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='password')
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_TOKEN=self.token.key, HTTP_ID=str(self.user.id))
+
+        self.template = MemeTemplate.objects.create(name="Funny Template", image_url="http://example.com/image.png")
+        self.meme = Meme.objects.create(template=self.template, top_text="Top", bottom_text="Bottom", created_by=self.user)
+        Rating.objects.create(meme=self.meme, user=self.user, score=4)
+
+        self.meme_url = reverse('meme_request')
+        self.retrieve_url = reverse('retrieve_meme', kwargs={'meme_id': self.meme.id})
+
+    def test_list_selects_fields(self):
+        response = self.client.get(self.meme_url, {'fields': 'id,top_text'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'], [{'id': self.meme.id, 'top_text': 'Top'}])
+
+    def test_list_expands_in_one_query(self):
+        # One query for authentication, one for the count and one for the page
+        with self.assertNumQueries(3):
+            response = self.client.get(self.meme_url, {'fields': 'id', 'expand': 'template,rating'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        meme = response.data['results'][0]
+        self.assertEqual(meme['id'], self.meme.id)
+        self.assertEqual(meme['template']['id'], self.template.id)
+        self.assertEqual(meme['template']['name'], 'Funny Template')
+        self.assertEqual(meme['rating'], {'avg': 4.0, 'count': 1})
+
+    def test_retrieve_selects_fields(self):
+        response = self.client.get(self.retrieve_url, {'fields': 'id,bottom_text'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'id': self.meme.id, 'bottom_text': 'Bottom'})
+        self.assertNotEqual(response['ETag'], self.client.get(self.retrieve_url)['ETag'])
+
+        cached = self.client.get(self.retrieve_url, {'fields': 'id,bottom_text'}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, status.HTTP_304_NOT_MODIFIED)
+        other = self.client.get(self.retrieve_url, {'fields': 'id,top_text'}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(other.status_code, status.HTTP_200_OK)
+
+    def test_retrieve_expands_template(self):
+        response = self.client.get(self.retrieve_url, {'expand': 'template'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['top_text'], 'Top')
+        self.assertEqual(response.data['template']['image_url'], 'http://example.com/image.png')
+
+    def test_unknown_fields_and_expansions(self):
+        response = self.client.get(self.meme_url, {'fields': 'id,password', 'expand': 'author'})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('fields', response.data)
+        self.assertIn('expand', response.data)
+
+    def test_empty_fields(self):
+        for url in (self.meme_url, self.retrieve_url):
+            response = self.client.get(url, {'fields': ',,'})
+
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(response.data['fields'], ['fields must not be empty.'])
+
+
+class CompressionTestCase(APITestCase):
+
+    def setUp(self):
+        buckets().clear()
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='password')
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_TOKEN=self.token.key, HTTP_ID=str(self.user.id))
+
+        for i in range(30):
+            MemeTemplate.objects.create(name=f"Template {i}", image_url=f"http://example.com/template{i}.jpg",
+                                        default_top_text="Top Text", default_bottom_text="Bottom Text")
+        self.url = reverse('receive_all_templates')
+
+    def test_precompressed_templates(self):
+        """Test that the template catalogue is served from its precompressed cache entry."""
+        expected = self.client.get(self.url).data
+
+        # The second request is answered from the cache without querying templates
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip')
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(json.loads(gzip.decompress(response.content)), expected)
+
+    def test_templates_cache_invalidated_on_create(self):
+        self.client.get(self.url)
+        MemeTemplate.objects.create(name="New Template", image_url="http://example.com/new.jpg")
+
+        response = self.client.get(self.url)
+        self.assertEqual(len(response.data), 31)
+
+    def test_middleware_compresses_large_json(self):
+        """Test that JSON responses above the size threshold are compressed."""
+        template = MemeTemplate.objects.first()
+        ids = [Meme.objects.create(template=template, created_by=self.user, top_text="Top", bottom_text="Bottom").id
+               for _ in range(20)]
+
+        response = self.client.post(reverse('batch_get_memes'), {'ids': ids}, format='json', HTTP_ACCEPT_ENCODING='gzip')
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(len(json.loads(gzip.decompress(response.content))['results']), 20)
+
+    def test_middleware_skips_small_or_unaccepted(self):
+        response = self.client.get(reverse('meme_request'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+        response = self.client.get(self.url)
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_negotiate_encoding(self):
+        self.assertEqual(negotiate_encoding('gzip;q=0.5, deflate'), 'gzip')
+        self.assertIsNone(negotiate_encoding('gzip;q=0, deflate'))
+        self.assertIsNone(negotiate_encoding(''))
+        self.assertEqual(negotiate_encoding('*'), ENCODINGS[0])
+
+    def test_streaming_compression(self):
+        """Test that streaming responses are compressed chunk by chunk."""
+        chunks = [b'{"a": 1}', b'{"b": 2}']
+        middleware = CompressionMiddleware(lambda request: StreamingHttpResponse(iter(chunks), content_type='application/json'))
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING='gzip')
+
+        response = middleware(request)
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), b''.join(chunks))
+
+
+class SingleFlightTestCase(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_concurrent_misses_compute_once(self):
+        """Test that threads missing the same key share a single computation."""
+        calls = []
+        started = threading.Event()
+
+        def build():
+            calls.append(1)
+            started.set()
+            time.sleep(0.2)
+            return 'value'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(get_or_compute('key', build, 60))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['value'] * 8)
+
+    def test_waits_for_other_process(self):
+        """Test that a miss waits for the lock holder's value instead of recomputing."""
+        cache.add('key:lock', 'other-process', 30)
+        threading.Timer(0.1, lambda: cache.set('key', {'value': 'theirs', 'fresh_until': time.time() + 60,
+                                                      'stale_timeout': 0})).start()
+
+        self.assertEqual(get_or_compute('key', lambda: 'ours', 60), 'theirs')
+
+    def test_stale_while_revalidate(self):
+        """Test that stale values are served while another worker refreshes them."""
+        get_or_compute('key', lambda: 'old', 60, stale_timeout=60)
+        expire('key')
+
+        # Someone else is refreshing: keep serving the stale value
+        cache.add('key:lock', 'other-process', 30)
+        self.assertEqual(get_or_compute('key', lambda: 'new', 60, stale_timeout=60), 'old')
+
+        # Once the lock is free the next reader refreshes
+        cache.delete('key:lock')
+        self.assertEqual(get_or_compute('key', lambda: 'new', 60, stale_timeout=60), 'new')
+        self.assertEqual(get_or_compute('key', lambda: 'newer', 60, stale_timeout=60), 'new')
+
+    def test_errors_are_shared_and_not_cached(self):
+        def build():
+            raise ValueError('boom')
+
+        with self.assertRaises(ValueError):
+            get_or_compute('key', build, 60)
+        self.assertEqual(get_or_compute('key', lambda: 'value', 60), 'value')
+
+
+class MetricsTestCase(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        metrics.registry.reset()
+        self.user = User.objects.create_user(username='testuser', password='password')
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_TOKEN=self.token.key, HTTP_ID=str(self.user.id))
+        template = MemeTemplate.objects.create(name="Funny Template", image_url="http://example.com/image.png")
+        self.meme = Meme.objects.create(template=template, top_text="Top", bottom_text="Bottom", created_by=self.user)
+
+    def test_metrics_endpoint(self):
+        """Test that per-route latency, status, SQL and cache metrics are exposed."""
+        url = reverse('retrieve_meme', kwargs={'meme_id': self.meme.id})
+        self.client.get(url)
+        self.client.get(url)
+
+        response = self.client.get(reverse('metrics'))
+        body = response.content.decode()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        self.assertIn('meme_http_request_duration_seconds_count{route="api/memes/<int:meme_id>/",method="GET"} 2', body)
+        self.assertIn('meme_http_responses_total{route="api/memes/<int:meme_id>/",method="GET",status="200"} 2', body)
+        # One auth query per request plus the meme query on the cache miss
+        self.assertIn('meme_db_queries_total{route="api/memes/<int:meme_id>/"} 3', body)
+        self.assertIn('meme_cache_requests_total{cache="meme",result="hit"} 1', body)
+        self.assertIn('meme_cache_requests_total{cache="meme",result="miss"} 1', body)
+        self.assertIn('meme_http_requests_in_flight 1', body)
+
+    def test_merges_worker_snapshots(self):
+        """Test that snapshots written by other workers are merged into a scrape."""
+        with tempfile.TemporaryDirectory() as metrics_dir, self.settings(METRICS_DIR=metrics_dir):
+            metrics.registry.observe_request('api/memes/', 'GET', 200, 0.01, 2, 0.001)
+            other = metrics.Registry()
+            other.observe_request('api/memes/', 'GET', 200, 0.02, 3, 0.002)
+            # The parent process is alive; pid 999999999 is not
+            for pid in (os.getppid(), 999999999):
+                with open(os.path.join(metrics_dir, f'metrics-{pid}.json'), 'w') as f:
+                    json.dump(other.snapshot(), f)
+
+            merged = metrics.collect()
+            remaining = sorted(os.listdir(metrics_dir))
+
+        self.assertEqual(merged['responses'][('api/memes/', 'GET', '200')], 2)
+        self.assertEqual(merged['db'][('api/memes/',)][0], 5)
+        self.assertEqual(remaining, sorted([f'metrics-{os.getpid()}.json', f'metrics-{os.getppid()}.json']))
+
+    def test_worker_removes_its_snapshot_on_exit(self):
+        with tempfile.TemporaryDirectory() as metrics_dir, self.settings(METRICS_DIR=metrics_dir):
+            metrics.flush(force=True)
+            self.assertTrue(os.path.exists(os.path.join(metrics_dir, f'metrics-{os.getpid()}.json')))
+            metrics._remove_snapshot()
+            self.assertEqual(os.listdir(metrics_dir), [])
+
+    def test_metrics_token(self):
+        with self.settings(METRICS_TOKEN='secret'):
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, status.HTTP_401_UNAUTHORIZED)
+            response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer wrong')
+            self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+            response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class ProfilingMiddlewareTestCase(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.profile_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.profile_dir.cleanup)
+        self.user = User.objects.create_user(username='testuser', password='password')
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_TOKEN=self.token.key, HTTP_ID=str(self.user.id))
+
+    def profiling_settings(self, **overrides):
+        options = {
+            'PROFILING_ENABLED': True,
+            'PROFILING_TOKEN': 'secret',
+            'PROFILING_SAMPLE_RATE': 0,
+            'PROFILING_DIR': self.profile_dir.name,
+            'PROFILING_URL': '/profiles/',
+        }
+        options.update(overrides)
+        return self.settings(**options)
+
+    def test_disabled_middleware_is_not_used(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            ProfilingMiddleware(lambda request: None)
+
+    def test_profile_requested_by_header(self):
+        """Test that an authorized header produces a profile, its SQL log and a Link header."""
+        for mode, extension in (('sampling', '.folded'), ('cprofile', '.prof')):
+            with self.profiling_settings(PROFILING_MODE=mode):
+                self.client.handler.load_middleware()
+                response = self.client.get(reverse('receive_all_templates'), HTTP_X_PROFILE='secret')
+
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertRegex(response['Link'], rf'^</profiles/[\w-]+\{extension}>; rel="profile"$')
+            name = response['Link'][len('</profiles/'):-len(f'{extension}>; rel="profile"')]
+            self.assertTrue(os.path.exists(os.path.join(self.profile_dir.name, name + extension)))
+            with open(os.path.join(self.profile_dir.name, name + '.sql.json')) as f:
+                sql_log = json.load(f)
+            self.assertEqual(sql_log['path'], reverse('receive_all_templates'))
+            self.assertTrue(sql_log['queries'])
+
+    def test_unauthorized_header_is_ignored(self):
+        with self.profiling_settings():
+            self.client.handler.load_middleware()
+            response = self.client.get(reverse('receive_all_templates'), HTTP_X_PROFILE='wrong')
+
+        self.assertFalse(response.has_header('Link'))
+        self.assertEqual(os.listdir(self.profile_dir.name), [])
+
+    def test_sampling_rate(self):
+        with self.profiling_settings(PROFILING_SAMPLE_RATE=1.0):
+            self.client.handler.load_middleware()
+            response = self.client.get(reverse('receive_all_templates'))
+
+        self.assertIn('rel="profile"', response['Link'])
+
+
+class StructuredLoggingTestCase(SimpleTestCase):
+
+    def make_record(self, name='meme_generator.auth', level=logging.INFO, **extra):
+        record = logging.LogRecord(name, level, __file__, 1, 'message %s', ({'password': 'hunter2'},), None)
+        record.__dict__.update(extra)
+        return record
+
+    def test_redacts_secrets(self):
+        record = self.make_record(token='abc', headers={'Token': 'abc', 'Id': '1'}, user_id='1')
+        RedactingFilter().filter(record)
+
+        self.assertEqual(record.token, REDACTED)
+        self.assertEqual(record.headers, {'Token': REDACTED, 'Id': '1'})
+        self.assertEqual(record.user_id, '1')
+        self.assertEqual(record.args, {'password': REDACTED})
+
+    def test_json_formatter(self):
+        data = json.loads(JSONFormatter().format(self.make_record(user_id='1')))
+
+        self.assertEqual(data['logger'], 'meme_generator.auth')
+        self.assertEqual(data['level'], 'INFO')
+        self.assertEqual(data['user_id'], '1')
+
+    def test_sampling(self):
+        sampler = SamplingFilter({'meme_generator.auth': 0.0, 'meme_generator': 1.0})
+
+        self.assertFalse(sampler.filter(self.make_record()))
+        self.assertTrue(sampler.filter(self.make_record(name='meme_generator.views')))
+        # Warnings are never sampled out
+        self.assertTrue(sampler.filter(self.make_record(level=logging.WARNING)))
+
+    def test_queue_handler_drops_instead_of_blocking(self):
+        stream = io.StringIO()
+        handler = QueueListenerHandler(stream=stream, queue_size=1)
+        handler.listener.stop()
+        handler._listening = False
+        try:
+            for _ in range(3):
+                handler.emit(self.make_record(token='abc'))
+            self.assertEqual(handler.dropped, 2)
+
+            # Redaction and formatting happen on the listener side
+            handler.listener.start()
+            handler._listening = True
+        finally:
+            handler.close()
+
+        line = json.loads(stream.getvalue())
+        self.assertEqual(line['token'], REDACTED)
+
+
+class IdempotencyKeyTestCase(APITestCase):
+
+    def setUp(self):
+        buckets().clear()
+        caches['idempotency'].clear()
+        self.user = User.objects.create_user(username='testuser', password='password')
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_TOKEN=self.token.key, HTTP_ID=str(self.user.id))
+        self.template = MemeTemplate.objects.create(name="Funny Template", image_url="http://example.com/image.png")
+        self.meme_url = reverse('meme_request')
+        self.data = {'template': self.template.id, 'top_text': 'Top', 'bottom_text': 'Bottom'}
+
+    def test_retry_replays_first_response(self):
+        """Test that retrying a creation with the same key does not create a duplicate."""
+        first = self.client.post(self.meme_url, self.data, HTTP_IDEMPOTENCY_KEY='abc')
+        retry = self.client.post(self.meme_url, self.data, HTTP_IDEMPOTENCY_KEY='abc')
+
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Meme.objects.count(), 1)
+
+    def test_keys_are_scoped(self):
+        """Test that the same key on another endpoint or without a key runs normally."""
+        meme_id = self.client.post(self.meme_url, self.data, HTTP_IDEMPOTENCY_KEY='abc').data['id']
+        response = self.client.post(f'/api/memes/{meme_id}/rate/', {'score': 4}, HTTP_IDEMPOTENCY_KEY='abc')
+        self.assertEqual(response.data['message'], 'Rating created successfully!')
+
+        self.client.post(self.meme_url, self.data)
+        self.assertEqual(Meme.objects.count(), 2)
+
+    def test_rating_retry_is_replayed(self):
+        meme_id = self.client.post(self.meme_url, self.data).data['id']
+        rate_url = f'/api/memes/{meme_id}/rate/'
+
+        first = self.client.post(rate_url, {'score': 4}, HTTP_IDEMPOTENCY_KEY='rate-1')
+        retry = self.client.post(rate_url, {'score': 4}, HTTP_IDEMPOTENCY_KEY='rate-1')
+
+        self.assertEqual(first.data['message'], 'Rating created successfully!')
+        self.assertEqual(retry.data, first.data)
+
+    def test_key_reuse_with_different_body(self):
+        self.client.post(self.meme_url, self.data, HTTP_IDEMPOTENCY_KEY='abc')
+        response = self.client.post(self.meme_url, dict(self.data, top_text='Other'), HTTP_IDEMPOTENCY_KEY='abc')
+
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(Meme.objects.count(), 1)
+
+    def test_concurrent_duplicate_waits_for_result(self):
+        """Test that a duplicate of an in-flight request waits for and replays its result."""
+        self.client.post(self.meme_url, self.data, HTTP_IDEMPOTENCY_KEY='abc')
+        store = caches['idempotency']
+        cache_key = idempotency_cache_key(str(self.user.id), 'POST', self.meme_url, 'abc')
+        finished = store.get(cache_key)
+        store.set(cache_key, {'state': 'in_flight', 'fingerprint': finished['fingerprint']})
+        threading.Timer(0.1, lambda: store.set(cache_key, finished)).start()
+
+        response = self.client.post(self.meme_url, self.data, HTTP_IDEMPOTENCY_KEY='abc')
+
+        self.assertEqual(response['Idempotent-Replayed'], 'true')
+        self.assertEqual(Meme.objects.count(), 1)
+
+
+class MemeDedupTestCase(APITestCase):
+
+    def setUp(self):
+        buckets().clear()
+        self.user = User.objects.create_user(username='testuser', password='password')
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_TOKEN=self.token.key, HTTP_ID=str(self.user.id))
+        self.template = MemeTemplate.objects.create(name="Funny Template", image_url="http://example.com/image.png")
+        self.meme_url = reverse('meme_request')
+        self.data = {'template': self.template.id, 'top_text': 'Top  text', 'bottom_text': 'Bottom'}
+
+    def test_content_hash_normalizes_text(self):
+        self.assertEqual(
+            Meme.compute_content_hash(self.template.id, ' TOP   text ', 'bottom'),
+            Meme.compute_content_hash(self.template.id, 'top text', 'Bottom'),
+        )
+        self.assertNotEqual(
+            Meme.compute_content_hash(self.template.id, 'top', 'text bottom'),
+            Meme.compute_content_hash(self.template.id, 'top text', 'bottom'),
+        )
+
+    def test_allow_mode_stores_duplicates(self):
+        first = self.client.post(self.meme_url, self.data)
+        second = self.client.post(self.meme_url, dict(self.data, top_text='TOP TEXT'))
+
+        self.assertEqual(second.status_code, status.HTTP_201_CREATED)
+        self.assertNotEqual(first.data['id'], second.data['id'])
+        self.assertIsNotNone(Meme.objects.get(id=first.data['id']).content_hash)
+        self.assertIsNone(Meme.objects.get(id=second.data['id']).content_hash)
+
+    def test_reuse_mode_returns_existing_meme(self):
+        first = self.client.post(self.meme_url, self.data)
+        with self.settings(MEME_DEDUP_MODE='reuse'):
+            second = self.client.post(self.meme_url, dict(self.data, top_text='top text'))
+
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertEqual(second.data['id'], first.data['id'])
+        self.assertEqual(Meme.objects.count(), 1)
+
+    def test_reject_mode_returns_conflict(self):
+        first = self.client.post(self.meme_url, self.data)
+        with self.settings(MEME_DEDUP_MODE='reject'):
+            second = self.client.post(self.meme_url, self.data)
+
+        self.assertEqual(second.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(second.data['id'], first.data['id'])
+        self.assertEqual(Meme.objects.count(), 1)
+
+    def test_backfill_hashes_oldest_meme_of_each_cluster(self):
+        memes = [
+            Meme.objects.create(template=self.template, created_by=self.user, top_text=top, bottom_text='Bottom')
+            for top in ('Top', 'top', 'Other', 'TOP')
+        ]
+        out = io.StringIO()
+
+        call_command('backfill_meme_hashes', '--dry-run', stdout=out)
+        self.assertIn('Would hash 2 of 4 memes; 2 duplicates in 1 clusters.', out.getvalue())
+        self.assertFalse(Meme.objects.exclude(content_hash=None).exists())
+
+        call_command('backfill_meme_hashes', '--batch-size', '2', stdout=out)
+        hashed = set(Meme.objects.exclude(content_hash=None).values_list('id', flat=True))
+        self.assertEqual(hashed, {memes[0].id, memes[2].id})
+        self.assertIn(f'meme {memes[0].id}: 2 duplicates', out.getvalue())
+
+    def test_backfill_dry_run_counts_clusters_per_template(self):
+        other = MemeTemplate.objects.create(name='Other template', image_url='http://example.com/other.jpg')
+        for template, top in ((self.template, 'Top'), (other, 'Top'), (self.template, 'top'),
+                              (other, 'Other'), (other, 'TOP'), (self.template, 'Top')):
+            Meme.objects.create(template=template, created_by=self.user, top_text=top, bottom_text='Bottom')
+        out = io.StringIO()
+
+        call_command('backfill_meme_hashes', '--dry-run', '--batch-size', '1', '--top', '1', stdout=out)
+        self.assertIn('Would hash 3 of 6 memes; 3 duplicates in 2 clusters.', out.getvalue())
+        self.assertEqual(out.getvalue().count('duplicates\n'), 1)
+        self.assertIn(f'meme {Meme.objects.filter(template=self.template).earliest("id").id}: 2 duplicates',
+                      out.getvalue())
+
+
+class FeedMemeTestCase(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='password')
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_TOKEN=self.token.key, HTTP_ID=str(self.user.id))
+        self.template = MemeTemplate.objects.create(name="Funny Template", image_url="http://example.com/image.png")
+        self.memes = [
+            Meme.objects.create(template=self.template, created_by=self.user, top_text=f'Top {i}', bottom_text='Bottom')
+            for i in range(7)
+        ]
+        for meme in self.memes[::3]:
+            Rating.objects.create(meme=meme, user=self.user, score=3)
+        self.unrated = {meme.id for meme in self.memes} - {meme.id for meme in self.memes[::3]}
+        self.feed_url = reverse('meme_feed')
+
+    def walk(self, url):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids += [meme['id'] for meme in response.data['results']]
+            url = response.data['next']
+        return ids
+
+    def test_recent_feed_skips_rated_memes(self):
+        ids = self.walk(self.feed_url + '?limit=2')
+        self.assertEqual(ids, sorted(self.unrated, reverse=True))
+
+    def test_shuffled_feed_visits_each_unrated_meme_once(self):
+        ids = self.walk(self.feed_url + '?order=shuffle&limit=3')
+        self.assertEqual(len(ids), len(self.unrated))
+        self.assertEqual(set(ids), self.unrated)
+
+    def test_shuffled_feed_wraps_around_start_point(self):
+        for i, meme in enumerate(self.memes):
+            Meme.objects.filter(id=meme.id).update(shuffle_key=i / 10)
+        with mock.patch('meme_generator.feed.random.random', return_value=0.35):
+            ids = self.walk(self.feed_url + '?order=shuffle&limit=2')
+        expected = [m.id for m in self.memes[4:] + self.memes[:4] if m.id in self.unrated]
+        self.assertEqual(ids, expected)
+
+    def test_feed_only_excludes_own_ratings(self):
+        other = User.objects.create_user(username='other', password='password')
+        Rating.objects.create(meme=self.memes[1], user=other, score=5)
+        ids = self.walk(self.feed_url)
+        self.assertIn(self.memes[1].id, ids)
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.client.get(self.feed_url + '?order=hot').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(self.feed_url + '?cursor=garbage').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(self.feed_url + '?limit=x').status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class UserStatsTestCase(APITestCase):
+
+    def setUp(self):
+        buckets().clear()
+        self.user = User.objects.create_user(username='testuser', password='password')
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_TOKEN=self.token.key, HTTP_ID=str(self.user.id))
+        self.author = User.objects.create_user(username='author', password='password')
+        self.template = MemeTemplate.objects.create(name="Funny Template", image_url="http://example.com/image.png")
+        self.meme = Meme.objects.create(template=self.template, created_by=self.author, top_text='Top', bottom_text='Bottom')
+
+    def stats(self, user):
+        response = self.client.get(reverse('user_stats', args=[user.id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_counters_follow_memes_and_ratings(self):
+        self.client.post(reverse('meme_request'), {'template': self.template.id, 'top_text': 'A', 'bottom_text': 'B'})
+        rate_url = reverse('rate_meme', args=[self.meme.id])
+        self.client.post(rate_url, {'score': 2})
+        self.client.post(rate_url, {'score': 5})  # update: only the score changes
+
+        self.assertEqual(self.stats(self.user), {
+            'user': self.user.id, 'memes_created': 1, 'ratings_given': 1, 'ratings_received': 0, 'avg_score': None,
+        })
+        self.assertEqual(self.stats(self.author)['ratings_received'], 1)
+        self.assertEqual(self.stats(self.author)['avg_score'], 5)
+
+    def test_invalid_score_leaves_counters_untouched(self):
+        response = self.client.post(reverse('rate_meme', args=[self.meme.id]), {'score': 'abc'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.stats(self.user)['ratings_given'], 0)
+
+    def test_unknown_user(self):
+        response = self.client.get(reverse('user_stats', args=[9999]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_reconcile_fixes_drift(self):
+        # Rows written outside the endpoints are not counted until reconciled
+        Rating.objects.create(meme=self.meme, user=self.user, score=4)
+        self.assertEqual(self.stats(self.user)['ratings_given'], 0)
+
+        out = io.StringIO()
+        call_command('reconcile_user_stats', '--batch-size', '1', stdout=out)
+        self.assertIn('Fixed counters of 2 of 2 users.', out.getvalue())
+        self.assertEqual(self.stats(self.user)['ratings_given'], 1)
+        self.assertEqual(self.stats(self.author)['memes_created'], 1)
+        self.assertEqual(self.stats(self.author)['avg_score'], 4)
+
+        call_command('reconcile_user_stats', stdout=out)
+        self.assertIn('Fixed counters of 0 of 2 users.', out.getvalue())
+
+
+class RatingHistogramTestCase(APITestCase):
+
+    def setUp(self):
+        buckets().clear()
+        self.user = User.objects.create_user(username='testuser', password='password')
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_TOKEN=self.token.key, HTTP_ID=str(self.user.id))
+        self.template = MemeTemplate.objects.create(name="Funny Template", image_url="http://example.com/image.png")
+        self.meme = Meme.objects.create(template=self.template, created_by=self.user, top_text='Top', bottom_text='Bottom')
+        self.unrated = Meme.objects.create(template=self.template, created_by=self.user, top_text='New', bottom_text='Meme')
+
+    def rate(self, user, score):
+        token = Token.objects.get_or_create(user=user)[0]
+        self.client.credentials(HTTP_TOKEN=token.key, HTTP_ID=str(user.id))
+        return self.client.post(reverse('rate_meme', args=[self.meme.id]), {'score': score})
+
+    def test_histogram_tracks_inserts_and_updates(self):
+        other = User.objects.create_user(username='other', password='password')
+        self.rate(self.user, 2)
+        self.rate(other, 4)
+        self.rate(self.user, 4)  # moves the first rating from 2 to 4
+
+        response = self.client.get(reverse('retrieve_meme', args=[self.meme.id]) + '?expand=histogram')
+        self.assertEqual(response.data['histogram'], {'1': 0, '2': 0, '3': 0, '4': 2, '5': 0})
+
+    def test_list_page_embeds_histograms(self):
+        self.rate(self.user, 5)
+        with self.assertNumQueries(3):  # auth, count, page: nothing per meme
+            response = self.client.get(reverse('meme_request') + '?fields=id&expand=histogram')
+        histograms = {meme['id']: meme['histogram'] for meme in response.data['results']}
+        self.assertEqual(histograms[self.meme.id]['5'], 1)
+        self.assertEqual(histograms[self.unrated.id], {'1': 0, '2': 0, '3': 0, '4': 0, '5': 0})
+
+    def test_out_of_range_score_is_rejected(self):
+        for score in (0, 6):
+            self.assertEqual(self.rate(self.user, score).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Rating.objects.exists())
+
+
+class EventStreamTestCase(APITestCase):
+
+    def setUp(self):
+        broadcaster.reset()
+        self.addCleanup(broadcaster.reset)
+        self.user = User.objects.create_user(username='testuser', password='password')
+        self.token = Token.objects.create(user=self.user)
+        self.template = MemeTemplate.objects.create(name="Funny Template", image_url="http://example.com/image.png")
+
+    def scope(self, *headers):
+        return {'type': 'http', 'method': 'GET', 'path': '/api/stream/', 'query_string': b'', 'headers': [
+            (b'token', self.token.key.encode()), (b'id', str(self.user.id).encode()), *headers,
+        ]}
+
+    def stream(self, scope, until, publish=()):
+        """Run the stream app until a body containing ``until`` is sent."""
+        async def run():
+            sent, stop = [], asyncio.Event()
+            # Like ASGI servers: the empty request body first, then the disconnect
+            messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+
+            async def receive():
+                if messages:
+                    return messages.pop(0)
+                await stop.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                sent.append(message)
+                if until in message.get('body', b''):
+                    stop.set()
+
+            task = asyncio.ensure_future(stream_app(scope, receive, send))
+            while not broadcaster.subscribers and not task.done():
+                await asyncio.sleep(0.01)
+            for event_type, data in publish:
+                broadcaster.publish(event_type, data)
+            await asyncio.wait_for(task, 5)
+            return sent
+
+        return async_to_sync(run)()
+
+    def test_subscriber_coalesces_and_resyncs(self):
+        subscriber = Subscriber(max_size=2)
+        for i in range(1, 4):
+            subscriber.push(Event(str(i), 'meme', {'id': i}))
+            subscriber.push(Event(f'{i}b', 'leaderboard', {'meme': i}), coalesce=True)
+
+        self.assertEqual(subscriber.drain(), [Event('3', 'resync', {}), Event('3b', 'leaderboard', {'meme': 3})])
+        self.assertEqual(subscriber.drain(), [])
+
+    def test_local_backend_resume(self):
+        with self.settings(EVENTS_HISTORY_SIZE=2):
+            broadcaster.reset()
+            for i in range(1, 5):
+                broadcaster.publish('meme', {'id': i})
+            backend = broadcaster.backend
+            third, fourth = backend.history
+            prefix = third.id.partition('-')[0]
+
+            self.assertEqual(backend.since(third.id), [fourth])
+            self.assertEqual(backend.since(fourth.id), [])
+            self.assertEqual(backend.since(f'{prefix}-2'), [third, fourth])
+            # Event 2 was evicted, or the id comes from another process
+            self.assertIsNone(backend.since(f'{prefix}-1'))
+            self.assertIsNone(backend.since('abc-1'))
+
+    def test_new_meme_is_published_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            meme = Meme.objects.create(template=self.template, created_by=self.user, top_text='Top', bottom_text='Bottom')
+            self.assertEqual(len(broadcaster.backend.history), 0)
+
+        event = broadcaster.backend.history[-1]
+        self.assertEqual((event.type, event.data['id'], event.data['top_text']), ('meme', meme.id, 'Top'))
+
+    def test_stream_pushes_events(self):
+        sent = self.stream(self.scope(), b'event: meme', publish=[('meme', {'id': 7})])
+
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertIn((b'content-type', b'text/event-stream'), sent[0]['headers'])
+        self.assertIn(b'data: {"id":7}', sent[-2]['body'])
+        self.assertEqual(sent[-1], {'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+    def test_stream_resumes_after_last_event_id(self):
+        broadcaster.publish('meme', {'id': 1})
+        broadcaster.publish('meme', {'id': 2})
+        first = broadcaster.backend.history[0]
+
+        sent = self.stream(self.scope((b'last-event-id', first.id.encode())), b'event: meme')
+        self.assertIn(b'data: {"id":2}', sent[-2]['body'])
+        self.assertNotIn(b'data: {"id":1}', sent[-2]['body'])
+
+    def test_stream_requires_authentication(self):
+        scope = dict(self.scope(), headers=[(b'token', b'wrong'), (b'id', str(self.user.id).encode())])
+        sent = self.stream(scope, b'Invalid token')
+        self.assertEqual(sent[0]['status'], 400)
+
+
+class DeletionTestCase(APITestCase):
+
+    def setUp(self):
+        buckets().clear()
+        cache.clear()
+        self.author = User.objects.create_user(username='author', password='password')
+        self.rater = User.objects.create_user(username='rater', password='password')
+        self.template = MemeTemplate.objects.create(name="Funny Template", image_url="http://example.com/image.png")
+        self.memes = [self.create_meme(self.author, f'Top {i}') for i in range(3)]
+        self.rater_meme = self.create_meme(self.rater, 'Mine')
+        for meme in self.memes:
+            self.rate(self.rater, meme, 4)
+        self.rate(self.author, self.rater_meme, 2)
+        self.login(self.author)
+
+    def login(self, user):
+        token = Token.objects.get_or_create(user=user)[0]
+        self.client.credentials(HTTP_TOKEN=token.key, HTTP_ID=str(user.id))
+
+    def create_meme(self, user, top_text):
+        self.login(user)
+        data = {'template': self.template.id, 'top_text': top_text, 'bottom_text': 'Bottom'}
+        return Meme.objects.get(id=self.client.post(reverse('meme_request'), data).data['id'])
+
+    def rate(self, user, meme, score):
+        self.login(user)
+        self.client.post(reverse('rate_meme', args=[meme.id]), {'score': score})
+
+    def stats(self, user):
+        self.login(self.rater if user == self.author else self.author)
+        return self.client.get(reverse('user_stats', args=[user.id])).data
+
+    def listed_ids(self):
+        return [meme['id'] for meme in self.client.get(reverse('meme_request') + '?fields=id').data['results']]
+
+    def test_meme_deletion_hides_then_purges(self):
+        meme = self.memes[0]
+        detail_url = reverse('retrieve_meme', args=[meme.id])
+        self.assertEqual(self.client.get(detail_url).status_code, status.HTTP_200_OK)  # now cached
+
+        response = self.client.delete(detail_url)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['status'], 'pending')
+        self.assertEqual(self.client.get(detail_url).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertNotIn(meme.id, self.listed_ids())
+        self.assertEqual(self.client.post(reverse('rate_meme', args=[meme.id]), {'score': 1}).status_code,
+                         status.HTTP_404_NOT_FOUND)
+
+        call_command('purge_deleted', '--sleep', '0', stdout=io.StringIO())
+        self.assertFalse(Meme.objects.filter(id=meme.id).exists())
+        self.assertEqual(self.client.get(response.data['status_url']).data['status'], 'done')
+        self.assertEqual(self.client.get(response.data['status_url']).data['ratings_deleted'], 1)
+        self.assertEqual(self.stats(self.author)['memes_created'], 2)
+        self.assertEqual(self.stats(self.rater)['ratings_given'], 2)
+
+    def test_only_the_creator_can_delete_a_meme(self):
+        self.login(self.rater)
+        response = self.client.delete(reverse('retrieve_meme', args=[self.memes[0].id]))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertFalse(PendingDeletion.objects.exists())
+
+    def test_user_deletion_purges_in_batches(self):
+        response = self.client.delete(reverse('user', args=[self.author.id]))
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        # Logged out everywhere and hidden, together with the user's memes
+        self.assertEqual(self.client.get(reverse('meme_request')).status_code, status.HTTP_400_BAD_REQUEST)
+        self.login(self.rater)
+        self.assertEqual(self.listed_ids(), [self.rater_meme.id])
+
+        out = io.StringIO()
+        with mock.patch('meme_generator.signals.invalidate_payload') as per_row, \
+                mock.patch('meme_generator.deletion.publish') as purge_publish:
+            call_command('purge_deleted', '--batch-size', '1', '--sleep', '0', stdout=out)
+        per_row.assert_not_called()
+        purge_publish.assert_called_once_with('leaderboard', {'meme': None})
+        self.assertIn('memes, 4 ratings deleted (done)', out.getvalue())
+        self.assertIn('1 memes, 2 ratings deleted (in progress)', out.getvalue())
+        self.assertFalse(User.objects.filter(id=self.author.id).exists())
+        self.assertFalse(Meme.objects.filter(created_by_id=self.author.id).exists())
+
+        # Counters of the remaining user follow the purged rows
+        rater_stats = self.client.get(reverse('user_stats', args=[self.rater.id])).data
+        self.assertEqual((rater_stats['ratings_given'], rater_stats['ratings_received']), (0, 0))
+        histogram = self.client.get(reverse('retrieve_meme', args=[self.rater_meme.id]) + '?expand=histogram').data
+        self.assertEqual(histogram['histogram']['2'], 0)
+
+    def test_template_deletion_requires_staff(self):
+        url = reverse('meme_template', args=[self.template.id])
+        self.assertEqual(self.client.delete(url).status_code, status.HTTP_403_FORBIDDEN)
+
+        User.objects.filter(id=self.author.id).update(is_staff=True)
+        self.assertEqual(self.client.delete(url).status_code, status.HTTP_202_ACCEPTED)
+        self.assertNotIn('Funny Template', [t['name'] for t in self.client.get(reverse('receive_all_templates')).data])
+        self.assertEqual(self.listed_ids(), [])
+        response = self.client.post(reverse('meme_request'), {'template': self.template.id, 'top_text': 'New'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class RatingCompactionTestCase(APITestCase):
+
+    def setUp(self):
+        buckets().clear()
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='password')
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_TOKEN=self.token.key, HTTP_ID=str(self.user.id))
+        self.other = User.objects.create_user(username='other', password='password')
+        self.template = MemeTemplate.objects.create(name="Funny Template", image_url="http://example.com/image.png")
+        self.meme = Meme.objects.create(template=self.template, created_by=self.other, top_text='Top', bottom_text='Bottom')
+        self.client.post(reverse('rate_meme', args=[self.meme.id]), {'score': 2})
+        Rating.objects.create(meme=self.meme, user=self.other, score=5)
+        # The user's rating is past the retention horizon, the other one is recent
+        Rating.objects.filter(user=self.user).update(created_at=timezone.now() - timedelta(days=365))
+
+    def compact(self):
+        out = io.StringIO()
+        call_command('compact_ratings', '--days', '30', stdout=out)
+        return out.getvalue()
+
+    def rating(self):
+        data = self.client.get(reverse('retrieve_meme', args=[self.meme.id]) + '?expand=rating').data
+        return data['rating']
+
+    def test_compaction_keeps_totals(self):
+        self.assertEqual(self.rating(), {'avg': 3.5, 'count': 2})
+        self.assertIn('Compacted 1 ratings', self.compact())
+
+        self.assertEqual(list(Rating.objects.values_list('user_id', flat=True)), [self.other.id])
+        self.assertTrue(CompactedRating.objects.filter(meme=self.meme, user=self.user, score=2).exists())
+        self.assertEqual(self.rating(), {'avg': 3.5, 'count': 2})
+        top = self.client.get(reverse('top memes')).data
+        self.assertEqual(top[0]['avg_rating'], 3.5)
+        self.assertIn('Compacted 0 ratings', self.compact())
+
+    def test_compacted_rating_stays_unique(self):
+        self.compact()
+        response = self.client.post(reverse('rate_meme', args=[self.meme.id]), {'score': 4})
+
+        self.assertEqual(response.data['message'], 'Rating updated successfully!')
+        self.assertFalse(Rating.objects.filter(user=self.user).exists())
+        self.assertEqual(self.rating(), {'avg': 4.5, 'count': 2})
+        self.assertEqual(self.client.get(reverse('meme_feed')).data['results'], [])
+
+    def test_reconcile_and_purge_include_compacted_ratings(self):
+        self.compact()
+        out = io.StringIO()
+        call_command('reconcile_user_stats', stdout=out)
+        stats = self.client.get(reverse('user_stats', args=[self.other.id])).data
+        self.assertEqual((stats['ratings_received'], stats['avg_score']), (2, 3.5))
+
+        self.client.delete(reverse('user', args=[self.user.id]))
+        call_command('purge_deleted', '--sleep', '0', stdout=out)
+        self.assertFalse(CompactedRating.objects.exists())
+        self.assertEqual(RatingAggregate.objects.get(meme=self.meme).count, 0)
+        self.client.credentials(HTTP_TOKEN=Token.objects.create(user=self.other).key, HTTP_ID=str(self.other.id))
+        self.assertEqual(self.rating(), {'avg': 5.0, 'count': 1})
+
+
+@skipUnless(connection.vendor == 'sqlite', 'SQLite profile')
+class SQLiteProfileTestCase(SimpleTestCase):
+    databases = {'default'}
+
+    def test_connection_pragmas(self):
+        with connection.cursor() as cursor:
+            pragmas = {name: cursor.execute(f'PRAGMA {name}').fetchone()[0]
+                       for name in ('synchronous', 'busy_timeout', 'cache_size', 'temp_store')}
+
+        self.assertEqual(pragmas, {
+            'synchronous': 1,  # NORMAL
+            'busy_timeout': settings.SQLITE_BUSY_TIMEOUT,
+            'cache_size': -settings.SQLITE_CACHE_SIZE,
+            'temp_store': 2,  # MEMORY
+        })
+        self.assertEqual(connection.transaction_mode, 'IMMEDIATE')
+
+
+class WarmupTestCase(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        warmup.reset()
+        self.addCleanup(warmup.reset)
+
+    def test_ready_after_warm_up(self):
+        with mock.patch.object(warmup, 'warm_up', side_effect=RuntimeError('database down')):
+            warmup.startup()
+            response = self.client.get(reverse('ready'))
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertFalse(response.data['ready'])
+
+        # The probe retries the warm-up in the background and stays not ready meanwhile
+        with mock.patch.object(warmup, 'startup') as startup:
+            response = self.client.get(reverse('ready'))
+            warmup._retry.join()
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        startup.assert_called_once_with(keep_connections=False)
+
+        self.client.get(reverse('ready'))
+        warmup._retry.join()
+        response = self.client.get(reverse('ready'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data['ready'])
+        report = response.data['warmup']
+        self.assertEqual(set(report['steps']), {'imports', 'urls', 'database', 'caches'})
+        self.assertIn('meme_generator.views', report['imports'])
+        for key in (TEMPLATES_CACHE_KEY, TOP_MEMES_CACHE_KEY, MEME_COUNT_CACHE_KEY):
+            self.assertIsNotNone(cache.get(key))
+
+    def test_warm_up_runs_once(self):
+        first = warmup.warm_up(setup=0.5)
+        self.assertEqual(first['steps']['django_setup'], 0.5)
+        with mock.patch.object(warmup, '_fill_caches') as fill:
+            self.assertIs(warmup.warm_up(), first)
+        fill.assert_not_called()
+
+    def test_warm_up_can_close_its_connections(self):
+        with mock.patch.object(warmup.connections, 'close_all') as close_all:
+            warmup.warm_up()
+            close_all.assert_not_called()
+            warmup.reset()
+            warmup.warm_up(keep_connections=False)
+        close_all.assert_called_once_with()
+
+    def test_disabled_warm_up_is_ready(self):
+        with self.settings(WARMUP_ON_STARTUP=False), mock.patch.object(warmup, 'warm_up') as warm_up:
+            warmup.startup()
+        warm_up.assert_not_called()
+        self.assertTrue(warmup.is_ready())
+
+    def test_warmup_command(self):
+        out = io.StringIO()
+        call_command('warmup', stdout=out)
+        self.assertIn('meme_generator.urls', out.getvalue())
+        self.assertIn('Warm-up finished', out.getvalue())
+
+
+class SnapshotTestCase(APITestCase):
+
+    def setUp(self):
+        buckets().clear()
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='password')
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_TOKEN=self.token.key, HTTP_ID=str(self.user.id))
+        # Large enough to be precompressed
+        self.templates = [MemeTemplate.objects.create(name=f'Template {n}', image_url=f'http://example.com/{n}.png')
+                          for n in range(30)]
+        self.meme = Meme.objects.create(template=self.templates[0], created_by=self.user, top_text='Top', bottom_text='Bottom')
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.dir = Path(directory.name)
+
+    def publish(self):
+        out = io.StringIO()
+        call_command('publish_snapshots', '--dir', str(self.dir), stdout=out)
+        return out.getvalue()
+
+    def test_snapshots_match_the_api(self):
+        self.client.post(reverse('rate_meme', args=[self.meme.id]), {'score': 4})
+        self.publish()
+
+        manifest = read_manifest(self.dir)
+        templates = manifest['snapshots']['templates']
+        self.assertEqual(json.loads((self.dir / templates['path']).read_bytes()),
+                         json.loads(self.client.get(reverse('receive_all_templates')).content))
+        self.assertEqual(json.loads((self.dir / 'top_memes.json').read_bytes()),
+                         json.loads(self.client.get(reverse('top memes')).content))
+        self.assertIn('gzip', templates['encodings'])
+        self.assertEqual(gzip.decompress((self.dir / 'templates.json.gz').read_bytes()),
+                         (self.dir / 'templates.json').read_bytes())
+
+    def test_alias_variants_switch_through_one_link(self):
+        self.publish()
+        MemeTemplate.objects.create(name='Template 30', image_url='http://example.com/30.png')
+        self.publish()
+
+        path = self.dir / read_manifest(self.dir)['snapshots']['templates']['path']
+        self.assertEqual((self.dir / 'templates.current').resolve(), path.parent.resolve())
+        for suffix in SUFFIXES.values():
+            self.assertEqual(os.readlink(self.dir / f'templates.json{suffix}'), f'templates.current/templates.json{suffix}')
+        self.assertEqual(gzip.decompress((self.dir / 'templates.json.gz').read_bytes()), path.read_bytes())
+
+    def test_republish_only_on_change(self):
+        self.publish()
+        first = read_manifest(self.dir)
+        self.assertIn('unchanged', self.publish())
+        self.assertEqual(read_manifest(self.dir), first)
+
+        self.client.post(reverse('rate_meme', args=[self.meme.id]), {'score': 4})
+        self.assertIn('top_memes: published', self.publish())
+        second = read_manifest(self.dir)
+        self.assertEqual(second['snapshots']['templates'], first['snapshots']['templates'])
+        self.assertNotEqual(second['snapshots']['top_memes']['version'], first['snapshots']['top_memes']['version'])
+        # Clients holding the previous manifest can still fetch the old version
+        self.assertTrue((self.dir / first['snapshots']['top_memes']['path']).exists())
+        self.assertEqual(json.loads((self.dir / 'top_memes.json').read_bytes())[0]['avg_rating'], 4.0)
+
+    def test_old_versions_are_pruned(self):
+        with self.settings(SNAPSHOT_KEEP_VERSIONS=2):
+            for score in (1, 2, 3):
+                self.client.post(reverse('rate_meme', args=[self.meme.id]), {'score': score})
+                publish(['top_memes'], self.dir)
+        self.assertEqual(len(list((self.dir / 'top_memes').iterdir())), 2)
+        self.assertTrue((self.dir / read_manifest(self.dir)['snapshots']['top_memes']['path']).exists())
+
+
+def template_png(width=300, height=200):
+    out = io.BytesIO()
+    Image.new('RGB', (width, height), 'navy').save(out, format='PNG')
+    return out.getvalue()
+
+
+class MemeImageTestCase(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='password')
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_TOKEN=self.token.key, HTTP_ID=str(self.user.id))
+        self.template = MemeTemplate.objects.create(name="Funny Template", image_url="http://example.com/image.png")
+        self.meme = Meme.objects.create(template=self.template, created_by=self.user, top_text='Top', bottom_text='Bottom')
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        sizes = {'thumb': 50, 'preview': 120, 'full': None}
+        settings_override = self.settings(RENDER_CACHE_DIR=directory.name, RENDER_SIZES=sizes)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def get_image(self, size=None, **extra):
+        params = {'size': size} if size else {}
+        return self.client.get(reverse('meme_image', args=[self.meme.id]), params, **extra)
+
+    def test_invalid_size(self):
+        response = self.get_image('huge')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('size', response.data)
+
+    def test_missing_meme(self):
+        response = self.client.get(reverse('meme_image', args=[self.meme.id + 1]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_rendering_unavailable_without_pillow(self):
+        with mock.patch('meme_generator.views.Image', None):
+            self.assertEqual(self.get_image().status_code, status.HTTP_501_NOT_IMPLEMENTED)
+
+    @skipUnless(Image, 'requires Pillow')
+    def test_one_render_stores_every_size(self):
+        with mock.patch('meme_generator.rendering.fetch_source', return_value=template_png()) as fetch:
+            response = self.get_image('thumb')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response['Content-Type'], 'image/png')
+            self.assertEqual(Image.open(io.BytesIO(response.content)).size, (50, 33))
+
+            # The other sizes come from the store, and the template image is fetched once
+            self.assertEqual(Image.open(io.BytesIO(self.get_image('preview').content)).size, (120, 80))
+            full = self.get_image()
+            self.assertEqual(Image.open(io.BytesIO(full.content)).size, (300, 200))
+        fetch.assert_called_once_with('http://example.com/image.png')
+
+        response = self.get_image(HTTP_IF_NONE_MATCH=full['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertNotEqual(full['ETag'], self.get_image('thumb')['ETag'])
+
+    @skipUnless(Image, 'requires Pillow')
+    def test_unavailable_template_image(self):
+        with mock.patch('meme_generator.rendering.fetch_source', return_value=b'not an image'):
+            response = self.get_image()
+        self.assertEqual(response.status_code, status.HTTP_502_BAD_GATEWAY)
+
+    @skipUnless(Image, 'requires Pillow')
+    def test_oversized_template_image(self):
+        with mock.patch('meme_generator.rendering.fetch_source', return_value=template_png()):
+            with self.settings(TEMPLATE_MAX_PIXELS=100):
+                self.assertEqual(self.get_image().status_code, status.HTTP_502_BAD_GATEWAY)
+            # Past twice its own limit Pillow refuses to open the image at all
+            with mock.patch.object(Image, 'MAX_IMAGE_PIXELS', 1000):
+                self.assertEqual(self.get_image().status_code, status.HTTP_502_BAD_GATEWAY)
+
+    def test_fetch_source_refuses_other_schemes(self):
+        with self.settings(RENDER_FETCH_REMOTE=True), self.assertRaises(SourceUnavailable):
+            fetch_source('file:///etc/passwd')
+        with self.assertRaises(SourceUnavailable):
+            fetch_source('http://example.com/image.png')
+
+    def test_fetch_source_refuses_internal_addresses(self):
+        with self.settings(RENDER_FETCH_REMOTE=True), mock.patch('socket.create_connection') as connect:
+            for url in ('http://127.0.0.1:8000/', 'http://localhost/', 'http://169.254.169.254/latest/meta-data/',
+                        'https://10.0.0.1/', 'http://[::ffff:192.168.0.1]/'):
+                with self.assertRaisesRegex(SourceUnavailable, 'non-public address'):
+                    fetch_source(url)
+        connect.assert_not_called()
+
+    def test_fetch_source_checks_redirects(self):
+        requested = []
+
+        class Redirect(BaseHTTPRequestHandler):
+            def do_GET(self):
+                requested.append(self.path)
+                self.send_response(302)
+                self.send_header('Location', f'http://127.0.0.1:{self.server.server_port}/internal')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(('127.0.0.1', 0), Redirect)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        # public.test looks public, and connecting to it reaches the local server
+        resolve, connect = socket.getaddrinfo, socket.create_connection
+        public = '93.184.215.14'
+        with self.settings(RENDER_FETCH_REMOTE=True), \
+                mock.patch('socket.getaddrinfo', lambda host, port, *args, **kwargs: (
+                    [(socket.AF_INET, socket.SOCK_STREAM, 6, '', (public, port))] if host == 'public.test'
+                    else resolve(host, port, *args, **kwargs))), \
+                mock.patch('socket.create_connection', lambda address, *args: connect(
+                    ('127.0.0.1', address[1]) if address[0] == public else address, *args)):
+            with self.assertRaisesRegex(SourceUnavailable, 'non-public address'):
+                fetch_source(f'http://public.test:{server.server_port}/image.png')
+        self.assertEqual(requested, ['/image.png'])
+
+    def test_unavailable_source_does_not_leak_the_reason(self):
+        with mock.patch('meme_generator.rendering.fetch_source', side_effect=SourceUnavailable('Could not fetch x')):
+            response = self.get_image()
+        self.assertEqual(response.status_code, status.HTTP_502_BAD_GATEWAY)
+        self.assertEqual(response.data, {'error': 'The template image is unavailable.'})
+
+    @skipUnless(Image, 'requires Pillow')
+    def test_render_memes_command(self):
+        out = io.StringIO()
+        with mock.patch('meme_generator.management.commands.render_memes.fetch_source', return_value=template_png()):
+            call_command('render_memes', '--workers', '2', stdout=out)
+            self.assertIn('Rendered 1 memes (0 failed)', out.getvalue())
+            call_command('render_memes', '--workers', '2', stdout=out)
+            self.assertIn('Rendered 0 memes (0 failed)', out.getvalue())
+
+        with mock.patch('meme_generator.rendering.fetch_source') as fetch:
+            self.assertEqual(self.get_image('thumb').status_code, status.HTTP_200_OK)
+        fetch.assert_not_called()
+
+
+@skipUnless(Image, 'requires Pillow')
+class TemplateAssetTestCase(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='password')
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_TOKEN=self.token.key, HTTP_ID=str(self.user.id))
+        assets, renders = tempfile.TemporaryDirectory(), tempfile.TemporaryDirectory()
+        self.addCleanup(assets.cleanup)
+        self.addCleanup(renders.cleanup)
+        settings_override = self.settings(TEMPLATE_ASSET_DIR=assets.name, RENDER_CACHE_DIR=renders.name,
+                                          RENDER_SIZES={'thumb': 50, 'full': None})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(open_raster.cache_clear)
+
+    def create_template(self, image):
+        return self.client.post(reverse('create_meme_template'), {
+            'name': 'Uploaded', 'image_url': 'http://example.com/uploaded.png', 'image': image,
+        }, format='multipart')
+
+    def test_uploaded_image_is_stored_decoded(self):
+        response = self.create_template(SimpleUploadedFile('template.png', template_png(), 'image/png'))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        template = MemeTemplate.objects.get(name='Uploaded')
+        raster = open_raster(template.image_asset)
+        self.assertEqual(raster.size, (300, 200))
+        self.assertTrue(raster.readonly)  # backed by the mapped file, not a copy
+        self.assertEqual(raster.getpixel((0, 0))[:3], (0, 0, 128))
+
+        # Renders read the stored raster instead of fetching the image URL
+        meme = Meme.objects.create(template=template, created_by=self.user, top_text='Top', bottom_text='Bottom')
+        with mock.patch('meme_generator.rendering.fetch_source') as fetch:
+            response = self.client.get(reverse('meme_image', args=[meme.id]), {'size': 'thumb'})
+        self.assertEqual(Image.open(io.BytesIO(response.content)).size, (50, 33))
+        fetch.assert_not_called()
+
+    def test_invalid_upload(self):
+        response = self.create_template(SimpleUploadedFile('template.png', b'not an image', 'image/png'))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('image', response.data)
+        self.assertFalse(MemeTemplate.objects.filter(name='Uploaded').exists())
+
+    def test_oversized_upload(self):
+        with self.settings(TEMPLATE_MAX_PIXELS=100):
+            response = self.create_template(SimpleUploadedFile('template.png', template_png(), 'image/png'))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('pixels', response.data['image'][0])
+        self.assertFalse(any(Path(settings.TEMPLATE_ASSET_DIR).rglob('*.raw')))
+
+    def test_corrupt_raster(self):
+        key = asset_key(b'corrupt')
+        path = Path(settings.TEMPLATE_ASSET_DIR) / key[:2] / f'{key}.raw'
+        path.parent.mkdir(parents=True)
+        # Empty, shorter than the header, and truncated pixels
+        for content in (b'', b'MEMERAW1', HEADER.pack(MAGIC, 10, 10) + b'\0' * 12):
+            path.write_bytes(content)
+            with self.assertRaises(AssetError):
+                open_raster(key)
+
+    def test_ingest_command(self):
+        template = MemeTemplate.objects.create(name='Remote', image_url='http://example.com/remote.png')
+        out = io.StringIO()
+        with mock.patch('meme_generator.management.commands.ingest_template_images.fetch_source',
+                        return_value=template_png()) as fetch:
+            call_command('ingest_template_images', stdout=out)
+            call_command('ingest_template_images', stdout=out)
+        fetch.assert_called_once_with('http://example.com/remote.png')
+        template.refresh_from_db()
+        self.assertEqual(open_raster(template.image_asset).size, (300, 200))
+
+        with tempfile.NamedTemporaryFile(suffix='.png') as f:
+            f.write(template_png(40, 30))
+            f.flush()
+            call_command('ingest_template_images', '--path', str(template.id), f.name, stdout=out)
+        template.refresh_from_db()
+        self.assertEqual(open_raster(template.image_asset).size, (40, 30))
+
+
+@skipUnless(phash.available(), 'requires NumPy and Pillow')
+class TemplatePerceptualHashTestCase(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='password')
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_TOKEN=self.token.key, HTTP_ID=str(self.user.id))
+        assets = tempfile.TemporaryDirectory()
+        self.addCleanup(assets.cleanup)
+        settings_override = self.settings(TEMPLATE_ASSET_DIR=assets.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def image(self, size=(240, 180), zoomed=False, format='PNG'):
+        """The Mandelbrot set, or a zoomed-in (different looking) part of it."""
+        extent = (-0.8, -0.4, 0.2, 0.4) if zoomed else (-2.0, -1.2, 0.8, 1.2)
+        image = Image.effect_mandelbrot(size, extent, 100).convert('RGB')
+        out = io.BytesIO()
+        image.save(out, format=format)
+        return out.getvalue()
+
+    def create_template(self, name, source):
+        return self.client.post(reverse('create_meme_template'), {
+            'name': name, 'image_url': f'http://example.com/{name}.png',
+            'image': SimpleUploadedFile(f'{name}.png', source),
+        }, format='multipart')
+
+    def test_hashes_survive_resizing_and_recompression(self):
+        original = Image.open(io.BytesIO(self.image()))
+        resized = Image.open(io.BytesIO(self.image((480, 360), format='JPEG')))
+        different = Image.open(io.BytesIO(self.image(zoomed=True)))
+        hashes = phash.perceptual_hashes([original, resized, different])
+
+        for name in phash.HASHES:
+            self.assertLessEqual(phash.distance(hashes[0][name], hashes[1][name]), 6, name)
+        self.assertGreater(phash.distance(hashes[0]['phash'], hashes[2]['phash']), 10)
+
+    def test_create_reports_near_duplicates(self):
+        self.create_template('original', self.image())
+        original = MemeTemplate.objects.get(name='original')
+        self.assertIsNotNone(original.phash)
+
+        response = self.create_template('copy', self.image((480, 360), format='JPEG'))
+        self.assertEqual([match['id'] for match in response.data['similar_templates']], [original.id])
+
+        response = self.create_template('other', self.image(zoomed=True))
+        self.assertEqual(response.data['similar_templates'], [])
+
+        copy = MemeTemplate.objects.get(name='copy')
+        response = self.client.get(reverse('similar_templates', args=[copy.id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([(match['id'], match['name']) for match in response.data], [(original.id, 'original')])
+        with self.settings(TEMPLATE_SIMILARITY_MAX_DISTANCE=64):
+            everything = self.client.get(reverse('similar_templates', args=[copy.id]), {'distance': 64}).data
+        self.assertEqual(everything[-1]['name'], 'other')
+        # Larger distances are capped
+        self.assertEqual([match['name'] for match in self.client.get(
+            reverse('similar_templates', args=[copy.id]), {'distance': 64}).data if match['distance'] > 16], [])
+
+    def test_index_sees_templates_hashed_by_other_workers(self):
+        self.create_template('original', self.image())
+        original = MemeTemplate.objects.get(name='original')
+        self.assertEqual(phash.similar_templates(original.phash, 10), [(0, original.id)])
+
+        # Hashed by another worker: update() sends no signal, so this cache's token stays the same
+        other = MemeTemplate.objects.create(name='elsewhere', image_url='http://example.com/elsewhere.png')
+        phash.template_index()
+        MemeTemplate.objects.filter(pk=other.pk).update(phash=original.phash ^ 1)
+        self.assertEqual(phash.similar_templates(original.phash, 10), [(0, original.id), (1, other.id)])
+
+        # Re-hashed elsewhere: neither the count nor the last id changes
+        time.sleep(0.002)
+        phash.save_hashes(other.pk, {'phash': original.phash ^ 3})
+        self.assertEqual(phash.similar_templates(original.phash, 10), [(0, original.id), (2, other.id)])
+
+    def test_similar_templates_errors(self):
+        unhashed = MemeTemplate.objects.create(name='remote', image_url='http://example.com/remote.png')
+        self.assertEqual(self.client.get(reverse('similar_templates', args=[unhashed.id])).status_code,
+                         status.HTTP_409_CONFLICT)
+        self.assertEqual(self.client.get(reverse('similar_templates', args=[unhashed.id + 1])).status_code,
+                         status.HTTP_404_NOT_FOUND)
+
+    def test_multi_index_matches_linear_scan(self):
+        rng = random.Random(0)
+        values = [phash.to_signed(rng.getrandbits(64)) for _ in range(500)]
+        # Near copies of the first values
+        values += [value ^ (1 << rng.randrange(63)) for value in values[:50]]
+        multi_index = phash.MultiIndex()
+        for index, value in enumerate(values):
+            multi_index.add(value, index)
+
+        for query in values[:20]:
+            for radius in (0, 3, 10, 16, 64):
+                expected = sorted((phash.distance(query, value), index) for index, value in enumerate(values)
+                                  if phash.distance(query, value) <= radius)
+                self.assertEqual(sorted(multi_index.search(query, radius)), expected)
+
+    def test_report_command_backfills_and_clusters(self):
+        first = MemeTemplate.objects.create(name='first', image_url='http://example.com/first.png')
+        second = MemeTemplate.objects.create(name='second', image_url='http://example.com/second.jpg')
+        MemeTemplate.objects.create(name='third', image_url='http://example.com/third.png')
+        sources = {
+            first.image_url: self.image(),
+            second.image_url: self.image((480, 360), format='JPEG'),
+        }
+
+        def fetch(url):
+            return sources.get(url) or self.image(zoomed=True)
+
+        out = io.StringIO()
+        with mock.patch('meme_generator.management.commands.report_template_duplicates.fetch_source', fetch):
+            call_command('report_template_duplicates', '--backfill', stdout=out)
+        self.assertIn('Hashed 3 templates (0 failed)', out.getvalue())
+        self.assertIn('1 clusters, 1 near-duplicate templates among 3 hashed', out.getvalue())
+        self.assertIn("'second'", out.getvalue())
+
+
+class RateLimitTestCase(APITestCase):
+    LIMITS = {
+        'create_meme': {'user': ('60/min', 2), 'ip': ('60/min', 3)},
+        'rate_meme': {'user': ('60/min', 2)},
+        'signup': {'ip': ('1/hour', 1)},
+    }
+
+    def setUp(self):
+        limits = self.settings(RATE_LIMIT_ENABLED=True, RATE_LIMIT_CACHE_ALIAS=None, RATE_LIMITS=self.LIMITS)
+        limits.enable()
+        self.addCleanup(limits.disable)
+        buckets().clear()
+        self.user = User.objects.create_user(username='testuser', password='password')
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_TOKEN=self.token.key, HTTP_ID=str(self.user.id))
+        self.template = MemeTemplate.objects.create(name="Funny Template", image_url="http://example.com/image.png")
+        self.data = {'template': self.template.id, 'top_text': 'Top', 'bottom_text': 'Bottom'}
+
+    def test_user_bucket_refuses_with_retry_after(self):
+        for _ in range(2):
+            self.assertEqual(self.client.post(reverse('meme_request'), self.data).status_code, status.HTTP_201_CREATED)
+        response = self.client.post(reverse('meme_request'), self.data)
+
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(Meme.objects.count(), 2)
+
+        meme = Meme.objects.first()
+        for score in (1, 2):
+            self.client.post(reverse('rate_meme', args=[meme.id]), {'score': score})
+        response = self.client.post(reverse('rate_meme', args=[meme.id]), {'score': 3})
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(Rating.objects.get().score, 2)
+
+    def test_address_bucket_is_shared_by_users(self):
+        other = User.objects.create_user(username='other', password='password')
+        other_client = APIClient()
+        other_client.credentials(HTTP_TOKEN=Token.objects.create(user=other).key, HTTP_ID=str(other.id))
+        for _ in range(2):
+            self.client.post(reverse('meme_request'), self.data)
+
+        self.assertEqual(other_client.post(reverse('meme_request'), self.data).status_code, status.HTTP_201_CREATED)
+        self.assertEqual(other_client.post(reverse('meme_request'), self.data).status_code,
+                         status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_refused_request_takes_no_user_token(self):
+        # The address bucket (3) refuses before the user bucket (2) is empty
+        other = User.objects.create_user(username='other', password='password')
+        other_client = APIClient()
+        other_client.credentials(HTTP_TOKEN=Token.objects.create(user=other).key, HTTP_ID=str(other.id))
+        for _ in range(2):
+            self.client.post(reverse('meme_request'), self.data)
+        other_client.post(reverse('meme_request'), self.data)
+        for _ in range(3):
+            self.assertEqual(other_client.post(reverse('meme_request'), self.data).status_code,
+                             status.HTTP_429_TOO_MANY_REQUESTS)
+
+        response = other_client.post(reverse('meme_request'), self.data, REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_idempotent_replays_are_not_charged(self):
+        meme = Meme.objects.create(template=self.template, created_by=self.user, top_text='Top', bottom_text='Bottom')
+        url = reverse('rate_meme', args=[meme.id])
+        self.client.post(url, {'score': 1}, HTTP_IDEMPOTENCY_KEY='first')
+        for _ in range(3):
+            response = self.client.post(url, {'score': 1}, HTTP_IDEMPOTENCY_KEY='first')
+            self.assertEqual(response['Idempotent-Replayed'], 'true')
+
+        self.assertNotEqual(self.client.post(url, {'score': 2}, HTTP_IDEMPOTENCY_KEY='second').status_code,
+                            status.HTTP_429_TOO_MANY_REQUESTS)
+        refused = self.client.post(url, {'score': 3}, HTTP_IDEMPOTENCY_KEY='third')
+        self.assertEqual(refused.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        # A refused request is not replayed: once the bucket refills it runs for real
+        buckets().clear()
+        self.assertNotEqual(self.client.post(url, {'score': 3}, HTTP_IDEMPOTENCY_KEY='third').status_code,
+                            status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(Rating.objects.get().score, 3)
+
+    def test_given_back_tokens(self):
+        caches['default'].clear()
+        for store in (LocalBuckets(), CacheBuckets('default')):
+            self.assertEqual([store.take('key', 1000, 2, 0) for _ in range(2)], [0, 0])
+            store.give_back('key', 1000)
+            self.assertEqual(store.take('key', 1000, 2, 0), 0)
+            self.assertEqual(store.take('key', 1000, 2, 0), 0.001)
+
+    def test_signup_is_limited_per_address(self):
+        data = {'username': 'new', 'email': 'new@example.com', 'password': 'strongpassword'}
+        self.assertEqual(self.client.post(reverse('signup'), data).status_code, status.HTTP_201_CREATED)
+
+        again = {'username': 'again', 'email': 'again@example.com', 'password': 'strongpassword'}
+        response = self.client.post(reverse('signup'), again)
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(int(response['Retry-After']), 60 * 60)
+        self.assertFalse(User.objects.filter(username='again').exists())
+
+        response = self.client.post(reverse('signup'), again, REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_client_ip_behind_trusted_proxies(self):
+        request = RequestFactory().post('/', REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR='6.6.6.6, 1.2.3.4')
+        self.assertEqual(client_ip(request), '10.0.0.1')
+        with self.settings(RATE_LIMIT_TRUSTED_PROXIES=1):
+            self.assertEqual(client_ip(request), '1.2.3.4')
+
+    def test_bucket_refills(self):
+        local = LocalBuckets()
+        self.assertEqual([local.take('key', 1000, 2, 0) for _ in range(3)], [0, 0, 0.001])
+        self.assertEqual(local.take('key', 1000, 2, 1000), 0)
+        self.assertEqual(local.take('key', 1000, 2, 1000), 0.001)
+        self.assertEqual(local.take('key', 1000, 2, 10000), 0)
+
+    def test_cache_buckets_match_local_buckets(self):
+        caches['default'].clear()
+        shared, local = CacheBuckets('default'), LocalBuckets()
+        rng = random.Random(0)
+        now = 0
+        for _ in range(500):
+            now += rng.choice((0, 100, 400, 5000))
+            key = rng.choice(('a', 'b'))
+            self.assertEqual(shared.take(key, 1000, 3, now), local.take(key, 1000, 3, now))
+
+
+class AdmissionControlTestCase(SimpleTestCase):
+
+    def test_sheds_requests_beyond_the_limit(self):
+        nested = []
+
+        def view(request):
+            if request.path == '/api/memes/' and not nested:
+                # More requests arriving while this one holds the only slot
+                nested.append(middleware(RequestFactory().get('/api/memes/')))
+                nested.append(middleware(RequestFactory().get('/metrics')))
+            return HttpResponse('ok')
+
+        with self.settings(ADMISSION_MAX_IN_FLIGHT=1, ADMISSION_QUEUE_TIMEOUT=0):
+            middleware = AdmissionControlMiddleware(view)
+            response = middleware(RequestFactory().get('/api/memes/'))
+            shed, exempt = nested
+
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(shed.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+            self.assertEqual(shed['Retry-After'], str(settings.ADMISSION_RETRY_AFTER))
+            self.assertEqual(exempt.status_code, 200)
+            # The slot is free again
+            self.assertEqual(middleware(RequestFactory().get('/api/memes/')).status_code, 200)
+
+    def test_disabled_with_zero_limit(self):
+        with self.settings(ADMISSION_MAX_IN_FLIGHT=0), self.assertRaises(MiddlewareNotUsed):
+            AdmissionControlMiddleware(lambda request: None)
@@ -4,12 +4,22 @@ from .views import (UserSignupView,
                     UserLoginView, 
                     UserLogoutView, 
                     RetrieveMemeView, 
+                    MemeImageView,
                     MemeView,
+                    BatchMemeView,
                     CreateMemeTemplateView,
                     ReceiveAllTemplatesView,
                     RateMemeView,
                     RandomMemeView,
-                    TopRatedMemesView
+                    FeedMemeView,
+                    UserStatsView,
+                    UserView,
+                    MemeTemplateView,
+                    SimilarTemplatesView,
+                    DeletionStatusView,
+                    TopRatedMemesView,
+                    MetricsView,
+                    ReadinessView
                     )
 
 urlpatterns = [
@@ -17,12 +27,22 @@ urlpatterns = [
     path('login/', UserLoginView.as_view(), name='login'),
     path('logout/',UserLogoutView.as_view(), name='logout'),
     path('api/memes/<int:meme_id>/', RetrieveMemeView.as_view(), name='retrieve_meme'),
+    path('api/memes/<int:meme_id>/image.png', MemeImageView.as_view(), name='meme_image'),
     path('api/memes/', MemeView.as_view(), name = 'meme_request'),
+    path('api/memes/batch-get/', BatchMemeView.as_view(), name='batch_get_memes'),
     path('api/meme_template/create/', CreateMemeTemplateView.as_view(), name = 'create_meme_template'),
+    path('api/meme_template/<int:template_id>/', MemeTemplateView.as_view(), name='meme_template'),
+    path('api/meme_template/<int:template_id>/similar/', SimilarTemplatesView.as_view(), name='similar_templates'),
     path('api/templates/', ReceiveAllTemplatesView.as_view(), name = 'receive_all_templates'),
     path('api/memes/<int:meme_id>/rate/', RateMemeView.as_view(), name='rate_meme'),
     path('api/memes/random/', RandomMemeView.as_view(), name='random_meme'),
-    path('api/memes/top/', TopRatedMemesView.as_view(), name='top memes')
+    path('api/memes/feed/', FeedMemeView.as_view(), name='meme_feed'),
+    path('api/memes/top/', TopRatedMemesView.as_view(), name='top memes'),
+    path('api/users/<int:user_id>/', UserView.as_view(), name='user'),
+    path('api/deletions/<int:deletion_id>/', DeletionStatusView.as_view(), name='deletion_status'),
+    path('api/users/<int:user_id>/stats/', UserStatsView.as_view(), name='user_stats'),
+    path('metrics', MetricsView.as_view(), name='metrics'),
+    path('ready', ReadinessView.as_view(), name='ready')
 ]
 
 
@@ -1,10 +1,13 @@
+import logging
+
 from rest_framework.authtoken.models import Token
 from rest_framework.exceptions import AuthenticationFailed
 
+logger = logging.getLogger('meme_generator.auth')
+
 def authenticate_user(request):
     """Validate the token against the user_id."""
     if request:
-        print('headers in authenticate',request.headers)
         token = request.headers.get('Token')
         user_id = request.headers.get('Id')
 
@@ -13,14 +16,17 @@ def authenticate_user(request):
 
         try:
             # Check if the token matches for the given user_id
-            auth_token = Token.objects.get(key=token)
+            auth_token = Token.objects.select_related('user').get(key=token)
 
-            if str(auth_token.user.id) == user_id:
+            if str(auth_token.user_id) == user_id:
+                logger.debug('Authenticated request', extra={'user_id': user_id, 'path': request.path})
                 return auth_token.user  # Return the user for further processing
             else:
+                logger.info('Token does not match the user_id', extra={'user_id': user_id, 'path': request.path})
                 raise AuthenticationFailed('Token does not match the user_id')
 
         except Token.DoesNotExist:
+            logger.info('Invalid token', extra={'user_id': user_id, 'path': request.path})
             raise AuthenticationFailed('Invalid token')
 
     raise AuthenticationFailed('Error: Request headers missing')
@@ -1,5 +1,6 @@
 from rest_framework import status
 from rest_framework.response import Response
+from rest_framework.exceptions import ValidationError
 from rest_framework.views import APIView
 from .serializers import (UserSignupSerializer, 
                           UserLoginSerializer, 
@@ -7,18 +8,133 @@ from .serializers import (UserSignupSerializer,
                           AuthenticateSerializer,
                           MemeSerializer,
                           MemeTemplateSerializer,
-                          RecieveMemeSerializer,
-                          RateMemeSerializer
+                          RateMemeSerializer,
+                          MemeIdsSerializer,
+                          BatchMemeSerializer,
+                          MemeRowSerializer,
+                          RecieveMemeRowSerializer,
+                          TopRatedMemeRowSerializer,
+                          TemplateRowSerializer,
+                          FeedMemeRowSerializer,
+                          PendingDeletionSerializer,
+                          SparseMemeSerializer,
+                          parse_fieldset
 )
 
-from .models import User, Meme, MemeTemplate, Rating
+from .models import User, Meme, MemeTemplate, PendingDeletion, Rating, CompactedRating
+from .cache import (meme_etag,
+                    get_cached_meme,
+                    set_cached_meme,
+                    get_cached_payload,
+                    MEME_COUNT_CACHE_KEY,
+                    TEMPLATES_CACHE_KEY,
+                    TOP_MEMES_CACHE_KEY)
+from .singleflight import get_or_compute
+from .metrics import collect, render_prometheus
+from .idempotency import idempotent_response
+from .ratelimit import rate_limit_response
+from .feed import ORDERS, RECENT, unrated_feed
+from .stats import get_user_stats, record_rating
+from .deletion import request_deletion
+from .ratings import record_compacted_score_change, with_rating_totals
+from .compression import negotiate_encoding
+from . import warmup
+from .phash import similar_templates
+from .rendering import Image, SourceUnavailable, get_render, render_key, render_meme, template_source
+from django.conf import settings
+from django.urls import reverse
+from django.http import HttpResponse
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import parse_etags
 from rest_framework.pagination import PageNumberPagination
-from django.db import IntegrityError
+from rest_framework.utils.urls import replace_query_param
+from django.db import IntegrityError, transaction
+import hmac
 import random
-from django.db.models import Avg
+
+
+def build_templates():
+    """Response data of the template catalogue."""
+    # Query all templates from MemeTemplate table as plain tuples
+    templates = TemplateRowSerializer().values(MemeTemplate.objects.visible().order_by('id'))
+
+    # Serialize the templates
+    return TemplateRowSerializer(templates, many=True).data
+
+
+def build_top_memes():
+    """Response data of the top rated memes leaderboard."""
+    # Query to get the top 10 rated memes that have at least one rating
+    top_memes = (
+        with_rating_totals(Meme.objects.visible())  # Average over live and compacted ratings
+        .filter(avg_rating__isnull=False)  # Only include memes with ratings
+        .order_by('-avg_rating')[:10]  # Get the top 10 rated memes
+    )
+
+    # Create a response list with memes and their average ratings
+    return TopRatedMemeRowSerializer(TopRatedMemeRowSerializer().values(top_memes), many=True).data
+
+
+def templates_payload():
+    """Cached payload of the template catalogue."""
+    return get_cached_payload(TEMPLATES_CACHE_KEY, build_templates, settings.TEMPLATES_CACHE_TIMEOUT,
+                              settings.TEMPLATES_STALE_TIMEOUT)
+
+
+def top_memes_payload():
+    """Cached payload of the top rated memes leaderboard."""
+    return get_cached_payload(TOP_MEMES_CACHE_KEY, build_top_memes, settings.TOP_MEMES_CACHE_TIMEOUT,
+                              settings.TOP_MEMES_STALE_TIMEOUT)
+
+
+def meme_count():
+    """Number of visible memes, cached with one recount per expiry."""
+    return get_or_compute(MEME_COUNT_CACHE_KEY, Meme.objects.visible().count,
+                          settings.MEME_COUNT_CACHE_TIMEOUT, settings.MEME_COUNT_STALE_TIMEOUT)
+
+
+def cached_payload_response(request, payload):
+    """Serve a cached payload, sending its precompressed body when the client allows it."""
+    encoding = negotiate_encoding(request.headers.get('Accept-Encoding'))
+    if request.accepted_renderer.format == 'json' and encoding in payload['bodies']:
+        response = HttpResponse(payload['bodies'][encoding], content_type='application/json')
+        response['Content-Encoding'] = encoding
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+    return Response(payload['data'], status=status.HTTP_200_OK)
+
+
+def batch_get_memes(ids):
+    """Fetch the memes for ``ids`` in one query and return them in request order.
+
+    Template data and rating aggregates are joined into the same query, so the
+    cost does not grow with the number of ids. Ids that do not exist are
+    returned as ``None`` in ``results`` and listed in ``missing``.
+    """
+    memes = (
+        with_rating_totals(Meme.objects.visible())
+        .select_related('template')
+        .in_bulk(set(ids))
+    )
+    serialized = {meme_id: BatchMemeSerializer(meme).data for meme_id, meme in memes.items()}
+    return {
+        'results': [serialized.get(meme_id) for meme_id in ids],
+        'missing': [meme_id for meme_id in ids if meme_id not in serialized],
+    }
+
+def deletion_response(deletion):
+    """202 Accepted with the progress of a queued deletion."""
+    data = PendingDeletionSerializer(deletion).data
+    data['status_url'] = reverse('deletion_status', args=[deletion.id])
+    return Response(data, status=status.HTTP_202_ACCEPTED)
 
 class UserSignupView(APIView):
     def post(self, request):
+        # Limited per address before the password is hashed
+        limited = rate_limit_response(request, 'signup')
+        if limited:
+            return limited
+
         serializer = UserSignupSerializer(data=request.data)
         if serializer.is_valid():
             user = serializer.save()
@@ -57,7 +173,14 @@ class MemeView(APIView):
         authenticate_serializer = AuthenticateSerializer(data=request.data, context={'request': request})
         if not authenticate_serializer.is_valid():
             return Response(authenticate_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-        
+
+        # Retries carrying the same Idempotency-Key get the first response back,
+        # without taking another rate limit token
+        user_id = request.headers.get('Id')
+        return idempotent_response(
+            request, user_id, lambda: rate_limit_response(request, 'create_meme', user_id) or self.create_meme(request))
+
+    def create_meme(self, request):
         meme_serializer = MemeSerializer(data=request.data)
 
         # Validate and save the meme
@@ -65,6 +188,8 @@ class MemeView(APIView):
             user_id = request.headers.get('Id')
             user = User.objects.get(id=user_id)
             meme = meme_serializer.save(created_by=user)  # Set the creator
+            if getattr(meme, 'reused', False):
+                return Response({'id': meme.id, 'message': 'Identical meme already exists.'}, status=status.HTTP_200_OK)
             return Response({'id': meme.id, 'message': 'Meme created successfully!'}, status=status.HTTP_201_CREATED)
 
         return Response(meme_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -75,19 +200,46 @@ class MemeView(APIView):
         if not authenticate_serializer.is_valid():
             return Response(authenticate_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-       # Query all memes and paginate them
-        memes = Meme.objects.all()
+        # Multi-get: /api/memes/?ids=1,2,3
+        if 'ids' in request.query_params:
+            ids_serializer = MemeIdsSerializer(data={'ids': request.query_params['ids'].split(',')})
+            if not ids_serializer.is_valid():
+                return Response(ids_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+            return Response(batch_get_memes(ids_serializer.validated_data['ids']), status=status.HTTP_200_OK)
+
+        # Sparse fieldsets: ?fields=id,top_text&expand=template,rating
+        try:
+            fields, expand = parse_fieldset(request.query_params, MemeRowSerializer.fields)
+        except ValidationError as e:
+            return Response(e.detail, status=status.HTTP_400_BAD_REQUEST)
+
+       # Query only the requested columns as plain tuples and paginate them
+        memes = SparseMemeSerializer(fields=fields, expand=expand).values(Meme.objects.visible().order_by('id'))
 
         # Use pagination
         paginator = PageNumberPagination()
         paginated_memes = paginator.paginate_queryset(memes, request)
 
         # Serialize the paginated memes
-        memes_serializer = MemeSerializer(paginated_memes, many=True)
+        memes_serializer = SparseMemeSerializer(paginated_memes, many=True, fields=fields, expand=expand)
 
         # Return paginated response
         return paginator.get_paginated_response(memes_serializer.data)
 
+class BatchMemeView(APIView):
+
+    def post(self, request):
+        # authenticate
+        authenticate_serializer = AuthenticateSerializer(data=request.data, context={'request': request})
+        if not authenticate_serializer.is_valid():
+            return Response(authenticate_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        ids_serializer = MemeIdsSerializer(data=request.data)
+        if not ids_serializer.is_valid():
+            return Response(ids_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(batch_get_memes(ids_serializer.validated_data['ids']), status=status.HTTP_200_OK)
+
 class CreateMemeTemplateView(APIView):
 
     def post(self, request):
@@ -101,7 +253,13 @@ class CreateMemeTemplateView(APIView):
         # Validate and save the meme
         if meme_template_serializer.is_valid():
             meme_template = meme_template_serializer.save()  # Set the creator
-            return Response({'id': meme_template.name, 'message': 'Meme template created successfully!'}, status=status.HTTP_201_CREATED)
+            # Uploaded images are hashed; point out templates that look the same
+            similar = []
+            if meme_template.phash is not None:
+                similar = similar_template_data(meme_template.phash, settings.TEMPLATE_SIMILARITY_DISTANCE,
+                                                exclude=meme_template.id)
+            return Response({'id': meme_template.name, 'message': 'Meme template created successfully!',
+                             'similar_templates': similar}, status=status.HTTP_201_CREATED)
 
         return Response(meme_template_serializer.errors, status=status.HTTP_400_BAD_REQUEST)    
 
@@ -115,16 +273,113 @@ class RetrieveMemeView(APIView):
             return Response(authenticate_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         
         try:
-            meme = Meme.objects.get(id=meme_id)
-        except Meme.DoesNotExist:
-            return Response({'error': 'Meme not found.'}, status=status.HTTP_404_NOT_FOUND)
+            fields, expand = parse_fieldset(request.query_params, RecieveMemeRowSerializer.fields)
+        except ValidationError as e:
+            return Response(e.detail, status=status.HTTP_400_BAD_REQUEST)
+
+        # Expansions embed related (and possibly changing) data, so they are
+        # read with a single joined query instead of the immutable cache
+        if expand:
+            serializer = SparseMemeSerializer(fields=fields, expand=expand)
+            row = serializer.values(Meme.objects.visible().filter(id=meme_id)).first()
+            if row is None:
+                return Response({'error': 'Meme not found.'}, status=status.HTTP_404_NOT_FOUND)
+            return Response(SparseMemeSerializer(row, fields=fields, expand=expand).data, status=status.HTTP_200_OK)
+
+        # Memes are immutable, so a cached representation is always current and
+        # a matching ETag can be answered without touching the meme table
+        data = get_cached_meme(meme_id)
+        if data is None:
+            row = RecieveMemeRowSerializer().values(Meme.objects.visible().filter(id=meme_id)).first()
+            if row is None:
+                return Response({'error': 'Meme not found.'}, status=status.HTTP_404_NOT_FOUND)
+
+            # Serialize the meme row
+            data = RecieveMemeRowSerializer(row).data
+            set_cached_meme(meme_id, data)
+
+        # Sparse fieldsets are projected from the cached representation
+        if fields != list(RecieveMemeRowSerializer.fields):
+            data = {field: data[SparseMemeSerializer.available_fields[field]] for field in fields}
+            etag = meme_etag(meme_id, fields)
+        else:
+            etag = meme_etag(meme_id)
 
-        # Serialize the meme instance
-        meme_serializer = RecieveMemeSerializer(meme)
+        # If-None-Match uses weak comparison; compressed responses carry W/ tags
+        if_none_match = [tag.removeprefix('W/') for tag in parse_etags(request.headers.get('If-None-Match', ''))]
+        if etag in if_none_match or '*' in if_none_match:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(data, status=status.HTTP_200_OK)
+
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, max_age=settings.MEME_HTTP_MAX_AGE, immutable=True)
+        return response
 
-        # Return the serialized data
-        return Response(meme_serializer.data, status=status.HTTP_200_OK)
+    def delete(self, request, meme_id):
+        # authenticate
+        authenticate_serializer = AuthenticateSerializer(data=request.data, context={'request': request})
+        if not authenticate_serializer.is_valid():
+            return Response(authenticate_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        user = authenticate_serializer.validated_data
+
+        creator_id = Meme.objects.visible().filter(id=meme_id).values_list('created_by_id', flat=True).first()
+        if creator_id is None:
+            return Response({'error': 'Meme not found.'}, status=status.HTTP_404_NOT_FOUND)
+        if creator_id != user.id and not user.is_staff:
+            return Response({'error': 'Only the creator can delete this meme.'}, status=status.HTTP_403_FORBIDDEN)
+
+        # Hidden right away, purged in the background
+        return deletion_response(request_deletion(PendingDeletion.MEME, meme_id, user))
     
+class MemeTemplateView(APIView):
+
+    def delete(self, request, template_id):
+        # authenticate
+        authenticate_serializer = AuthenticateSerializer(data=request.data, context={'request': request})
+        if not authenticate_serializer.is_valid():
+            return Response(authenticate_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        user = authenticate_serializer.validated_data
+
+        # Deleting a template takes all of its memes with it
+        if not user.is_staff:
+            return Response({'error': 'Only staff can delete templates.'}, status=status.HTTP_403_FORBIDDEN)
+        if not MemeTemplate.objects.visible().filter(id=template_id).exists():
+            return Response({'error': 'Template not found.'}, status=status.HTTP_404_NOT_FOUND)
+
+        return deletion_response(request_deletion(PendingDeletion.TEMPLATE, template_id, user))
+
+def similar_template_data(phash_value, radius, exclude=None):
+    matches = similar_templates(phash_value, radius, exclude)
+    names = dict(MemeTemplate.objects.filter(id__in=[template_id for _, template_id in matches])
+                 .values_list('id', 'name'))
+    return [{'id': template_id, 'name': names[template_id], 'distance': d} for d, template_id in matches]
+
+
+class SimilarTemplatesView(APIView):
+
+    def get(self, request, template_id):
+        # authenticate
+        authenticate_serializer = AuthenticateSerializer(data=request.data, context={'request': request})
+        if not authenticate_serializer.is_valid():
+            return Response(authenticate_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        # ?distance=N: maximum number of differing pHash bits
+        try:
+            radius = int(request.query_params.get('distance', settings.TEMPLATE_SIMILARITY_DISTANCE))
+        except ValueError:
+            return Response({'distance': ['A valid integer is required.']}, status=status.HTTP_400_BAD_REQUEST)
+        radius = min(max(radius, 0), settings.TEMPLATE_SIMILARITY_MAX_DISTANCE)
+
+        template = MemeTemplate.objects.visible().filter(id=template_id).values('id', 'phash').first()
+        if template is None:
+            return Response({'error': 'Template not found.'}, status=status.HTTP_404_NOT_FOUND)
+        if template['phash'] is None:
+            return Response({'error': 'The template image has not been hashed yet.'}, status=status.HTTP_409_CONFLICT)
+
+        return Response(similar_template_data(template['phash'], radius, exclude=template_id), status=status.HTTP_200_OK)
+
+
 class ReceiveAllTemplatesView(APIView):
      
      def get(self,request):
@@ -134,15 +389,14 @@ class ReceiveAllTemplatesView(APIView):
         if not authenticate_serializer.is_valid():
             return Response(authenticate_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-        # Query all templates from MemeTemplate table
-        templates = MemeTemplate.objects.all()
-        print(templates)
-
-        # Serialize the templates
-        template_serializer = MemeTemplateSerializer(templates, many=True)
+        # ?page=N returns one page of the catalogue instead of all of it
+        if 'page' in request.query_params:
+            paginator = PageNumberPagination()
+            templates = paginator.paginate_queryset(TemplateRowSerializer().values(MemeTemplate.objects.visible().order_by('id')), request)
+            return paginator.get_paginated_response(TemplateRowSerializer(templates, many=True).data)
 
-        # Return the serialized templates in the response
-        return Response(template_serializer.data, status=status.HTTP_200_OK)
+        # Return the serialized templates, precompressed when the client allows it
+        return cached_payload_response(request, templates_payload())
      
 class RateMemeView(APIView):
     def post(self, request, meme_id):
@@ -151,31 +405,86 @@ class RateMemeView(APIView):
         if not authenticate_serializer.is_valid():
             return Response(authenticate_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+        # Retries carrying the same Idempotency-Key get the first response back,
+        # without taking another rate limit token
+        user_id = request.headers.get('Id')
+        return idempotent_response(
+            request, user_id, lambda: rate_limit_response(request, 'rate_meme', user_id) or self.rate_meme(request, meme_id))
+
+    def rate_meme(self, request, meme_id):
         # Get user
         user_id = request.headers.get('Id')
         user = User.objects.get(id=user_id)
 
         # Get meme
         try:
-            meme = Meme.objects.get(id=meme_id)
+            meme = Meme.objects.visible().get(id=meme_id)
         except Meme.DoesNotExist:
             return Response({'error': 'Meme not found'}, status=status.HTTP_404_NOT_FOUND)
 
-        # Check if the user has already rated the meme
-        existing_rating = Rating.objects.filter(meme=meme, user=user).first()
+        # The rating and the rater's and meme owner's counters commit together
+        with transaction.atomic():
+            # Check if the user has already rated the meme, recently or before compaction
+            existing_rating = (Rating.objects.select_for_update().filter(meme=meme, user=user).first()
+                               or CompactedRating.objects.select_for_update().filter(meme=meme, user=user).first())
+            old_score = existing_rating.score if existing_rating else None
+
+            # Validate the score both for new ratings and for updates
+            rate_serializer = RateMemeSerializer(existing_rating, data=request.data, context={'meme': meme, 'user': user})
+            if not rate_serializer.is_valid():
+                return Response(rate_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+            # Update the existing rating or create a new one
+            rating = rate_serializer.save()
+            record_rating(user.id, meme.id, meme.created_by_id, rating.score, old_score)
+            if isinstance(rating, CompactedRating):
+                record_compacted_score_change(meme.id, rating.score, old_score)
+
         if existing_rating:
-            # If the rating exists, update it
-            existing_rating.score = request.data.get('score')
-            existing_rating.save()
-            return Response({'id': existing_rating.id, 'message': 'Rating updated successfully!'}, status=status.HTTP_201_CREATED)
+            return Response({'id': rating.id, 'message': 'Rating updated successfully!'}, status=status.HTTP_201_CREATED)
+        return Response({'id': rating.id, 'message': 'Rating created successfully!'}, status=status.HTTP_201_CREATED)
+
+
+class MemeImageView(APIView):
+
+    def get(self, request, meme_id):
+        # authenticate
+        authenticate_serializer = AuthenticateSerializer(data=request.data, context={'request': request})
+        if not authenticate_serializer.is_valid():
+            return Response(authenticate_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        size = request.query_params.get('size', 'full')
+        if size not in settings.RENDER_SIZES:
+            return Response({'size': [f'Must be one of {", ".join(settings.RENDER_SIZES)}.']},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        meme = Meme.objects.visible().select_related('template').filter(id=meme_id).first()
+        if meme is None:
+            return Response({'error': 'Meme not found.'}, status=status.HTTP_404_NOT_FOUND)
+
+        # Renders are content-addressed, so the key is a strong ETag
+        key = render_key(template_source(meme.template), meme.top_text, meme.bottom_text, size)
+        etag = f'"{key}"'
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
         else:
-            # Create a new rating
-            rate_serializer = RateMemeSerializer(data=request.data, context={'meme': meme, 'user': user})
-            if rate_serializer.is_valid():
-                rating = rate_serializer.save()
-                return Response({'id': rating.id, 'message': 'Rating created successfully!'}, status=status.HTTP_201_CREATED)
-        
-        return Response(rate_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+            data = get_render(key)
+            if data is None:
+                if Image is None:
+                    return Response({'error': 'Image rendering is not available (Pillow is not installed).'},
+                                    status=status.HTTP_501_NOT_IMPLEMENTED)
+                # One render stores every size
+                try:
+                    data = render_meme(meme)[size]
+                except SourceUnavailable:
+                    # The reason would tell fetch from decode failures apart
+                    return Response({'error': 'The template image is unavailable.'},
+                                    status=status.HTTP_502_BAD_GATEWAY)
+            response = HttpResponse(data, content_type='image/png')
+
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, max_age=settings.MEME_HTTP_MAX_AGE, immutable=True)
+        return response
 
 
 class RandomMemeView(APIView):
@@ -187,19 +496,99 @@ class RandomMemeView(APIView):
         if not authenticate_serializer.is_valid():
             return Response(authenticate_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         
-         # Get all memes
-        memes = Meme.objects.all()
-
-        # Randomly select one meme
-        random_meme = random.choice(memes) if memes else None
-        
-        if random_meme:
-            meme_serializer = MemeSerializer(random_meme)
-            return Response(meme_serializer.data, status=status.HTTP_200_OK)
+        # Count memes (cached, one recount per expiry) and pick a random offset
+        count = meme_count()
+
+        if count:
+            memes = MemeRowSerializer().values(Meme.objects.visible().order_by('id'))
+            # A stale count may point past the end of the table
+            random_meme = memes[random.randrange(count):].first() or memes.last()
+            if random_meme:
+                meme_serializer = MemeRowSerializer(random_meme)
+                return Response(meme_serializer.data, status=status.HTTP_200_OK)
         
         return Response({'message': 'No memes found.'}, status=status.HTTP_404_NOT_FOUND)
     
 
+class FeedMemeView(APIView):
+
+    def get(self, request):
+        # Authenticate
+        authenticate_serializer = AuthenticateSerializer(data=request.data, context={'request': request})
+        if not authenticate_serializer.is_valid():
+            return Response(authenticate_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        # ?order=recent|shuffle&limit=N&cursor=<next cursor of the previous page>
+        order = request.query_params.get('order', RECENT)
+        if order not in ORDERS:
+            return Response({'order': [f'Must be one of: {", ".join(ORDERS)}.']}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = int(request.query_params.get('limit', settings.MEME_FEED_PAGE_SIZE))
+        except ValueError:
+            return Response({'limit': ['A valid integer is required.']}, status=status.HTTP_400_BAD_REQUEST)
+        limit = min(max(limit, 1), settings.MEME_FEED_MAX_PAGE_SIZE)
+
+        try:
+            rows, cursor = unrated_feed(request.headers.get('Id'), FeedMemeRowSerializer(),
+                                        order, request.query_params.get('cursor'), limit)
+        except ValidationError as e:
+            return Response(e.detail, status=status.HTTP_400_BAD_REQUEST)
+
+        url = request.build_absolute_uri()
+        return Response({
+            'next': replace_query_param(url, 'cursor', cursor) if cursor else None,
+            'results': FeedMemeRowSerializer(rows, many=True).data,
+        }, status=status.HTTP_200_OK)
+
+
+class UserView(APIView):
+
+    def delete(self, request, user_id):
+        # Authenticate
+        authenticate_serializer = AuthenticateSerializer(data=request.data, context={'request': request})
+        if not authenticate_serializer.is_valid():
+            return Response(authenticate_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        user = authenticate_serializer.validated_data
+
+        if user_id != user.id and not user.is_staff:
+            return Response({'error': 'You can only delete your own account.'}, status=status.HTTP_403_FORBIDDEN)
+        if not User.objects.filter(id=user_id, is_active=True).exists():
+            return Response({'error': 'User not found.'}, status=status.HTTP_404_NOT_FOUND)
+
+        # Logs the user out everywhere; memes and ratings are purged in the background
+        return deletion_response(request_deletion(PendingDeletion.USER, user_id, user))
+
+
+class DeletionStatusView(APIView):
+
+    def get(self, request, deletion_id):
+        # Authenticate
+        authenticate_serializer = AuthenticateSerializer(data=request.data, context={'request': request})
+        if not authenticate_serializer.is_valid():
+            return Response(authenticate_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        user = authenticate_serializer.validated_data
+
+        deletion = PendingDeletion.objects.filter(id=deletion_id).first()
+        if deletion is None or (deletion.requested_by_id != user.id and not user.is_staff):
+            return Response({'error': 'Deletion not found.'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(PendingDeletionSerializer(deletion).data, status=status.HTTP_200_OK)
+
+
+class UserStatsView(APIView):
+
+    def get(self, request, user_id):
+        # Authenticate
+        authenticate_serializer = AuthenticateSerializer(data=request.data, context={'request': request})
+        if not authenticate_serializer.is_valid():
+            return Response(authenticate_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        # Read the maintained counters with a single primary-key lookup
+        stats = get_user_stats(user_id)
+        if stats is None:
+            return Response({'error': 'User not found.'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(stats, status=status.HTTP_200_OK)
+
+
 class TopRatedMemesView(APIView):
     def get(self, request):
         # Authenticate
@@ -207,23 +596,25 @@ class TopRatedMemesView(APIView):
         if not authenticate_serializer.is_valid():
             return Response(authenticate_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-          # Query to get the top 10 rated memes that have at least one rating
-        top_memes = (
-            Meme.objects
-            .annotate(avg_rating=Avg('rating__score'))  # Calculate the average rating
-            .filter(avg_rating__isnull=False)  # Only include memes with ratings
-            .order_by('-avg_rating')[:10]  # Get the top 10 rated memes
-        )
+        return cached_payload_response(request, top_memes_payload())
+
+
+class MetricsView(APIView):
+
+    def get(self, request):
+        # Prometheus text exposition of the per-route request metrics
+        token = settings.METRICS_TOKEN
+        if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            return Response({'detail': 'Invalid metrics token.'}, status=status.HTTP_401_UNAUTHORIZED)
+        return HttpResponse(render_prometheus(collect()), content_type='text/plain; version=0.0.4; charset=utf-8')
 
-        # Create a response list with memes and their average ratings
-        response_data = []
-        for meme in top_memes:
-            response_data.append({
-                'id': meme.id,
-                'template': meme.template.id,  # Assuming you want to include the template id
-                'top_text': meme.top_text,
-                'bottom_text': meme.bottom_text,
-                'avg_rating': meme.avg_rating,  # Include the average rating
-            })
 
-        return Response(response_data, status=status.HTTP_200_OK)
\ No newline at end of file
+class ReadinessView(APIView):
+
+    def get(self, request):
+        # 503 until this worker has warmed up; a probe also retries a failed
+        # warm-up, in the background so the probe itself stays fast
+        if not warmup.is_ready():
+            warmup.retry_in_background()
+        state = warmup.status()
+        return Response(state, status=status.HTTP_200_OK if state['ready'] else status.HTTP_503_SERVICE_UNAVAILABLE)
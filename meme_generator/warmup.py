@@ -0,0 +1,155 @@
+"""Warm-up of a worker before it takes traffic.
+
+The first requests of a fresh worker used to pay for importing the views and
+serializers (the URLconf is only loaded on the first request), for opening
+database connections and for filling empty caches. ``warm_up`` does all of
+that up front and records how long each part took. The WSGI and ASGI entry
+points run it before the worker accepts requests (``WARMUP_ON_STARTUP``), and
+``/ready`` reports whether it has finished, retrying a failed warm-up in the
+background.
+"""
+import importlib
+import logging
+import sys
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.urls import get_resolver
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Imported eagerly, in this order; the URLconf pulls in the views and serializers
+EAGER_IMPORTS = (
+    'meme_generator.renderers',
+    'meme_generator.serializers',
+    'meme_generator.views',
+    'meme_generator.middleware',
+)
+
+_lock = threading.Lock()
+_ready = threading.Event()
+_report = None
+_error = None
+_retry = None
+
+
+def _timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def _import_times():
+    times = {}
+    for name in (*EAGER_IMPORTS, settings.ROOT_URLCONF):
+        # Modules loaded earlier (e.g. by Django setup) cost nothing here
+        times[name] = 0.0 if name in sys.modules else _timed(lambda: importlib.import_module(name))
+    return times
+
+
+def _open_connections():
+    for alias in connections:
+        connections[alias].ensure_connection()
+
+
+def _fill_caches():
+    from .views import meme_count, templates_payload, top_memes_payload
+
+    return {
+        'templates': _timed(templates_payload),
+        'top_memes': _timed(top_memes_payload),
+        'meme_count': _timed(meme_count),
+    }
+
+
+def warm_up(setup=None, keep_connections=True):
+    """Warm this process up and mark it ready. Returns the timing report.
+
+    ``setup`` is the time the entry point spent setting Django up (settings,
+    app registry), reported with the other steps. Concurrent calls wait for
+    the running warm-up instead of repeating it. Without ``keep_connections``
+    the database connections are closed again once the caches are filled, for
+    callers whose thread will not serve requests or whose process may fork.
+    """
+    global _report, _error
+    with _lock:
+        if _ready.is_set():
+            return _report
+        start = time.perf_counter()
+        try:
+            imports = _import_times()
+            steps = {} if setup is None else {'django_setup': setup}
+            steps.update({
+                'imports': sum(imports.values()),
+                'urls': _timed(lambda: get_resolver().reverse_dict),
+                'database': _timed(_open_connections),
+            })
+            caches = _fill_caches()
+            steps['caches'] = sum(caches.values())
+            if not keep_connections:
+                connections.close_all()
+        except Exception as exc:
+            _error = f'{type(exc).__name__}: {exc}'
+            logger.exception('Warm-up failed')
+            raise
+
+        _report = {
+            'total': time.perf_counter() - start,
+            'steps': steps,
+            'imports': imports,
+            'caches': caches,
+            'finished_at': timezone.now().isoformat(),
+        }
+        _error = None
+        _ready.set()
+    logger.info('Warm-up finished', extra={'warmup': _report})
+    return _report
+
+
+def startup(setup=None, keep_connections=True):
+    """Called by the WSGI and ASGI entry points before the worker serves requests.
+
+    A failed warm-up leaves the worker not ready; ``/ready`` retries it.
+    """
+    if not settings.WARMUP_ON_STARTUP:
+        _ready.set()
+        return
+    try:
+        warm_up(setup, keep_connections)
+    except Exception:
+        pass  # logged by warm_up
+
+
+def retry_in_background():
+    """Start warm-up in a thread unless one is already running, and return the thread.
+
+    The readiness probe answers right away instead of waiting for it, so slow
+    warm-ups do not pile up probes that time out.
+    """
+    global _retry
+    with _lock:
+        if _retry is None or not _retry.is_alive():
+            _retry = threading.Thread(target=startup, kwargs={'keep_connections': False},
+                                      name='warmup-retry', daemon=True)
+            _retry.start()
+        return _retry
+
+
+def is_ready():
+    return _ready.is_set()
+
+
+def status():
+    """Readiness and the last warm-up report, for the readiness endpoint."""
+    return {'ready': is_ready(), 'warmup': _report, 'error': _error}
+
+
+def reset():
+    """Forget the warm-up, e.g. between tests."""
+    global _report, _error
+    with _lock:
+        _ready.clear()
+        _report = _error = None
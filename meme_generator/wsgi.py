@@ -8,9 +8,20 @@ https://docs.djangoproject.com/en/5.1/howto/deployment/wsgi/
 """
 
 import os
+import time
 
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'meme_generator.settings')
 
+started = time.perf_counter()
 application = get_wsgi_application()
+setup = time.perf_counter() - started
+
+# Imported after Django is set up. Servers import this module before the
+# worker accepts connections, so requests never reach a cold worker. With
+# gunicorn --preload that happens in the master, whose database connections
+# would be shared by every forked worker, so warm-up closes them again.
+from meme_generator.warmup import startup  # noqa: E402
+
+startup(setup, keep_connections=False)